@@ -0,0 +1,144 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+
+from .matching import Match, MatchConflictGreedySolvingAlgorithm, WorkerEntityExtraction
+from .entity import EntityName
+from .formats import LabelCreator
+from .preprocessing import get_worker_context
+from . import evaluation
+
+class ExtractionAblation:
+    """ Evaluates how the automatic annotation changes if single extractions
+        are left out ("without") or used alone ("only"). The possible 
+        matches of a previous annotation run are reused, only the conflict 
+        resolution and the label creation are repeated for each variant. 
+        Manual changes (post-editing rules) are not applied.
+        
+        Only the positions of the matches and the label and priority of 
+        each extraction are kept, so that the ablation can be sent to 
+        worker processes.
+    """
+    
+    def __init__(self, documents, annotation_type="BIO-2"):
+        """ documents: single documents (not corpora) with tokens, gold labels
+            and the possible matches of the annotation.
+        """
+        self.annotation_type = annotation_type
+        self.extraction_identifiers = []
+        self._extraction_labels_and_priorities = []
+        self._documents = []
+        extraction_index_of_identifier = {}
+        for document in documents:
+            match_tuples = []
+            for match in document.possible_matches:
+                extraction = match.match_entity_name.entity_extraction
+                identifier = extraction.get_identifier()
+                if identifier not in extraction_index_of_identifier:
+                    extraction_index_of_identifier[identifier] = len(self.extraction_identifiers)
+                    self.extraction_identifiers.append(identifier)
+                    self._extraction_labels_and_priorities.append((match.match_entity_name.get_label(), 
+                                                                   extraction.get_property("priority")))
+                match_tuples.append((match.match_start_pos, match.match_end_pos, extraction_index_of_identifier[identifier]))
+            self._documents.append((len(document.tokens), document.gold_labels, match_tuples))
+        self._entity_names = None
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_entity_names"] = None # recreated where needed
+        return state
+    
+    def _get_entity_names(self):
+        """ One stand-in entity name per extraction, providing the label and
+            the priority used by the conflict resolution and label creation.
+        """
+        if self._entity_names is None:
+            self._entity_names = [EntityName(None, "", WorkerEntityExtraction({"priority": priority}, label))
+                                  for label, priority in self._extraction_labels_and_priorities]
+        return self._entity_names
+    
+    def get_variants(self):
+        """ List of (variant, extraction identifier, indices of the used extractions) 
+            with variant "all", "without" or "only". The identifier is None 
+            for "all".
+        """
+        all_indices = frozenset(range(len(self.extraction_identifiers)))
+        variants = [("all", None, all_indices)]
+        for i, identifier in enumerate(self.extraction_identifiers):
+            variants.append(("without", identifier, all_indices - {i}))
+            variants.append(("only", identifier, frozenset([i])))
+        return variants
+    
+    def evaluate_variant(self, used_extraction_indices):
+        """ EvalCounts of all documents if only the matches of the given 
+            extractions are used.
+        """
+        entity_names = self._get_entity_names()
+        counts_list = []
+        for num_tokens, gold_labels, match_tuples in self._documents:
+            matches = [Match(start, end, entity_names[extraction_index]) for start, end, extraction_index in match_tuples 
+                       if extraction_index in used_extraction_indices]
+            MatchConflictGreedySolvingAlgorithm().resolve_conflicts(matches)
+            labels = LabelCreator(self.annotation_type).create(range(num_tokens), matches)
+            counts_list.append(evaluation.evaluate_vectorized(gold_labels, labels))
+        return evaluation.merge_counts(counts_list)
+    
+    def run(self, num_processes=1, status=None):
+        """ Evaluates all variants. Returns a list of (variant, extraction 
+            identifier, overall metrics, metrics by type) in the order of 
+            get_variants. With num_processes > 1, the variants are evaluated 
+            in worker processes, each receiving the ablation once.
+        """
+        variants = self.get_variants()
+        counts_per_variant = [None] * len(variants)
+        if num_processes <= 1 or len(variants) <= 1:
+            for i, (_, _, used_extraction_indices) in enumerate(variants):
+                if not status is None:
+                    status.set_progress(i/len(variants), "Evaluating variant {} of {}.".format(i+1, len(variants)))
+                counts_per_variant[i] = self.evaluate_variant(used_extraction_indices)
+        else:
+            # pickled once, not once per worker
+            pickled_ablation = pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+            pool = get_worker_context().Pool(min(num_processes, len(variants)), initializer=_init_ablation_worker,
+                                             initargs=(pickled_ablation,))
+            try:
+                tasks = [(i, used_extraction_indices) for i, (_, _, used_extraction_indices) in enumerate(variants)]
+                for num_done, (variant_idx, counts) in enumerate(pool.imap_unordered(_evaluate_variant_in_worker, tasks), 1):
+                    counts_per_variant[variant_idx] = counts
+                    if not status is None:
+                        status.set_progress(num_done/len(variants), "Evaluated {} of {} variants.".format(num_done, len(variants)))
+            finally:
+                pool.terminate()
+                pool.join()
+        
+        results = []
+        for (variant, identifier, _), counts in zip(variants, counts_per_variant):
+            overall, by_type = evaluation.metrics(counts)
+            results.append((variant, identifier, overall, by_type))
+        return results
+
+# state of a worker process of ExtractionAblation.run
+_worker_ablation = None
+
+def _init_ablation_worker(pickled_ablation):
+    global _worker_ablation
+    _worker_ablation = pickle.loads(pickled_ablation)
+
+def _evaluate_variant_in_worker(task):
+    variant_idx, used_extraction_indices = task
+    return variant_idx, _worker_ablation.evaluate_variant(used_extraction_indices)
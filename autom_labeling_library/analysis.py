@@ -15,8 +15,17 @@
 # See the Apache 2 License for the specific language governing permissions and
 # limitations under the License.
 
+import heapq
 from collections import Counter
+
 from .formats import LabelConverter
+from .document import Corpus
+from . import evaluation
+
+try:
+    import numpy as np
+except ImportError:
+    np = None # counting falls back to a Counter
 
 class ErrorAnalysis:
     
@@ -24,30 +33,178 @@ class ErrorAnalysis:
         self.outside_label = outside_label
     
     def analyse_errors(self, document, number_most_common_errors):
+        """ The most common token errors, as lists of (Error, count) for
+            precision errors (wrong automatic label) and recall errors 
+            (automatic label is outside label). Errors with the same count
+            are ordered by their first occurence.
+        """
         assert document.tokens is not None
         assert document.autom_labels is not None
         assert document.gold_labels is not None
         assert len(document.tokens) == len(document.autom_labels)
         assert len(document.tokens) == len(document.gold_labels)
         
-        precision_errors = Counter()
-        recall_errors = Counter()
+        # Tokens and labels are encoded as integer ids once. Each distinct 
+        # label is converted to IO format (the B- and I- prefixes should in
+        # most cases not add useful information to this analysis) only once.
         label_converter = LabelConverter()
-        for token, autom_label, gold_label in zip(document.tokens, document.autom_labels, document.gold_labels):
-            
-            # convert to IO format to ignore B- and I- prefixes, 
-            # in most cases should not add useful information to this analyssis
-            autom_label = label_converter.BIO2_to_IO(autom_label)
-            gold_label = label_converter.BIO2_to_IO(gold_label)
-            
-            if autom_label != gold_label:
-                error = Error(token, autom_label, gold_label)
-                if autom_label == self.outside_label:
-                    recall_errors[error] += 1
-                else:
-                    precision_errors[error] += 1
-                
-        return precision_errors.most_common(number_most_common_errors), recall_errors.most_common(number_most_common_errors)
+        io_label_ids = {}
+        io_label_of_label = {}
+        for label in set(document.autom_labels) | set(document.gold_labels):
+            io_label_of_label[label] = io_label_ids.setdefault(label_converter.BIO2_to_IO(label), len(io_label_ids))
+        io_labels = sorted(io_label_ids, key=io_label_ids.get)
+        outside_id = io_label_ids.get(self.outside_label, -1)
+        
+        token_ids = {}
+        token_key = [token_ids.setdefault(token, len(token_ids)) for token in document.tokens]
+        autom_key = [io_label_of_label[label] for label in document.autom_labels]
+        gold_key = [io_label_of_label[label] for label in document.gold_labels]
+        tokens = sorted(token_ids, key=token_ids.get)
+        
+        # one integer key per (token, autom label, gold label)
+        num_labels = len(io_labels)
+        if np is not None:
+            autom_key = np.array(autom_key, dtype=np.int64)
+            gold_key = np.array(gold_key, dtype=np.int64)
+            keys = (np.array(token_key, dtype=np.int64) * num_labels + autom_key) * num_labels + gold_key
+            mismatch = autom_key != gold_key
+            recall = mismatch & (autom_key == outside_id)
+            precision = mismatch & (autom_key != outside_id)
+            precision_counts = self._count_keys_numpy(keys[precision])
+            recall_counts = self._count_keys_numpy(keys[recall])
+        else:
+            precision_counts = Counter()
+            recall_counts = Counter()
+            for token_id, autom_id, gold_id in zip(token_key, autom_key, gold_key):
+                if autom_id != gold_id:
+                    key = (token_id * num_labels + autom_id) * num_labels + gold_id
+                    if autom_id == outside_id:
+                        recall_counts[key] += 1
+                    else:
+                        precision_counts[key] += 1
+        
+        def to_error(key):
+            key, gold_id = divmod(key, num_labels)
+            token_id, autom_id = divmod(key, num_labels)
+            return Error(tokens[token_id], io_labels[autom_id], io_labels[gold_id])
+        
+        return [(to_error(key), count) for key, count in most_common(precision_counts, number_most_common_errors)], \
+               [(to_error(key), count) for key, count in most_common(recall_counts, number_most_common_errors)]
+    
+    def _count_keys_numpy(self, keys):
+        """ Counter of the keys, in the order of their first occurence """
+        unique_keys, first_indices, counts = np.unique(keys, return_index=True, return_counts=True)
+        order = np.argsort(first_indices, kind="stable")
+        return Counter(dict(zip(unique_keys[order].tolist(), counts[order].tolist())))
+    
+    def analyse_span_errors(self, document, number_most_common_errors):
+        """ The most common errors on the level of entity spans (chunks as 
+            in the CoNLL evaluation). Precision errors are automatic spans 
+            that are not a gold span with the same type, recall errors are 
+            gold spans that were not found. The Error contains the tokens of 
+            the span and the types of the automatic and gold span with the 
+            same boundaries (outside label if there is none). For a Corpus,
+            spans end at the document boundaries.
+        """
+        document_offsets = get_document_offsets(document)
+        gold_spans = get_spans(document.gold_labels, document_offsets)
+        autom_spans = get_spans(document.autom_labels, document_offsets)
+        gold_type_of_boundaries = {(start, end): type_ for start, end, type_ in gold_spans}
+        autom_type_of_boundaries = {(start, end): type_ for start, end, type_ in autom_spans}
+        gold_spans_set = set(gold_spans)
+        autom_spans_set = set(autom_spans)
+        tokens = document.tokens
+        
+        # counted by (span text, autom type, gold type), Error objects are 
+        # only created for the most common ones
+        precision_errors = Counter((" ".join(tokens[start:end]), type_, gold_type_of_boundaries.get((start, end), self.outside_label))
+                                   for start, end, type_ in autom_spans if (start, end, type_) not in gold_spans_set)
+        recall_errors = Counter((" ".join(tokens[start:end]), autom_type_of_boundaries.get((start, end), self.outside_label), type_)
+                                for start, end, type_ in gold_spans if (start, end, type_) not in autom_spans_set)
+        
+        return [(Error(*key), count) for key, count in most_common(precision_errors, number_most_common_errors)], \
+               [(Error(*key), count) for key, count in most_common(recall_errors, number_most_common_errors)]
+    
+    def analyse_errors_by_extraction(self, document, number_most_common_errors):
+        """ For each extraction, the number of selected matches that do 
+            not correspond to a gold span with the same type (i.e. 
+            precision errors caused by the entity names of the extraction).
+            Returns a list of (extraction identifier, number of wrong matches,
+            number of matches) with the most wrong matches first.
+        """
+        if document.matches is None:
+            return []
+        
+        gold_spans = set(get_spans(document.gold_labels, get_document_offsets(document)))
+        wrong_matches = Counter()
+        all_matches = Counter()
+        for match in document.matches:
+            extraction_identifier = match.match_entity_name.entity_extraction.get_identifier()
+            all_matches[extraction_identifier] += 1
+            if (match.match_start_pos, match.match_end_pos, match.match_entity_name.get_label()) not in gold_spans:
+                wrong_matches[extraction_identifier] += 1
+        
+        return [(extraction_identifier, count, all_matches[extraction_identifier]) 
+                for extraction_identifier, count in most_common(wrong_matches, number_most_common_errors)]
+
+def most_common(counter, number):
+    """ Like Counter.most_common, but selects the top elements with a heap
+        instead of sorting all of them. Ties keep the order of the counter.
+    """
+    items = heapq.nlargest(number, enumerate(counter.items()), key=lambda item: (item[1][1], -item[0]))
+    return [item for _, item in items]
+
+def get_document_offsets(document):
+    """ The positions where the documents of a Corpus start, 
+        (0,) for a single Document
+    """
+    if isinstance(document, Corpus):
+        return document.get_document_offsets()
+    return (0,)
+
+def get_spans(labels, document_offsets=(0,)):
+    """ The chunks in the labels as (start, end, type) tuples with the
+        end excluded, determined as in the CoNLL evaluation. If the
+        labels are those of several concatenated documents, 
+        document_offsets are the positions where the documents start, 
+        no chunk spans two documents.
+    """
+    # whether a chunk ends/starts only depends on the previous and the 
+    # current label, so this is decided once per pair of labels
+    boundaries = {}
+    def get_boundary(last_label, label):
+        last_tag, last_type = evaluation.parse_tag(last_label)
+        tag, type_ = evaluation.parse_tag(label)
+        boundary = (evaluation.end_of_chunk(last_tag, tag, last_type, type_), 
+                    evaluation.start_of_chunk(last_tag, tag, last_type, type_), type_)
+        boundaries[(last_label, label)] = boundary
+        return boundary
+    
+    spans = []
+    chunk_start = None
+    chunk_type = None
+    last_label = "O"
+    document_starts = iter(document_offsets)
+    next_document_start = next(document_starts, None)
+    for i, label in enumerate(labels):
+        while next_document_start is not None and next_document_start <= i: # several for empty documents
+            if chunk_start is not None:
+                spans.append((chunk_start, i, chunk_type))
+                chunk_start = None
+            last_label = "O"
+            next_document_start = next(document_starts, None)
+        boundary = boundaries.get((last_label, label)) or get_boundary(last_label, label)
+        chunk_end, chunk_starts, type_ = boundary
+        if chunk_end and chunk_start is not None:
+            spans.append((chunk_start, i, chunk_type))
+            chunk_start = None
+        if chunk_starts:
+            chunk_start = i
+            chunk_type = type_
+        last_label = label
+    if chunk_start is not None:
+        spans.append((chunk_start, len(labels), chunk_type))
+    return spans
 
 class Error:
     
@@ -62,8 +219,8 @@ class Error:
         return False
         
     def __hash__(self):
-        return hash(self.token) + hash(self.autom_label) + hash(self.gold_label)
+        # a tuple hash, the order of the elements matters (swapped labels are different errors)
+        return hash((self.token, self.autom_label, self.gold_label))
         
     def __str__(self):
         return f"Error({self.token}|Pred:{self.autom_label}|Gold:{self.gold_label})"
-
@@ -0,0 +1,297 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Annotates a directory of documents with saved extractions without
+    running the server. E.g.
+
+    python -m autom_labeling_library.batch --extractions instance/extraction_en-PER-Q5-1_config.pkl \
+        --input-dir texts/ --output-dir annotated/ --language en
+
+    Instead of single configuration files, an instance directory or the
+    database of the SQLite backend (anea.sqlite) can be given, then all 
+    active extractions stored there are used. The preprocessing settings
+    of the instance (tokenizer language, lemmatization, removal of 
+    diacritics) are used unless they are given as arguments. Each input 
+    file is written as CoNLL file (token, gold label if the input is in 
+    CoNLL format, automatic label) to the output directory, named like 
+    the input file (relative to the input directory) plus ".conll". 
+    Progress and throughput are reported on stderr.
+"""
+
+import os
+import io
+import sys
+import glob
+import time
+import pickle
+import argparse
+import itertools
+import multiprocessing
+
+from .document import DocumentRawFormat
+from .entity import EntityNameCollection, EntityObject
+from .matching import MatchingAlgorithm, MatchConflictGreedySolvingAlgorithm
+from .formats import LabelCreator, CoNLLFormatCreator, CoNLLFormatParser
+from .preprocessing import Preprocessing, remove_diacritics
+from . import extract_storage
+from .sqlite_store import SQLiteStore
+
+SQLITE_FILE_NAME = "anea.sqlite" # default database of the SQLite backend in the instance directory
+
+def load_extraction(config_path):
+    """ Loads a WikiDataNameExtraction and its extracts from the
+        files stored by the server (extraction_<identifier>_config.pkl
+        and the corresponding extracts file).
+    """
+    if not config_path.endswith("_config.pkl"):
+        raise Exception(f"{config_path} is not an extraction configuration file (extraction_<identifier>_config.pkl).")
+    with open(config_path, "rb") as input_file:
+        extraction = pickle.load(input_file)
+
+    extracts_path = config_path[:-len("_config.pkl")] + "_extracts.bin"
+    legacy_extracts_path = config_path[:-len("_config.pkl")] + "_extracts.pkl"
+    if os.path.isfile(extracts_path):
+        extraction._extracts = extract_storage.load_extracts(extracts_path, extraction)
+    elif os.path.isfile(legacy_extracts_path):
+        with open(legacy_extracts_path, "rb") as input_file:
+            extraction._extracts = pickle.load(input_file)
+        for entity_name in itertools.chain(extraction._extracts["labels"], extraction._extracts["aliases"]):
+            entity_name.entity_extraction = extraction
+            entity_name.entity_object = EntityObject.get_instance(entity_name.entity_object.identifier)
+    else:
+        raise Exception(f"No extracts found for {config_path}.")
+    return extraction
+
+def load_extractions_from_store(db_path):
+    """ Loads the active extractions stored in the database of the 
+        SQLite backend. Their names are read from the database.
+    """
+    store = SQLiteStore(db_path)
+    extractions = []
+    for identifier in store.get_extraction_identifiers():
+        extraction = store.load_extraction_config(identifier)
+        if extraction.get_property("active"):
+            extraction._extracts = store.load_extracts(identifier, extraction)
+            extractions.append(extraction)
+    return extractions
+
+def load_extractions(paths):
+    """ Loads the extractions of the given configuration files, SQLite
+        databases and instance directories (the active extractions
+        stored there, as files or in the database).
+    """
+    extractions = []
+    for path in paths:
+        if os.path.isdir(path):
+            config_paths = sorted(glob.glob(os.path.join(path, "extraction_*_config.pkl")))
+            db_path = os.path.join(path, SQLITE_FILE_NAME)
+            if len(config_paths) == 0 and os.path.isfile(db_path):
+                extractions.extend(load_extractions_from_store(db_path))
+            for config_path in config_paths:
+                with open(config_path, "rb") as input_file:
+                    if pickle.load(input_file).get_property("active"):
+                        extractions.append(load_extraction(config_path))
+        elif path.endswith(".sqlite"):
+            extractions.extend(load_extractions_from_store(path))
+        else:
+            extraction = load_extraction(path)
+            extraction.set_property("active", True) # explicitly given
+            extractions.append(extraction)
+    return extractions
+
+class _StoredSettings:
+    """ The settings of an instance, see _SettingsUnpickler """
+    pass
+
+class _SettingsUnpickler(pickle.Unpickler):
+    """ Unpickles the settings stored by the server without importing it """
+    def find_class(self, module, name):
+        if module == "server.memory" and name == "Settings":
+            return _StoredSettings
+        return super().find_class(module, name)
+
+def _load_settings_pickle(data):
+    return _SettingsUnpickler(io.BytesIO(data)).load()
+
+def load_instance_settings(paths):
+    """ The settings stored in the instance of the first given path
+        (instance directory, SQLite database or configuration file) 
+        or None if there are none.
+    """
+    path = paths[0]
+    if path.endswith(".sqlite") and os.path.isfile(path):
+        return SQLiteStore(path).load_value("settings", loads=_load_settings_pickle)
+    
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    settings_path = os.path.join(directory, "settings.pkl")
+    if os.path.isfile(settings_path):
+        with open(settings_path, "rb") as input_file:
+            return _load_settings_pickle(input_file.read())
+    db_path = os.path.join(directory, SQLITE_FILE_NAME)
+    if os.path.isfile(db_path):
+        return SQLiteStore(db_path).load_value("settings", loads=_load_settings_pickle)
+    return None
+
+def _apply_instance_settings(arguments):
+    """ Preprocessing arguments that are not given are taken from the
+        settings of the instance (as the server would preprocess) or
+        set to the defaults.
+    """
+    settings = load_instance_settings(arguments.extractions)
+    if settings is not None:
+        print("Using the preprocessing settings of the instance.", file=sys.stderr)
+    if arguments.language is None:
+        arguments.language = getattr(settings, "spacy_tokenizer_language_code", "whitespace")
+    if arguments.entity_name_language is None:
+        if getattr(settings, "use_language_specific_tokenizer_for_entity_names", False):
+            arguments.entity_name_language = arguments.language
+        else:
+            arguments.entity_name_language = "whitespace"
+    if arguments.lemmatize is None:
+        arguments.lemmatize = getattr(settings, "lemmatize", False)
+    if arguments.remove_diacritics is None:
+        arguments.remove_diacritics = getattr(settings, "remove_diacritics", False)
+
+# state of the annotation, created once in the main process before the
+# worker processes are forked so that they share the entity names
+_matching_algorithm = None
+_tokenizer = None
+_lemmatizer = None
+_arguments = None
+
+def _prepare(arguments):
+    global _matching_algorithm, _tokenizer, _lemmatizer, _arguments
+    _arguments = arguments
+
+    entity_name_tokenizer = Preprocessing.create_tokenizer(arguments.entity_name_language)
+    entity_names = []
+    for extraction in load_extractions(arguments.extractions):
+        entity_names.extend(extraction.iter_extracts_for_matching(entity_name_tokenizer))
+        print(f"Loaded extraction {extraction.get_identifier()}, {len(entity_names)} entity names in total.", file=sys.stderr)
+
+    if len(entity_names) == 0:
+        raise Exception("No entity names found. Could not annotate.")
+
+    _matching_algorithm = MatchingAlgorithm(EntityNameCollection(entity_names))
+    if arguments.lemmatize:
+        _lemmatizer = Preprocessing.create_lemmatizer(arguments.language)
+        if _lemmatizer is None:
+            raise Exception(f"Lemmatization is not supported for language {arguments.language}.")
+    if DocumentRawFormat(arguments.format) == DocumentRawFormat.SIMPLE_TEXT:
+        _tokenizer = Preprocessing.create_tokenizer(arguments.language) # also lemmatizes
+
+def get_output_path(input_path):
+    """ The input file name (relative to the input directory, including 
+        its extension, so a.txt and a.conll do not collide) plus .conll
+    """
+    relative_path = os.path.relpath(input_path, _arguments.input_dir)
+    return os.path.join(_arguments.output_dir, relative_path + ".conll")
+
+def annotate_file(input_path):
+    """ Annotates one input file and writes the CoNLL output.
+        Returns the number of tokens and of matches.
+    """
+    raw_format = DocumentRawFormat(_arguments.format)
+    gold_labels = None
+    with open(input_path, "r", encoding="utf-8") as input_file:
+        if raw_format == DocumentRawFormat.SIMPLE_TEXT:
+            tokens = _tokenizer.tokenize(input_file.read(), lemmatize=_arguments.lemmatize)
+        else:
+            document = CoNLLFormatParser().parse_lines(input_file, raw_format)
+            tokens = document.tokens
+            gold_labels = document.gold_labels
+            if _arguments.lemmatize:
+                tokens = _lemmatizer.lemmatize(tokens)
+
+    if _arguments.remove_diacritics:
+        tokens = [remove_diacritics(token) for token in tokens]
+
+    matches = _matching_algorithm.match_tokens(tokens)
+    MatchConflictGreedySolvingAlgorithm().resolve_conflicts(matches)
+    autom_labels = LabelCreator(_arguments.annotation_type).create(tokens, matches)
+
+    output_path = get_output_path(input_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True) # the pattern can match files in subdirectories
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        output_file.writelines(CoNLLFormatCreator(_arguments.annotation_type).iter_lines(tokens, gold_labels, autom_labels))
+    return len(tokens), len(matches)
+
+def _print_progress(num_done, num_total, num_tokens, time_start):
+    duration = max(time.time() - time_start, 1e-6)
+    bar_length = 30
+    filled = int(bar_length * num_done / max(num_total, 1))
+    print("\r[{}{}] {}/{} documents, {:.1f} documents/s, {:.0f} tokens/s".format(
+          "#" * filled, "." * (bar_length - filled), num_done, num_total,
+          num_done / duration, num_tokens / duration), end="", file=sys.stderr, flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Annotate documents with saved ANEA extractions.")
+    parser.add_argument("--extractions", nargs="+", required=True,
+                        help="extraction configuration files (extraction_<identifier>_config.pkl), SQLite databases or instance directories")
+    parser.add_argument("--input-dir", required=True, help="directory with the documents to annotate")
+    parser.add_argument("--output-dir", required=True, help="directory for the CoNLL outputs")
+    parser.add_argument("--pattern", default="*", help="file name pattern of the input documents (default: all files)")
+    parser.add_argument("--format", default=DocumentRawFormat.SIMPLE_TEXT.value,
+                        choices=[raw_format.value for raw_format in DocumentRawFormat])
+    parser.add_argument("--language", help="tokenizer language for simple text input (e.g. en), default: from the instance or whitespace")
+    parser.add_argument("--entity-name-language", help="tokenizer language for the entity names, default: from the instance or whitespace")
+    parser.add_argument("--lemmatize", action="store_true", default=None)
+    parser.add_argument("--no-lemmatize", action="store_false", dest="lemmatize")
+    parser.add_argument("--remove-diacritics", action="store_true", default=None)
+    parser.add_argument("--no-remove-diacritics", action="store_false", dest="remove_diacritics")
+    parser.add_argument("--annotation-type", default="BIO-2", choices=["BIO-2", "IO"])
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    arguments = parser.parse_args(argv)
+
+    input_paths = sorted(path for path in glob.glob(os.path.join(arguments.input_dir, arguments.pattern)) if os.path.isfile(path))
+    os.makedirs(arguments.output_dir, exist_ok=True)
+
+    _apply_instance_settings(arguments)
+    _prepare(arguments)
+
+    time_start = time.time()
+    num_done = num_tokens = num_matches = 0
+    if arguments.processes > 1 and "fork" in multiprocessing.get_all_start_methods():
+        # forked workers share the entity name index with the main process
+        context = multiprocessing.get_context("fork")
+        pool = context.Pool(arguments.processes)
+        results = pool.imap_unordered(annotate_file, input_paths, chunksize=4)
+    else:
+        pool = None
+        results = map(annotate_file, input_paths)
+
+    try:
+        for document_num_tokens, document_num_matches in results:
+            num_done += 1
+            num_tokens += document_num_tokens
+            num_matches += document_num_matches
+            _print_progress(num_done, len(input_paths), num_tokens, time_start)
+    except BaseException: # e.g. a failed document or Ctrl+C, do not wait for the remaining documents
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    duration = time.time() - time_start
+    print(f"\nAnnotated {num_done} documents ({num_tokens} tokens, {num_matches} matches) in {duration:.1f}s.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
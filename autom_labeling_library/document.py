@@ -15,21 +15,229 @@
 # See the Apache 2 License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
+from array import array
 from enum import Enum
 
+from .post_editing import PostEditingRules
+
 class Document:
     
-    def __init__(self, raw_text, document_raw_format):
-        self.raw_text = raw_text
+    def __init__(self, raw_text, document_raw_format, raw_text_path=None):
+        self.raw_text = raw_text # None if the raw text is only kept on disk (raw_text_path)
+        self.raw_text_path = raw_text_path
         self.document_raw_format = document_raw_format
         self.tokens = None
         self.autom_labels = None
         self.matches = None # matches select by the conflict resolving algorithm
         self.possible_matches = None # all possible matches
         self.gold_labels = None
+        self.post_editing_rules = PostEditingRules() # manual changes of the autom_labels
+        self._token_positions = None # token -> positions, built on first use
+        self._token_positions_ignore_case = None
+        self._token_positions_tokens = None # tokens for which the indexes were built
+    
+    def get_token_positions(self, token, ignore_case=False):
+        """ The positions (sorted) at which the token occurs, 
+            looked up in an index from token to positions.
+        """
+        if self._token_positions_tokens is not self.tokens:
+            # built again if the tokens were replaced
+            self._token_positions = None
+            self._token_positions_ignore_case = None
+            self._token_positions_tokens = self.tokens
+        
+        if ignore_case:
+            if self._token_positions_ignore_case is None:
+                self._token_positions_ignore_case = self._build_token_positions(lambda token: token.lower())
+            return self._token_positions_ignore_case.get(token.lower(), ())
+        if self._token_positions is None:
+            self._token_positions = self._build_token_positions(lambda token: token)
+        return self._token_positions.get(token, ())
+    
+    def _build_token_positions(self, normalize):
+        token_positions = {}
+        for i, token in enumerate(self.tokens):
+            normalized_token = normalize(token)
+            if normalized_token not in token_positions:
+                token_positions[normalized_token] = array("q")
+            token_positions[normalized_token].append(i)
+        return token_positions
+    
+    def get_raw_text(self):
+        """ The raw text, read from disk if it is not kept in memory """
+        if self.raw_text is None and self.raw_text_path is not None:
+            with open(self.raw_text_path, "r", encoding="utf-8") as input_file:
+                return input_file.read()
+        return self.raw_text
         
 class DocumentRawFormat(Enum):
     SIMPLE_TEXT = "simple_text"
     CONLL_TAB = "conll_tab"
     CONLL_SPACE = "conll_space"
 
+
+class Corpus:
+    """ Several documents of the same type (e.g. many uploaded files).
+        Each document is stored, tokenized and annotated on its own.
+        Offers the attributes of a Document (tokens, gold_labels, 
+        autom_labels, matches, possible_matches) as views over all 
+        documents as if they were concatenated, so code that works 
+        on a single Document also works on a Corpus.
+    """
+    
+    def __init__(self):
+        self.documents = []
+        self.document_names = []
+        self._matches_cache = (None, None, None) # match lists of the documents, matches, possible_matches
+    
+    def add_document(self, name, document):
+        self.documents.append(document)
+        self.document_names.append(name)
+    
+    def _get_concatenated(self, attribute):
+        """ None if the attribute is not set for all documents """
+        lists = [getattr(document, attribute) for document in self.documents]
+        if len(lists) == 0 or any(values is None for values in lists):
+            return None
+        return ConcatenatedList(lists)
+    
+    def _set_split(self, attribute, values):
+        """ Distributes the values over the documents according to their lengths """
+        if values is None:
+            for document in self.documents:
+                setattr(document, attribute, None)
+            return
+        values = list(values)
+        assert len(values) == sum(len(document.tokens) for document in self.documents)
+        start = 0
+        for document in self.documents:
+            setattr(document, attribute, values[start:start+len(document.tokens)])
+            start += len(document.tokens)
+    
+    @property
+    def tokens(self):
+        return self._get_concatenated("tokens")
+    
+    @property
+    def gold_labels(self):
+        return self._get_concatenated("gold_labels")
+    
+    @gold_labels.setter
+    def gold_labels(self, gold_labels):
+        self._set_split("gold_labels", gold_labels)
+    
+    @property
+    def autom_labels(self):
+        return self._get_concatenated("autom_labels")
+    
+    @autom_labels.setter
+    def autom_labels(self, autom_labels):
+        self._set_split("autom_labels", autom_labels)
+    
+    def get_token_positions(self, token, ignore_case=False):
+        """ The positions of the token in the concatenated tokens """
+        positions = []
+        for document, offset in zip(self.documents, self.get_document_offsets()):
+            positions.extend(offset + position for position in document.get_token_positions(token, ignore_case))
+        return positions
+    
+    def locate(self, position):
+        """ The document containing the token at the position in the
+            concatenated tokens and the position within this document
+        """
+        offsets = self.get_document_offsets()
+        document_idx = bisect.bisect_right(offsets, position) - 1
+        return self.documents[document_idx], position - offsets[document_idx]
+    
+    def get_document_offsets(self):
+        """ Position of the first token of each document in the concatenated tokens """
+        offsets = []
+        offset = 0
+        for document in self.documents:
+            offsets.append(offset)
+            offset += len(document.tokens)
+        return offsets
+    
+    def _get_shifted_matches(self):
+        """ Matches of all documents with positions in the concatenated tokens.
+            Matches and possible matches share the same objects (as for
+            a single Document), they are cached until a document changes.
+            The cache keeps the match lists of the documents it was created 
+            from and is only used if the documents still have the same 
+            lists (compared by identity).
+        """
+        from .matching import Match # avoid circular import
+        
+        key = [(document.matches, document.possible_matches) for document in self.documents]
+        cached_key = self._matches_cache[0]
+        if cached_key is not None and len(cached_key) == len(key) and \
+           all(matches is cached_matches and possible_matches is cached_possible_matches 
+               for (matches, possible_matches), (cached_matches, cached_possible_matches) in zip(key, cached_key)):
+            return self._matches_cache[1], self._matches_cache[2]
+        
+        if len(self.documents) == 0 or any(document.matches is None for document in self.documents):
+            self._matches_cache = (key, None, None)
+            return None, None
+        
+        shifted_matches = {} # id of original match -> shifted match
+        def shift(match, offset):
+            if id(match) not in shifted_matches:
+                shifted_matches[id(match)] = Match(match.match_start_pos + offset, match.match_end_pos + offset, 
+                                                   match.match_entity_name)
+            return shifted_matches[id(match)]
+        
+        matches = []
+        possible_matches = []
+        for document, offset in zip(self.documents, self.get_document_offsets()):
+            matches.extend(shift(match, offset) for match in document.matches)
+            possible_matches.extend(shift(match, offset) for match in document.possible_matches)
+        self._matches_cache = (key, matches, possible_matches)
+        return matches, possible_matches
+    
+    @property
+    def matches(self):
+        return self._get_shifted_matches()[0]
+    
+    @property
+    def possible_matches(self):
+        return self._get_shifted_matches()[1]
+
+class ConcatenatedList:
+    """ A list-like view of several lists as if they were concatenated.
+        Changing an element changes the underlying list.
+    """
+    
+    def __init__(self, lists):
+        self._lists = lists
+        self._offsets = [0]
+        for values in lists:
+            self._offsets.append(self._offsets[-1] + len(values))
+    
+    def __len__(self):
+        return self._offsets[-1]
+    
+    def _locate(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("ConcatenatedList index out of range")
+        list_idx = bisect.bisect_right(self._offsets, idx) - 1
+        return list_idx, idx - self._offsets[list_idx]
+    
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        list_idx, position = self._locate(idx)
+        return self._lists[list_idx][position]
+    
+    def __setitem__(self, idx, value):
+        list_idx, position = self._locate(idx)
+        self._lists[list_idx][position] = value
+    
+    def __iter__(self):
+        for values in self._lists:
+            yield from values
+    
+    def __eq__(self, other):
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
@@ -15,6 +15,9 @@
 # See the Apache 2 License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+import weakref
+
 try:
     from fuzzywuzzy import fuzz
     FUZZY_THRESHOLD = 75
@@ -22,14 +25,58 @@ try:
 except ImportError:
     print('Install package \'fuzzywuzzy\' to enable fuzzy string matching (optional).')
 
+def get_slots_state(obj):
+    """ Pickle state of an object that uses __slots__ (a dict of
+        the attributes that are set).
+    """
+    return {slot: getattr(obj, slot) for slot in type(obj).__slots__ 
+            if slot != "__weakref__" and hasattr(obj, slot)}
+
+def set_slots_state(obj, state):
+    """ Restores the state created by get_slots_state(). Also accepts
+        the state of objects pickled before __slots__ were used
+        (the instance __dict__) and the default state of
+        slotted objects (a tuple (dict, slots dict)).
+    """
+    if isinstance(state, tuple):
+        dict_state, slots_state = state
+        state = dict(dict_state or {})
+        state.update(slots_state or {})
+    for key, value in state.items():
+        setattr(obj, key, value)
+
 class EntityObject:
     """
         Representing an entity in the underlying knowledge-base.
         E.g. 
+        
+        The same entity can be part of several extractions (e.g. Q5 humans
+        and a subclass of it). Use get_instance() to obtain an EntityObject
+        that is shared between all extractions instead of creating a new one.
     """
     
+    __slots__ = ("identifier", "__weakref__") # many instances exist, no per-instance __dict__
+    
+    _instances = weakref.WeakValueDictionary() # identifier -> EntityObject, as long as it is used
+    
     def __init__(self, identifier):
         self.identifier = identifier
+    
+    def __getstate__(self):
+        return get_slots_state(self)
+    
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+    
+    @staticmethod
+    def get_instance(identifier):
+        """ Returns the shared EntityObject for this identifier.
+        """
+        entity_object = EntityObject._instances.get(identifier)
+        if entity_object is None:
+            entity_object = EntityObject(sys.intern(identifier))
+            EntityObject._instances[entity_object.identifier] = entity_object
+        return entity_object
         
     def __str__(self):
         return "EntityObject({})".format(self.identifier)
@@ -39,9 +86,11 @@ class EntityName:
         Representing a name/string that refers to an entity in the knowledge-base.
     """
     
+    __slots__ = ("entity_object", "name", "tokenized_name", "entity_extraction") # many instances exist, no per-instance __dict__
+    
     def __init__(self, entity_object, name, entity_extraction):
         self.entity_object = entity_object
-        self.name = name # original name as extracted from the Knowledge Base
+        self.name = sys.intern(name) # original name as extracted from the Knowledge Base, interned as names recur across extractions
         self.tokenized_name = None # Is set by WikiDataNameExtraction when applying the properties
         #self.named_entity_type = named_entity_type # TODO Check constructor
         self.entity_extraction = entity_extraction # TODO Not all objects might have this set already
@@ -49,6 +98,12 @@ class EntityName:
         # TODO do preprocessing on the names (e.g. stemming) when converting
         # to tokenization
     
+    def __getstate__(self):
+        return get_slots_state(self)
+    
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+    
     def get_label(self):
         return self.entity_extraction.get_label()
         
@@ -93,6 +148,20 @@ class EntityName:
     def matches_token_equality_function_ignore_all_casing(this_token, other_token):
         return this_token.lower() == other_token.lower()
         
+    @staticmethod
+    def normalize_tokens(tokens, match_casing_property):
+        """ Returns a tuple of the tokens normalized so that two token lists
+            match (see matches_tokens) if and only if their normalized tuples 
+            are equal. Returns None for fuzzy matching where this is not possible.
+        """
+        if match_casing_property == "exact":
+            return tuple(tokens)
+        elif match_casing_property == "ignore_first_character":
+            return tuple(token[:1].lower() + token[1:] for token in tokens)
+        elif match_casing_property == "ignore_all":
+            return tuple(token.lower() for token in tokens)
+        return None
+        
     @staticmethod
     def matches_token_equality_function_fuzzy(this_token, other_token):
         if fuzz.partial_ratio(this_token, other_token) >= FUZZY_THRESHOLD:
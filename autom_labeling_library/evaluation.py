@@ -33,6 +33,11 @@ import re
 
 from collections import defaultdict, namedtuple
 
+try:
+    import numpy as np
+except ImportError:
+    np = None # evaluate_vectorized falls back to evaluate
+
 ANY_SPACE = '<SPACE>'
 
 class FormatError(Exception):
@@ -57,13 +62,33 @@ def parse_tag(t):
     m = re.match(r'^([^-]*)-(.*)$', t)
     return m.groups() if m else (t, '')
 
+# state between two tokens: the previous labels and whether the current chunk is correct until now
+EvalState = namedtuple('EvalState', 'last_correct_label last_guessed_label in_correct')
+INITIAL_STATE = EvalState('O', 'O', False)
+
 def evaluate(correct_labels, guessed_labels, options=None):
+    counts, state = evaluate_block(correct_labels, guessed_labels)
+    finish_counts(counts, state)
+    return counts
+
+def finish_counts(counts, state):
+    """ Counts the chunk that is still open after the last token """
+    if state.in_correct:
+        last_correct_type = parse_tag(state.last_correct_label)[1]
+        counts.correct_chunk += 1
+        counts.t_correct_chunk[last_correct_type] += 1
+
+def evaluate_block(correct_labels, guessed_labels, state=INITIAL_STATE):
+    """ Evaluates a part of the labels, continuing from the state after 
+        the previous part. Returns the counts (without the chunk still 
+        open at the end, see finish_counts) and the state after the part.
+    """
     counts = EvalCounts()
-    in_correct = False        # currently processed chunks is correct until now
-    last_correct = 'O'        # previous chunk tag in corpus
-    last_correct_type = ''    # type of previously identified chunk tag
-    last_guessed = 'O'        # previously identified chunk tag
-    last_guessed_type = ''    # type of previous chunk tag in corpus
+    in_correct = state.in_correct   # currently processed chunks is correct until now
+    last_correct, last_correct_type = parse_tag(state.last_correct_label) # previous chunk tag in corpus and its type
+    last_guessed, last_guessed_type = parse_tag(state.last_guessed_label) # previously identified chunk tag and its type
+    last_correct_label = state.last_correct_label
+    last_guessed_label = state.last_guessed_label
 
     for correct_label, guessed_label in zip(correct_labels, guessed_labels):
 
@@ -105,13 +130,107 @@ def evaluate(correct_labels, guessed_labels, options=None):
         last_correct = correct
         last_guessed_type = guessed_type
         last_correct_type = correct_type
+        last_correct_label = correct_label
+        last_guessed_label = guessed_label
 
-    if in_correct:
-        counts.correct_chunk += 1
-        counts.t_correct_chunk[last_correct_type] += 1
+    return counts, EvalState(last_correct_label, last_guessed_label, in_correct)
 
+def evaluate_vectorized(correct_labels, guessed_labels):
+    """ Same counts as evaluate, but computed with NumPy on integer
+        arrays (see evaluate_block_vectorized).
+    """
+    counts, state = evaluate_block_vectorized(correct_labels, guessed_labels)
+    finish_counts(counts, state)
     return counts
 
+def evaluate_block_vectorized(correct_labels, guessed_labels, state=INITIAL_STATE):
+    """ Same as evaluate_block, but computed with NumPy on integer arrays.
+        Each distinct label is parsed only once; whether a chunk starts or 
+        ends between two tokens is looked up in tables over all pairs of 
+        distinct labels. Falls back to evaluate_block if NumPy is not
+        installed.
+    """
+    if np is None:
+        return evaluate_block(correct_labels, guessed_labels, state)
+
+    counts = EvalCounts()
+    n = min(len(correct_labels), len(guessed_labels))
+    if n == 0:
+        return counts, state
+
+    # label ids, the arrays start with the labels before the first token
+    label_ids = {}
+    correct = np.fromiter((label_ids.setdefault(label, len(label_ids)) for label in _prefixed(state.last_correct_label, correct_labels, n)), 
+                          dtype=np.int64, count=n+1)
+    guessed = np.fromiter((label_ids.setdefault(label, len(label_ids)) for label in _prefixed(state.last_guessed_label, guessed_labels, n)), 
+                          dtype=np.int64, count=n+1)
+
+    # per distinct label: parsed tag and type (as ids)
+    labels = sorted(label_ids, key=label_ids.get)
+    parsed = [parse_tag(label) for label in labels]
+    type_names = sorted(set(type_ for _, type_ in parsed))
+    type_ids = {type_: i for i, type_ in enumerate(type_names)}
+    parse_ids = {}
+    label_type = np.array([type_ids[type_] for _, type_ in parsed], dtype=np.int64)
+    label_parse = np.array([parse_ids.setdefault(tag_and_type, len(parse_ids)) for tag_and_type in parsed], dtype=np.int64)
+    start_table = np.array([[start_of_chunk(prev_tag, tag, prev_type, type_) for tag, type_ in parsed] 
+                            for prev_tag, prev_type in parsed], dtype=bool)
+    end_table = np.array([[end_of_chunk(prev_tag, tag, prev_type, type_) for tag, type_ in parsed] 
+                          for prev_tag, prev_type in parsed], dtype=bool)
+
+    # per token (index i refers to token i, its predecessor is at i in the prefixed arrays)
+    start_correct = start_table[correct[:-1], correct[1:]]
+    start_guessed = start_table[guessed[:-1], guessed[1:]]
+    end_correct = end_table[correct[:-1], correct[1:]]
+    end_guessed = end_table[guessed[:-1], guessed[1:]]
+    correct_type = label_type[correct[1:]]
+    guessed_type = label_type[guessed[1:]]
+    last_correct_type = label_type[correct[:-1]]
+    last_guessed_type = label_type[guessed[:-1]]
+
+    # The chunk state machine of evaluate: a chunk that started correctly 
+    # (start_both) is counted at the first following token where both 
+    # chunks end with the same type (count) unless they diverged before.
+    start_both = start_correct & start_guessed & (guessed_type == correct_type)
+    count = end_correct & end_guessed & (last_guessed_type == last_correct_type)
+    stop = count | (end_correct != end_guessed) | (guessed_type != correct_type)
+
+    # in a correct chunk before a token: the last start is after the last stop.
+    # A chunk that is correct before the block counts as start at position -1.
+    positions = np.arange(n)
+    last_start = np.maximum.accumulate(np.where(start_both, positions, -1 if state.in_correct else -2)) # up to and including each token
+    last_stop = np.maximum.accumulate(np.where(stop, positions, -1))
+    in_correct_before = np.empty(n, dtype=bool)
+    in_correct_before[0] = state.in_correct
+    in_correct_before[1:] = last_start[:-1] >= last_stop[:-1]
+
+    counted = count & in_correct_before
+    num_types = len(type_names)
+    t_correct_chunk = np.bincount(last_correct_type[counted], minlength=num_types)
+    t_found_correct = np.bincount(correct_type[start_correct], minlength=num_types)
+    t_found_guessed = np.bincount(guessed_type[start_guessed], minlength=num_types)
+
+    counts.correct_chunk = int(t_correct_chunk.sum())
+    counts.found_correct = int(t_found_correct.sum())
+    counts.found_guessed = int(t_found_guessed.sum())
+    counts.correct_tags = int(np.count_nonzero(label_parse[correct[1:]] == label_parse[guessed[1:]]))
+    counts.token_counter = n
+    for by_type_counts, by_type in [(t_correct_chunk, counts.t_correct_chunk),
+                                    (t_found_correct, counts.t_found_correct),
+                                    (t_found_guessed, counts.t_found_guessed)]:
+        for type_id in np.flatnonzero(by_type_counts):
+            by_type[type_names[type_id]] = int(by_type_counts[type_id])
+    
+    final_state = EvalState(labels[correct[-1]], labels[guessed[-1]], bool(last_start[-1] >= last_stop[-1]))
+    return counts, final_state
+
+def _prefixed(first_label, labels, n):
+    """ first_label followed by the first n labels """
+    yield first_label
+    for i, label in enumerate(labels):
+        if i == n:
+            break
+        yield label
 
 def calculate_metrics(correct, guessed, total):
     tp, fp, fn = correct, guessed-correct, total-correct
@@ -120,6 +239,24 @@ def calculate_metrics(correct, guessed, total):
     f = 0 if p + r == 0 else 2 * p * r / (p + r)
     return Metrics(tp, fp, fn, p, r, f)
 
+def merge_counts(counts_list):
+    """ Sums the counts of several documents that were evaluated
+        separately (chunks do not continue across documents).
+    """
+    merged = EvalCounts()
+    for c in counts_list:
+        merged.correct_chunk += c.correct_chunk
+        merged.correct_tags += c.correct_tags
+        merged.found_correct += c.found_correct
+        merged.found_guessed += c.found_guessed
+        merged.token_counter += c.token_counter
+        for merged_by_type, by_type in [(merged.t_correct_chunk, c.t_correct_chunk),
+                                        (merged.t_found_correct, c.t_found_correct),
+                                        (merged.t_found_guessed, c.t_found_guessed)]:
+            for t, count in by_type.items():
+                merged_by_type[t] += count
+    return merged
+
 def metrics(counts):
     c = counts
     overall = calculate_metrics(
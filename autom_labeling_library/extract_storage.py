@@ -0,0 +1,269 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import mmap
+import struct
+import itertools
+from array import array
+from collections import OrderedDict
+from threading import Lock
+
+from .entity import EntityObject, EntityName
+
+# Columnar storage of the extracts (EntityName objects) of a
+# WikiDataNameExtraction. Instead of pickling millions of EntityName
+# objects, the names, the identifiers of the entity objects and
+# per-name flags are stored in flat columns:
+#
+# header:          magic, number of names, number of labels, number of
+#                  entity objects, byte length of name and entity string data
+# name_offsets:    uint64[num_names+1], offsets into the name string data
+# entity_indices:  uint32[num_names], index of the entity object of each name
+# flags:           uint8[num_names], FLAG_ALIAS if the name is an alias
+# entity_offsets:  uint64[num_entities+1], offsets into the entity string data
+# name_data:       utf-8 encoded names
+# entity_data:     utf-8 encoded identifiers of the entity objects (e.g. Q42)
+#
+# Labels are stored first, then aliases. The file is memory-mapped
+# when loading so that no Python objects need to be created until
+# a name is actually accessed. All numbers are little-endian.
+
+MAGIC = b"ANEAEXT1"
+HEADER_FORMAT = "<8sQQQQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+FLAG_ALIAS = 1
+
+DECODED_CACHE_SIZE = 65536 # EntityName objects kept per view after they were decoded
+DECODING_BATCH_SIZE = 4096 # names decoded at once when iterating
+
+def _padded(length):
+    """ Sections start at multiples of 8 bytes """
+    return (length + 7) // 8 * 8
+
+def _get_section_offsets(num_names, num_entities, name_data_length):
+    name_offsets_start = HEADER_SIZE
+    entity_indices_start = name_offsets_start + _padded(8 * (num_names + 1))
+    flags_start = entity_indices_start + _padded(4 * num_names)
+    entity_offsets_start = flags_start + _padded(num_names)
+    name_data_start = entity_offsets_start + _padded(8 * (num_entities + 1))
+    entity_data_start = name_data_start + _padded(name_data_length)
+    return name_offsets_start, entity_indices_start, flags_start, entity_offsets_start, name_data_start, entity_data_start
+
+def _little_endian_bytes(numbers):
+    if sys.byteorder != "little":
+        numbers = array(numbers.typecode, numbers)
+        numbers.byteswap()
+    return numbers.tobytes()
+
+def write_extracts(file_path, extracts):
+    """ Writes the extracts (a map of two lists of EntityName objects,
+        "labels" and "aliases") in the columnar format to the given file.
+        The data is first written to a temporary file that then replaces
+        the given file. This way, a file that is currently memory-mapped
+        is not changed and an interrupted write does not leave a broken file.
+    """
+    name_offsets = array("Q", [0])
+    entity_indices = array("I")
+    flags = bytearray()
+    name_data = bytearray()
+    entity_offsets = array("Q", [0])
+    entity_data = bytearray()
+    entity_index_of_identifier = {}
+
+    num_labels = len(extracts["labels"])
+    for i, entity_name in enumerate(itertools.chain(extracts["labels"], extracts["aliases"])):
+        name_data += entity_name.name.encode("utf-8")
+        name_offsets.append(len(name_data))
+
+        identifier = entity_name.entity_object.identifier
+        if identifier not in entity_index_of_identifier:
+            entity_index_of_identifier[identifier] = len(entity_index_of_identifier)
+            entity_data += identifier.encode("utf-8")
+            entity_offsets.append(len(entity_data))
+        entity_indices.append(entity_index_of_identifier[identifier])
+        flags.append(FLAG_ALIAS if i >= num_labels else 0)
+
+    num_names = len(entity_indices)
+    num_entities = len(entity_index_of_identifier)
+    section_offsets = _get_section_offsets(num_names, num_entities, len(name_data))
+    sections = [_little_endian_bytes(name_offsets), _little_endian_bytes(entity_indices), flags,
+                _little_endian_bytes(entity_offsets), name_data, entity_data]
+
+    temp_file_path = file_path + ".tmp"
+    with open(temp_file_path, "wb") as output_file:
+        output_file.write(struct.pack(HEADER_FORMAT, MAGIC, num_names, num_labels, num_entities,
+                                      len(name_data), len(entity_data)))
+        for section_offset, section in zip(section_offsets, sections):
+            output_file.write(b"\0" * (section_offset - output_file.tell()))
+            output_file.write(section)
+        output_file.flush()
+        os.fsync(output_file.fileno())
+    os.replace(temp_file_path, file_path)
+
+class ColumnarExtracts:
+    """ Read-only, memory-mapped access to extracts stored with write_extracts.
+    """
+
+    def __init__(self, file_path):
+        with open(file_path, "rb") as input_file:
+            self._mmap = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.num_names, self.num_labels, num_entities, name_data_length, entity_data_length = \
+            struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+        if magic != MAGIC:
+            raise Exception(f"File {file_path} is not in the columnar extracts format.")
+
+        name_offsets_start, entity_indices_start, flags_start, entity_offsets_start, \
+            self._name_data_start, self._entity_data_start = _get_section_offsets(self.num_names, num_entities, name_data_length)
+
+        self._name_offsets = self._get_numbers("Q", name_offsets_start, self.num_names + 1)
+        self._entity_indices = self._get_numbers("I", entity_indices_start, self.num_names)
+        self._flags = memoryview(self._mmap)[flags_start:flags_start + self.num_names]
+        self._entity_offsets = self._get_numbers("Q", entity_offsets_start, num_entities + 1)
+
+    def _get_numbers(self, typecode, start, length):
+        item_size = array(typecode).itemsize
+        data = memoryview(self._mmap)[start:start + item_size * length]
+        if sys.byteorder == "little":
+            return data.cast(typecode)
+        numbers = array(typecode, data.tobytes()) # no zero-copy access on big-endian systems
+        numbers.byteswap()
+        return numbers
+
+    def __len__(self):
+        return self.num_names
+
+    def get_name(self, idx):
+        start = self._name_data_start + self._name_offsets[idx]
+        end = self._name_data_start + self._name_offsets[idx+1]
+        return self._mmap[start:end].decode("utf-8")
+
+    def get_entity_identifier(self, idx):
+        entity_idx = self._entity_indices[idx]
+        start = self._entity_data_start + self._entity_offsets[entity_idx]
+        end = self._entity_data_start + self._entity_offsets[entity_idx+1]
+        return self._mmap[start:end].decode("utf-8")
+
+    def is_alias(self, idx):
+        return self._flags[idx] & FLAG_ALIAS != 0
+
+    def get_entity_name(self, idx, entity_extraction):
+        return EntityName(EntityObject.get_instance(self.get_entity_identifier(idx)), self.get_name(idx), entity_extraction)
+    
+    def get_entity_names(self, start, end, entity_extraction):
+        """ EntityName objects of the names start to end (excluded). The
+            name data of the range is read from the file at once.
+        """
+        if start >= end:
+            return []
+        name_offsets = self._name_offsets
+        first_offset = name_offsets[start]
+        data = self._mmap[self._name_data_start + first_offset:self._name_data_start + name_offsets[end]]
+        return [EntityName(EntityObject.get_instance(self.get_entity_identifier(idx)),
+                           data[name_offsets[idx] - first_offset:name_offsets[idx+1] - first_offset].decode("utf-8"),
+                           entity_extraction)
+                for idx in range(start, end)]
+
+class EntityNameListView:
+    """ A list-like view of a range of names in ColumnarExtracts.
+        EntityName objects are only created when they are accessed.
+        The most recently accessed ones (at most DECODED_CACHE_SIZE) are 
+        kept, so repeated accesses (e.g. previews) return the same objects
+        without decoding them again. Names added after loading (via append) 
+        are kept in a normal list behind the stored ones.
+    """
+
+    def __init__(self, columnar_extracts, start, end, entity_extraction):
+        self._columnar_extracts = columnar_extracts
+        self._start = start
+        self._end = end
+        self._entity_extraction = entity_extraction
+        self._appended = []
+        self._decoded = OrderedDict() # position in the view -> EntityName, least recently used first
+        self._lock_decoded = Lock()
+
+    def __len__(self):
+        return self._end - self._start + len(self._appended)
+    
+    def _get_stored(self, start, end):
+        """ The EntityName objects of the stored names start to end (positions
+            in the view). Names that are not cached are decoded in batches.
+        """
+        with self._lock_decoded:
+            entity_names = [self._decoded.get(idx) for idx in range(start, end)]
+            i = 0
+            while i < len(entity_names):
+                if entity_names[i] is not None:
+                    self._decoded.move_to_end(start + i)
+                    i += 1
+                    continue
+                j = i
+                while j < len(entity_names) and entity_names[j] is None:
+                    j += 1
+                entity_names[i:j] = self._columnar_extracts.get_entity_names(self._start + start + i, self._start + start + j, 
+                                                                             self._entity_extraction)
+                for k in range(i, j):
+                    self._decoded[start + k] = entity_names[k]
+                i = j
+            while len(self._decoded) > DECODED_CACHE_SIZE:
+                self._decoded.popitem(last=False)
+        return entity_names
+
+    def __getitem__(self, idx):
+        num_stored = self._end - self._start
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step == 1 and start < stop:
+                return self._get_stored(min(start, num_stored), min(stop, num_stored)) + \
+                       self._appended[max(start - num_stored, 0):max(stop - num_stored, 0)]
+            return [self[i] for i in range(start, stop, step)]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("EntityNameListView index out of range")
+        if idx < num_stored:
+            return self._get_stored(idx, idx + 1)[0]
+        return self._appended[idx - num_stored]
+
+    def __iter__(self):
+        num_stored = self._end - self._start
+        for batch_start in range(0, num_stored, DECODING_BATCH_SIZE):
+            yield from self._get_stored(batch_start, min(batch_start + DECODING_BATCH_SIZE, num_stored))
+        yield from self._appended
+
+    def append(self, entity_name):
+        self._appended.append(entity_name)
+    
+    def get_entity_names_in_memory(self):
+        """ The EntityName objects that are currently kept in memory
+            (decoded or appended), e.g. to estimate the memory usage
+        """
+        with self._lock_decoded:
+            return list(self._decoded.values()) + self._appended
+
+def load_extracts(file_path, entity_extraction):
+    """ Memory-maps the extracts stored in the given file and returns
+        them in the same structure as WikiDataNameExtraction._extracts.
+        All EntityName objects refer to the given entity_extraction.
+    """
+    columnar_extracts = ColumnarExtracts(file_path)
+    return {"labels": EntityNameListView(columnar_extracts, 0, columnar_extracts.num_labels, entity_extraction),
+            "aliases": EntityNameListView(columnar_extracts, columnar_extracts.num_labels,
+                                          columnar_extracts.num_names, entity_extraction)}
@@ -15,6 +15,8 @@
 # See the Apache 2 License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+
 from .document import Document, DocumentRawFormat
 
 class LabelCreator:
@@ -115,16 +117,26 @@ class CoNLLFormatCreator:
         self.new_line = new_line
     
     def create(self, tokens, gold_labels=None, autom_labels=None):               
-        output = ""
-        for i, token in enumerate(tokens):
-            output += "{}".format(token)
-            if gold_labels is not None:
-                output += "{}{}".format(self.separator, gold_labels[i])
-            if autom_labels is not None:
-                output += "{}{}".format(self.separator, autom_labels[i])
-            output += self.new_line
-            
-        return output
+        return "".join(self.iter_lines(tokens, gold_labels, autom_labels))
+    
+    def iter_lines(self, tokens, gold_labels=None, autom_labels=None):
+        """ Returns an iterator over the output lines (including the new 
+            line) so that large documents can be written or sent without
+            creating the whole output in memory. Raises an exception 
+            (directly, not while iterating) if the labels do not have the 
+            same length as the tokens.
+        """
+        columns = [tokens]
+        if gold_labels is not None:
+            columns.append(gold_labels)
+        if autom_labels is not None:
+            columns.append(autom_labels)
+        
+        if any(len(column) != len(tokens) for column in columns):
+            raise Exception("The tokens and labels have different lengths ({}), can not create the output.".format(
+                            ", ".join(str(len(column)) for column in columns)))
+        
+        return (self.separator.join(str(value) for value in values) + self.new_line for values in zip(*columns))
 
 class CoNLLFormatParser:
     """
@@ -138,14 +150,20 @@ class CoNLLFormatParser:
         self.new_line = new_line
 
     def parse(self, raw_text, raw_format, label_type="gold"):
+        return self.parse_lines(raw_text.split(self.new_line), raw_format, label_type, raw_text)
+    
+    def parse_lines(self, lines, raw_format, label_type="gold", raw_text=None):
+        """ Parses any iterable of lines, e.g. an opened file, without 
+            needing the whole raw text in memory. raw_text is only stored 
+            in the returned Document. Tokens and labels are interned as 
+            the same strings occur many times in a corpus.
+        """
         if raw_format == DocumentRawFormat.CONLL_SPACE:
             separator = " "
         elif raw_format == DocumentRawFormat.CONLL_TAB:
             separator = "\t"
         else:
             raise Exception(f"Raw format {raw_format} not supported for CoNLL parsing.")
-         
-        lines = raw_text.split(self.new_line)
         
         tokens = []
         labels = []
@@ -167,9 +185,9 @@ class CoNLLFormatParser:
                 
             elements = line.split(separator)
             
-            tokens.append(elements[0])
+            tokens.append(sys.intern(elements[0]))
             if len(elements) > 1:
-                labels.append(elements[-1])
+                labels.append(sys.intern(elements[-1]))
         
         document = Document(raw_text, raw_format)
         document.tokens = tokens
@@ -0,0 +1,71 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+
+from . import evaluation
+
+class IncrementalEvaluation:
+    """ Caches the evaluation counts of a document in blocks of tokens.
+        When labels are changed (e.g. by post-editing), only the blocks
+        containing the changed positions are evaluated again. The 
+        evaluation of a block continues from the state at the end of the 
+        previous block, so the result is identical to evaluating the whole
+        document. If the state at the end of a re-evaluated block changed,
+        the following block is evaluated again as well.
+        
+        The cache is only valid for the given label lists. All changes
+        to them need to be reported via labels_changed.
+    """
+    
+    def __init__(self, gold_labels, autom_labels, block_size=10000):
+        self.gold_labels = gold_labels
+        self.autom_labels = autom_labels
+        self.block_size = block_size
+        self._num_tokens = min(len(gold_labels), len(autom_labels))
+        num_blocks = max(1, (self._num_tokens + block_size - 1) // block_size)
+        self._block_counts = [None] * num_blocks # None if the block needs to be evaluated
+        self._block_end_states = [None] * num_blocks
+        
+    def is_valid_for(self, gold_labels, autom_labels):
+        """ False if the labels were replaced (e.g. by a new annotation) """
+        return gold_labels is self.gold_labels and autom_labels is self.autom_labels and \
+               min(len(gold_labels), len(autom_labels)) == self._num_tokens
+    
+    def labels_changed(self, start, end):
+        """ The labels of the tokens [start, end) changed """
+        for block_idx in range(max(0, start // self.block_size), 
+                               min(len(self._block_counts), (end - 1) // self.block_size + 1)):
+            self._block_counts[block_idx] = None
+    
+    def get_counts(self):
+        """ The EvalCounts of the whole document """
+        state = evaluation.INITIAL_STATE
+        for block_idx in range(len(self._block_counts)):
+            if self._block_counts[block_idx] is None:
+                start = block_idx * self.block_size
+                end = min(start + self.block_size, self._num_tokens)
+                counts, end_state = evaluation.evaluate_block_vectorized(self.gold_labels[start:end], 
+                                                                         self.autom_labels[start:end], state)
+                if block_idx + 1 < len(self._block_counts) and end_state != self._block_end_states[block_idx]:
+                    self._block_counts[block_idx + 1] = None # continues from a different state
+                self._block_counts[block_idx] = counts
+                self._block_end_states[block_idx] = end_state
+            state = self._block_end_states[block_idx]
+        
+        counts = evaluation.merge_counts(self._block_counts)
+        evaluation.finish_counts(counts, state)
+        return counts
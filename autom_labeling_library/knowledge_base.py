@@ -15,6 +15,8 @@
 # See the Apache 2 License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import sys
 import pickle
 import json
 import itertools
@@ -43,6 +45,8 @@ class WikiDataNameExtraction:
         self._extracts = {"labels":[], "aliases":[]} # a map of two lists of EntityName objects, labels and aliases
         
         self._properties_changed = True
+        self._extracts_changed = False # marks if extracts were added since the extracts were last saved
+        self._compiled_filter_list = None # set of normalized filter items, created on demand, see _get_compiled_filter_list
         
         if self._depth > 0:
             # this will query WikiData to get the subclasses for the entity
@@ -53,6 +57,30 @@ class WikiDataNameExtraction:
         else:
             self._all_instances = [self._instance_of_property]
     
+    def __getstate__(self):
+        """ Only the configuration is pickled, the extracts are stored separately
+            (see extract_storage).
+        """
+        state = self.__dict__.copy()
+        state["_extracts"] = None
+        state["_extracts_changed"] = False
+        state["_compiled_filter_list"] = None
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._extracts_changed = False # also for configurations pickled by older versions
+        self._compiled_filter_list = None
+    
+    def update_configuration(self, other_extraction):
+        """ Takes over the configuration (identifier, properties, ...)
+            of the other extraction object, keeps the own extracts.
+        """
+        extracts = self._extracts
+        self.__setstate__(other_extraction.__getstate__())
+        self._extracts = extracts
+        self._properties_changed = True
+    
     def get_identifier(self):
         return self._identifier
     
@@ -109,6 +137,7 @@ class WikiDataNameExtraction:
     def set_property(self, key, value):
         self._properties[key] = value
         self._properties_changed = True
+        self._compiled_filter_list = None
         
     def get_property(self, key, default=None):
         if key not in self._properties:
@@ -128,6 +157,15 @@ class WikiDataNameExtraction:
             self._extracts["aliases"].append(entity_name)
         
         self._properties_changed = True
+        self._extracts_changed = True
+    
+    def clear_entity_names(self):
+        """
+        Remove all EntityName objects from the list of extracts
+        """
+        self._extracts = {"labels":[], "aliases":[]}
+        self._properties_changed = True
+        self._extracts_changed = True
     
     def _get_used_extracts(self):
         
@@ -140,58 +178,99 @@ class WikiDataNameExtraction:
         else:
             return self._extracts["labels"]
     
-    def _tokenize_entity_names(self, entity_names, tokenizer):
-        for entity_name in entity_names:
-            entity_name.tokenized_name = tokenizer.tokenize(entity_name.name)
-            entity_name.tokenized_name = [token for token in entity_name.tokenized_name if len(token) > 0] # some entitites have multiple whitespaces between tokens resulting in zero length tokens
+    def _tokenize_entity_name(self, entity_name, tokenizer):
+        entity_name.tokenized_name = tokenizer.tokenize(entity_name.name)
+        entity_name.tokenized_name = [sys.intern(token) for token in entity_name.tokenized_name if len(token) > 0] # some entitites have multiple whitespaces between tokens resulting in zero length tokens
     
-    def _remove_diacritis(self, entity_names):
+    def _remove_diacritis(self, entity_name):
         # remove diacritics for all tokens
-        for entity_name in entity_names:
-            entity_name.tokenized_name = [remove_diacritics(token) for token in entity_name.tokenized_name]
+        entity_name.tokenized_name = [sys.intern(remove_diacritics(token)) for token in entity_name.tokenized_name]
     
     def get_extracts_for_matching(self, tokenizer, num_examples=-1):
+        return list(self.iter_extracts_for_matching(tokenizer, num_examples))
+    
+    def iter_extracts_for_matching(self, tokenizer, num_examples=-1):
+        """ Returns an iterator over the EntityName objects of this extraction
+            prepared for matching (tokenized and filtered according to the
+            properties). Names are only prepared when they are requested,
+            so for a preview (num_examples != -1) only the first few names
+            are tokenized.
+        """
         example_mode = num_examples != -1
         
         if not self._properties["active"] and not example_mode: # do not return empty list for examples
-            return []
+            return iter([])
         
-        # TODO optimize for less memory footprint, do functional generator approach
-                
-        selected_extracts = list(self._get_used_extracts())  #itertools.islice(selected_extracts,0,num_examples) 
+        if not example_mode:
+            self._properties_changed = False
         
-        if num_examples > -1: # if num_examples > -1, we just want a couple of examples for the preview, otherwise full list
-            selected_extracts = selected_extracts[:num_examples]# TODO fancier returns, dove-tailing labels and aliases, randomly picking, etc.  
+        selected_extracts = self._prepare_extracts_for_matching(tokenizer, example_mode)
+        if example_mode: # we just want a couple of examples for the preview, otherwise all
+            selected_extracts = itertools.islice(selected_extracts, num_examples) # TODO fancier returns, dove-tailing labels and aliases, randomly picking, etc.  
+        return selected_extracts
+    
+    def _get_compiled_filter_list(self):
+        """ Returns the filter list as a set of token tuples normalized
+            according to the match_casing property, so that a name can be 
+            checked with one lookup. Returns None if the filter list 
+            can not be compiled (fuzzy matching).
+        """
+        if self._compiled_filter_list is None:
+            match_casing = self._properties.get("match_casing")
+            if EntityName.normalize_tokens([], match_casing) is None:
+                return None
+            self._compiled_filter_list = set(EntityName.normalize_tokens(filter_item, match_casing) 
+                                             for filter_item in self._properties.get("filter_list"))
+        return self._compiled_filter_list
+    
+    def _prepare_extracts_for_matching(self, tokenizer, example_mode):
+        minimum_length = self._properties.get("minimum_length")
+        remove_diacritics_property = self._properties.get("remove_diacritics")
+        split_tokens = self._properties.get("split_tokens")
+        filter_list = self._properties.get("filter_list")
         
-        self._tokenize_entity_names(selected_extracts, tokenizer)
+        def is_selected(entity_name):
+            """ Filters that only need the name are checked before tokenization """
+            return minimum_length == -1 or len(entity_name.name) >= minimum_length
         
-        print(self._properties.get("remove_diacritics", "Bling"))
-        if self._properties.get("remove_diacritics"):
-            print("removing diacricits")
-            self._remove_diacritis(selected_extracts)
+        compiled_filter_list = self._get_compiled_filter_list()
+        match_casing = self._properties.get("match_casing")
         
-        if self._properties.get("split_tokens"):
-            new_selected_extracts = []
-            for entity_name in selected_extracts:
-                if entity_name.token_length() > 1:
-                    new_selected_extracts.extend(entity_name.create_split_token_objects())
-            self._tokenize_entity_names(new_selected_extracts, tokenizer)
-            selected_extracts.extend(new_selected_extracts)
-
         def matches_filter_list(entity_name):
-            for filter_item in self._properties.get("filter_list"):
+            if compiled_filter_list is not None:
+                return EntityName.normalize_tokens(entity_name.tokenized_name, match_casing) in compiled_filter_list
+            for filter_item in filter_list:
                 if entity_name.matches_tokens(filter_item):
                     return True
             return False
-
-        if self._properties.get("minimum_length") != -1:
-            selected_extracts = filter(lambda extract: len(extract.name) >= self._properties.get("minimum_length"), selected_extracts)
-        selected_extracts = filter(lambda extract: not matches_filter_list(extract), selected_extracts)
+        
+        # split token objects come after all other names (order matters for
+        # solving match conflicts), except for previews
+        new_selected_extracts = []
+        for entity_name in self._get_used_extracts():
+            if not is_selected(entity_name): # then none of its split tokens is selected either
+                continue
             
-        if not example_mode:
-            self._properties_changed = False
+            self._tokenize_entity_name(entity_name, tokenizer)
+            if remove_diacritics_property:
+                self._remove_diacritis(entity_name)
+            
+            if not matches_filter_list(entity_name):
+                yield entity_name
+            
+            if split_tokens and entity_name.token_length() > 1:
+                for split_entity_name in entity_name.create_split_token_objects():
+                    if not is_selected(split_entity_name):
+                        continue
+                    self._tokenize_entity_name(split_entity_name, tokenizer)
+                    if matches_filter_list(split_entity_name):
+                        continue
+                    if example_mode:
+                        yield split_entity_name
+                    else:
+                        new_selected_extracts.append(split_entity_name)
         
-        return list(selected_extracts)
+        yield from new_selected_extracts
 
 class WikiDataExtractor:
     
@@ -200,12 +279,16 @@ class WikiDataExtractor:
         
     def extract(self, wiki_data_name_extractions, status=None):
         # TODO Parallelize
+        num_bytes_total = max(1, os.path.getsize(self.wikidata_path))
+        num_bytes_read = 0
         with open(self.wikidata_path, "r") as input_file:
             
             for i, line in enumerate(input_file):
+                num_bytes_read += len(line) # characters, only an estimate of the bytes for the progress
                 
-                if not status is None and i % 10000 == 0:
-                    status.set_message(f"Extraction in progress. Checked {i} entries of the knowledge base")
+                if not status is None and i % 1000 == 0:
+                    status.set_progress(min(1, num_bytes_read / num_bytes_total), 
+                                        f"Extraction in progress. Checked {i} entries of the knowledge base")
                 
                 line = line[:-2] # remove newline and , after object definition
                 
@@ -222,7 +305,7 @@ class WikiDataExtractor:
                     # check if object is instance of this extraction id/property
                     if self.obj_is_instance_of(json_obj, extraction):
                         obj_identifier = json_obj["id"]
-                        entity_obj = EntityObject(obj_identifier) 
+                        entity_obj = EntityObject.get_instance(obj_identifier) # shared between extractions
                         label = self.get_label(json_obj, extraction.get_language_code())
                         aliases = self.get_aliases(json_obj, extraction.get_language_code())
                         
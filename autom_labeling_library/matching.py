@@ -15,8 +15,15 @@
 # See the Apache 2 License for the specific language governing permissions and
 # limitations under the License.
 
+import pickle
+
+from .entity import EntityName, EntityNameCollection, get_slots_state, set_slots_state
+from .preprocessing import get_worker_context
+
 class Match:
     
+    __slots__ = ("match_start_pos", "match_end_pos", "match_entity_name") # many instances exist, no per-instance __dict__
+    
     def __init__(self, match_start_pos, match_end_pos, match_entity_name):
         """
         match_start_pos: Start of the match (index starting with 0, included)
@@ -26,6 +33,12 @@ class Match:
         self.match_end_pos = match_end_pos
         self.match_entity_name = match_entity_name
         
+    def __getstate__(self):
+        return get_slots_state(self)
+    
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+    
     def length(self):
         return self.match_end_pos - self.match_start_pos
         
@@ -45,7 +58,7 @@ class MatchingAlgorithm:
         
         for i in range(len(tokens)):
             if not status is None and i % 100 == 0:
-                status.set_message("Performing matching. Checked {}% of the text.".format(int(i/len(tokens)*100)))
+                status.set_progress(i/len(tokens), "Performing matching. Checked {}% of the text.".format(int(i/len(tokens)*100)))
             
             for entity_name in self.entity_name_collection.get_possible_entity_names(tokens[i]): # Only use a subset of all entities (those that start with the same letter as the current token)
                 if entity_name.token_length() > len(tokens) - i: # Near end of document, rest of tokens can be shorter than entity
@@ -56,6 +69,81 @@ class MatchingAlgorithm:
                     
         return matches
     
+    def match_documents(self, token_lists, num_processes=1, status=None):
+        """ Matches each list of tokens (e.g. the documents of a corpus) on 
+            its own. Returns one list of matches per token list.
+            With num_processes > 1, the token lists are distributed over 
+            worker processes. They are not forked from this process (which
+            might run other threads, e.g. the server), they only receive
+            what matching needs: the tokenized names and the casing 
+            property of the entity names. The workers only send back 
+            positions and the index of the matched EntityName.
+        """
+        if num_processes <= 1 or len(token_lists) <= 1:
+            matches_per_document = []
+            for i, tokens in enumerate(token_lists):
+                if not status is None:
+                    status.set_progress(i/len(token_lists), "Performing matching. Matched {} of {} documents.".format(i, len(token_lists)))
+                matches_per_document.append(self.match_tokens(tokens))
+            return matches_per_document
+        
+        entity_names = self.entity_name_collection.entity_names
+        # pickled once, not once per worker
+        worker_entity_names = pickle.dumps([(entity_name.tokenized_name, entity_name.entity_extraction.get_property("match_casing"))
+                                            for entity_name in entity_names], protocol=pickle.HIGHEST_PROTOCOL)
+        matches_per_document = [None] * len(token_lists)
+        pool = get_worker_context().Pool(min(num_processes, len(token_lists)), initializer=_init_matching_worker, 
+                                         initargs=(worker_entity_names,))
+        try:
+            for num_done, (document_idx, match_tuples) in enumerate(pool.imap_unordered(_match_document_in_worker, 
+                                                                                        enumerate(token_lists)), 1):
+                matches_per_document[document_idx] = [Match(start, end, entity_names[entity_name_idx]) 
+                                                      for start, end, entity_name_idx in match_tuples]
+                if not status is None:
+                    status.set_progress(num_done/len(token_lists), "Performing matching. Matched {} of {} documents.".format(num_done, len(token_lists)))
+        finally:
+            pool.terminate()
+            pool.join()
+        return matches_per_document
+
+class WorkerEntityExtraction:
+    """ Stands in for the extraction of the entity names in a worker 
+        process, only the properties (and the label) needed there are known.
+    """
+    def __init__(self, properties, label=None):
+        self._properties = properties
+        self._label = label
+    
+    def get_property(self, key):
+        return self._properties[key]
+    
+    def get_label(self):
+        return self._label
+
+# state of a worker process of match_documents
+_worker_matching_algorithm = None
+_worker_entity_name_indices = None # id of EntityName -> position in the entity name collection
+
+def _init_matching_worker(worker_entity_names):
+    global _worker_matching_algorithm, _worker_entity_name_indices
+    extractions = {}
+    entity_names = []
+    for tokenized_name, match_casing in pickle.loads(worker_entity_names):
+        if match_casing not in extractions:
+            extractions[match_casing] = WorkerEntityExtraction({"match_casing": match_casing})
+        entity_name = EntityName(None, "", extractions[match_casing])
+        entity_name.tokenized_name = tokenized_name
+        entity_names.append(entity_name)
+    # the names are already in the order of the collection (the sort is stable), 
+    # so the positions are the same as in the calling process
+    _worker_matching_algorithm = MatchingAlgorithm(EntityNameCollection(entity_names))
+    _worker_entity_name_indices = {id(entity_name): i for i, entity_name in enumerate(entity_names)}
+
+def _match_document_in_worker(document_idx_and_tokens):
+    document_idx, tokens = document_idx_and_tokens
+    return document_idx, [(match.match_start_pos, match.match_end_pos, _worker_entity_name_indices[id(match.match_entity_name)])
+                          for match in _worker_matching_algorithm.match_tokens(tokens)]
+    
 class MatchConflictGreedySolvingAlgorithm:
     """
         Solves the conflicts arrising from
@@ -71,11 +159,13 @@ class MatchConflictGreedySolvingAlgorithm:
             be sorted by match.match_start_pos.
         """
                 
-        i = 0 # using explicit index, because matches are changed inplace
+        # the kept matches are collected in a new list instead of removing the
+        # conflicting ones from matches, which would be quadratic
+        resolved = []
+        i = 0
         while i < len(matches):
             current_match = matches[i]
             
-            conflicting = []
             conflict_end_pos = current_match.match_end_pos
             j = i+1
             # each match that starts at a position within the current_match
@@ -83,7 +173,6 @@ class MatchConflictGreedySolvingAlgorithm:
             # matches[j].match_start_pos > current_match.match_start_pos
             # is guaranteed because list of matches must be sorted.
             while j < len(matches) and matches[j].match_start_pos < conflict_end_pos:
-                conflicting.append(matches[j])
                 # one of the conflicting matches can itself conflict with other matches
                 # include all in this conflicting. E.g. if current_match is "A", it conflicts
                 # with "A B" and then "B" is added as well.
@@ -91,9 +180,10 @@ class MatchConflictGreedySolvingAlgorithm:
                 j += 1
             
             # if there are conflicts
-            if len(conflicting) > 0:
+            if j > i+1:
 
                 # find longest match
+                conflicting = matches[i+1:j]
                 conflicting.append(current_match)
                 longest_match_length = max([match.length() for match in conflicting])
                 longest_matches = [match for match in conflicting if match.length() == longest_match_length]
@@ -103,11 +193,12 @@ class MatchConflictGreedySolvingAlgorithm:
                 else:
                     longest_match = max(longest_matches, key=lambda match: match.match_entity_name.entity_extraction.get_property("priority"))
 
-                # longest match is saved from deletion
-                conflicting.remove(longest_match) 
-                
-                # remove the conflicting matches
-                for conflict in conflicting:
-                    matches.remove(conflict)
+                # only the longest match is kept
+                resolved.append(longest_match)
+            else:
+                resolved.append(current_match)
             
-            i += 1 
+            # all matches up to j were part of this conflict
+            i = j
+        
+        matches[:] = resolved
@@ -0,0 +1,77 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+
+class PostEditingRules:
+    """ The manual changes of the automatic labels of a document, stored 
+        as rules so that they can be applied again after the document was
+        annotated again (e.g. with changed extractions). Two kinds of rules:
+        
+        token rule: all occurences of a token with label current_label 
+                    (or any label if None) get new_label
+        position rule: the token at a position gets new_label
+        
+        The rules are applied in the order in which they were added.
+    """
+    
+    def __init__(self):
+        self.rules = [] # tuples ("token", token, current_label, new_label, ignore_case) or ("position", position, new_label)
+    
+    def __len__(self):
+        return len(self.rules)
+    
+    def add_token_rule(self, token, current_label, new_label, ignore_case=False):
+        self.rules.append(("token", token, current_label, new_label, ignore_case))
+    
+    def add_position_rule(self, position, new_label):
+        # an earlier change of the same position is overwritten anyway
+        self.rules = [rule for rule in self.rules if not (rule[0] == "position" and rule[1] == position)]
+        self.rules.append(("position", position, new_label))
+    
+    def clear(self):
+        self.rules = []
+    
+    def apply(self, document):
+        """ Applies the rules to the automatic labels of the document in 
+            one pass. The positions of the rules are collected first (token 
+            rules via the token index of the document), then each of these 
+            positions is visited once and its rules are applied in order 
+            to its label. Returns the changed positions.
+        """
+        autom_labels = document.autom_labels
+        rules_at_position = {} # position -> [(current_label, new_label), ...] in the order of the rules
+        for rule in self.rules:
+            if rule[0] == "token":
+                _, token, current_label, new_label, ignore_case = rule
+                positions = document.get_token_positions(token, ignore_case)
+            else:
+                _, position, new_label = rule
+                current_label = None
+                positions = [position] if position < len(autom_labels) else []
+            for i in positions:
+                rules_at_position.setdefault(i, []).append((current_label, new_label))
+        
+        changed_positions = []
+        for i, position_rules in rules_at_position.items():
+            label = autom_labels[i]
+            for current_label, new_label in position_rules:
+                if current_label is None or label == current_label:
+                    label = new_label
+            if label != autom_labels[i]:
+                autom_labels[i] = label
+                changed_positions.append(i)
+        return sorted(changed_positions)
@@ -17,6 +17,10 @@
 
 import importlib.util
 import unicodedata
+import re
+import os
+import multiprocessing
+from collections import deque
 
 # not all version might have Spacy installed
 if not importlib.util.find_spec("spacy") is None:
@@ -31,6 +35,39 @@ def remove_diacritics(token):
     nfkd_form = unicodedata.normalize('NFKD', token)
     return u"".join([c for c in nfkd_form if not unicodedata.combining(c)])
 
+# boundaries at which a long text can be split for tokenization, from
+# coarse to fine: paragraphs (empty lines), sentences and finally any whitespace
+TEXT_SPLIT_PATTERNS = [re.compile(r"\n\s*\n"), re.compile(r"(?<=[.!?])\s+"), re.compile(r"\s+")]
+
+def iter_text_chunks(text, max_chunk_length, split_pattern_idx=0):
+    """ Yields consecutive chunks of the text that are (if possible) at most
+        max_chunk_length characters long. The text is only split at 
+        paragraph boundaries. If a paragraph is too long, it is split at 
+        sentence boundaries and then at whitespace. The separating whitespace 
+        stays at the end of the preceding chunk, so concatenating all 
+        chunks returns the original text.
+    """
+    if len(text) <= max_chunk_length:
+        yield text
+        return
+    
+    if split_pattern_idx == len(TEXT_SPLIT_PATTERNS):
+        yield text # no boundary left to split at
+        return
+    
+    current_chunk_start = 0
+    current_chunk_end = 0
+    for boundary in TEXT_SPLIT_PATTERNS[split_pattern_idx].finditer(text):
+        if boundary.end() - current_chunk_start > max_chunk_length and current_chunk_end > current_chunk_start:
+            yield from iter_text_chunks(text[current_chunk_start:current_chunk_end], max_chunk_length, split_pattern_idx+1)
+            current_chunk_start = current_chunk_end
+        current_chunk_end = boundary.end()
+    
+    if len(text) - current_chunk_start > max_chunk_length and current_chunk_end > current_chunk_start:
+        yield from iter_text_chunks(text[current_chunk_start:current_chunk_end], max_chunk_length, split_pattern_idx+1)
+        current_chunk_start = current_chunk_end
+    yield from iter_text_chunks(text[current_chunk_start:], max_chunk_length, split_pattern_idx+1)
+
 class Preprocessing:
     
     @staticmethod
@@ -55,6 +92,20 @@ class Preprocessing:
         elif language == "whitespace":
             return WhitespaceTokenizer()
     
+    @staticmethod
+    def get_tokenizer_version(language):
+        """ Returns a string that identifies the tokenizer (and the version
+            of the external library) that is used for the given language. 
+            Can be used to detect whether cached tokens are outdated.
+        """
+        if SpacyTokenizer.is_valid_language(language):
+            return f"spacy-{spacy.__version__}-{language}"
+        elif language == "et":
+            import estnltk
+            return f"estnltk-{getattr(estnltk, '__version__', 'unknown')}"
+        else:
+            return language
+    
     @staticmethod
     def create_lemmatizer(language):
         """ Creates a Lemmatizer that lemmatizes
@@ -146,3 +197,71 @@ class WhitespaceTokenizer:
         if lemmatize == True:
             raise Exception("Whitespace tokenizer does not support lemmatization.")
         return text.split()
+
+_worker_tokenizer = None # tokenizer of a ParallelTokenizer worker process
+
+def _init_tokenization_worker(language):
+    global _worker_tokenizer
+    _worker_tokenizer = Preprocessing.create_tokenizer(language)
+
+def _tokenize_in_worker(text, lemmatize):
+    return _worker_tokenizer.tokenize(text, lemmatize=lemmatize)
+
+class ParallelTokenizer:
+    """ Tokenizes long texts by splitting them into chunks (at paragraph
+        or sentence boundaries) and tokenizing the chunks in several
+        processes. The tokens of the chunks are concatenated in order.
+        Only a limited number of chunks is processed at the same time
+        to keep the memory footprint bounded.
+        Short texts are tokenized directly with the given tokenizer.
+        
+        The worker processes are started with forkserver (or spawn), 
+        not by forking the calling process which might run other threads 
+        (e.g. the server). There are never more workers than chunks.
+    """
+    
+    def __init__(self, language, tokenizer=None, num_processes=None, max_chunk_length=100000):
+        self.language = language
+        self.tokenizer = tokenizer
+        if num_processes is None:
+            num_processes = os.cpu_count() or 1
+        self.num_processes = num_processes
+        self.max_chunk_length = max_chunk_length # Spacy's default max_length is 1,000,000 characters
+        
+    def tokenize(self, text, lemmatize=False):
+        if self.tokenizer is None:
+            self.tokenizer = Preprocessing.create_tokenizer(self.language)
+        
+        # each chunk has at most max_chunk_length characters, so there are at least this many
+        min_num_chunks = -(-len(text) // self.max_chunk_length)
+        num_processes = min(self.num_processes, min_num_chunks)
+        
+        # splitting on whitespace is already fast, starting processes 
+        # (each loading the tokenizer) is not worth it for a few chunks
+        if num_processes < MIN_CHUNKS_FOR_PARALLEL_TOKENIZATION or isinstance(self.tokenizer, WhitespaceTokenizer):
+            tokens = []
+            for chunk in iter_text_chunks(text, self.max_chunk_length):
+                tokens.extend(self.tokenizer.tokenize(chunk, lemmatize=lemmatize))
+            return tokens
+        
+        tokens = []
+        pending_results = deque()
+        with get_worker_context().Pool(num_processes, initializer=_init_tokenization_worker, 
+                                        initargs=(self.language,)) as pool:
+            for chunk in iter_text_chunks(text, self.max_chunk_length):
+                pending_results.append(pool.apply_async(_tokenize_in_worker, (chunk, lemmatize)))
+                # only keep a few chunks in flight, chunks are processed in order
+                if len(pending_results) >= 2 * num_processes:
+                    tokens.extend(pending_results.popleft().get())
+            while len(pending_results) > 0:
+                tokens.extend(pending_results.popleft().get())
+        return tokens
+
+# fewer chunks are tokenized in the calling process
+MIN_CHUNKS_FOR_PARALLEL_TOKENIZATION = 3
+
+def get_worker_context():
+    """ Multiprocessing context that does not fork the calling process """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
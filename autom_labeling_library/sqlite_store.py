@@ -0,0 +1,293 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+import pickle
+import threading
+
+from .entity import EntityObject, EntityName
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+CREATE TABLE IF NOT EXISTS documents (
+    position INTEGER PRIMARY KEY,
+    document_type TEXT,
+    raw_format TEXT,
+    raw_text TEXT,
+    name TEXT,
+    raw_text_path TEXT
+);
+CREATE TABLE IF NOT EXISTS extractions (
+    identifier TEXT PRIMARY KEY,
+    config BLOB
+);
+CREATE TABLE IF NOT EXISTS entity_names (
+    extraction_identifier TEXT,
+    is_alias INTEGER,
+    position INTEGER,
+    name TEXT,
+    first_token TEXT,
+    entity_identifier TEXT,
+    PRIMARY KEY (extraction_identifier, is_alias, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entity_names_first_token ON entity_names (first_token);
+CREATE INDEX IF NOT EXISTS entity_names_entity_identifier ON entity_names (entity_identifier);
+"""
+
+def normalize_first_token(name):
+    """ The first (whitespace) token of the name, lowercased.
+        Used to look up possible matches of a token.
+    """
+    tokens = name.split()
+    if len(tokens) == 0:
+        return ""
+    return tokens[0].lower()
+
+class SQLiteStore:
+    """ Stores settings, raw documents, the configurations of
+        WikiDataNameExtraction objects and their extracts in one
+        SQLite database. Entity names are indexed by extraction,
+        normalized first token and entity identifier (Q-id), so
+        lookups and previews do not need to load whole extractions.
+        The database can be read by other tools at the same time.
+
+        Each thread uses its own connection.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._thread_local = threading.local()
+        connection = self._get_connection()
+        connection.execute("PRAGMA journal_mode=WAL") # readers do not block the writer
+        connection.executescript(SCHEMA)
+        self._migrate(connection)
+    
+    def _migrate(self, connection):
+        """ Adds columns that databases created by older versions miss """
+        document_columns = [row[1] for row in connection.execute("PRAGMA table_info(documents)")]
+        for column in ["name", "raw_text_path"]:
+            if column not in document_columns:
+                with connection:
+                    connection.execute(f"ALTER TABLE documents ADD COLUMN {column} TEXT")
+
+    def _get_connection(self):
+        if not hasattr(self._thread_local, "connection"):
+            self._thread_local.connection = sqlite3.connect(self.db_path, timeout=60)
+        return self._thread_local.connection
+
+    def save_value(self, key, value):
+        """ Pickles and stores an object (e.g. the settings) under the given key """
+        with self._get_connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                               (key, pickle.dumps(value)))
+
+    def load_value(self, key, loads=pickle.loads):
+        """ Returns the object stored under the given key or None. 
+            loads: unpickles the stored bytes (e.g. with a custom Unpickler)
+        """
+        row = self._get_connection().execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return loads(row[0])
+
+    def save_documents(self, documents):
+        """ documents: list of (document_type, raw_format, raw_text, name, raw_text_path) 
+            with strings as types and formats. The name is None if the document 
+            is not part of a corpus. If the raw text is kept in a file, raw_text 
+            is None and raw_text_path is set. Replaces all stored documents.
+        """
+        with self._get_connection() as connection:
+            connection.execute("DELETE FROM documents")
+            connection.executemany("INSERT INTO documents (position, document_type, raw_format, raw_text, name, raw_text_path) VALUES (?, ?, ?, ?, ?, ?)",
+                                   [(i,) + tuple(document) for i, document in enumerate(documents)])
+
+    def load_documents(self):
+        return self._get_connection().execute(
+                "SELECT document_type, raw_format, raw_text, name, raw_text_path FROM documents ORDER BY position").fetchall()
+
+    def get_extraction_identifiers(self):
+        return [row[0] for row in self._get_connection().execute("SELECT identifier FROM extractions ORDER BY identifier")]
+
+    def save_extraction_config(self, identifier, config):
+        """ config: the pickled WikiDataNameExtraction (without extracts) """
+        with self._get_connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO extractions (identifier, config) VALUES (?, ?)",
+                               (identifier, config))
+
+    def load_extraction_config(self, identifier):
+        row = self._get_connection().execute("SELECT config FROM extractions WHERE identifier = ?", (identifier,)).fetchone()
+        if row is None:
+            raise Exception(f"No extraction with identifier {identifier} in {self.db_path}")
+        return pickle.loads(row[0])
+
+    def has_extraction(self, identifier):
+        row = self._get_connection().execute("SELECT 1 FROM extractions WHERE identifier = ?", (identifier,)).fetchone()
+        return row is not None
+
+    def save_extracts(self, identifier, extracts):
+        """ Stores the given extracts (a map of two lists of EntityName objects, 
+            "labels" and "aliases") as the entity names of the extraction.
+            If the extracts were loaded from this store, only the names that 
+            were added since are inserted. Otherwise, the stored names are replaced.
+        """
+        def rows(entity_names, is_alias, start_position):
+            for position, entity_name in enumerate(entity_names, start_position):
+                yield (identifier, is_alias, position, entity_name.name, normalize_first_token(entity_name.name),
+                       entity_name.entity_object.identifier)
+
+        stored_lists = [] # lists whose added names were inserted
+        with self._get_connection() as connection:
+            for is_alias, entity_names in [(0, extracts["labels"]), (1, extracts["aliases"])]:
+                if isinstance(entity_names, SQLiteEntityNameList) and entity_names._store is self \
+                   and entity_names._identifier == identifier:
+                    # names can still be appended while saving (the list is not a copy),
+                    # only the ones taken here are inserted
+                    num_stored, appended = entity_names._get_appended()
+                    new_rows = rows(appended, is_alias, num_stored)
+                    stored_lists.append((entity_names, len(appended)))
+                else:
+                    connection.execute("DELETE FROM entity_names WHERE extraction_identifier = ? AND is_alias = ?", 
+                                       (identifier, is_alias))
+                    new_rows = rows(entity_names, is_alias, 0)
+                connection.executemany("INSERT OR REPLACE INTO entity_names (extraction_identifier, is_alias, position, name, first_token, entity_identifier) VALUES (?, ?, ?, ?, ?, ?)",
+                                       new_rows)
+        
+        # committed, the added names are now read from the database
+        for entity_names, num_inserted in stored_lists:
+            entity_names._set_stored(num_inserted)
+
+    def rename_extraction(self, old_identifier, new_identifier):
+        with self._get_connection() as connection:
+            connection.execute("UPDATE extractions SET identifier = ? WHERE identifier = ?", (new_identifier, old_identifier))
+            connection.execute("UPDATE entity_names SET extraction_identifier = ? WHERE extraction_identifier = ?",
+                               (new_identifier, old_identifier))
+
+    def count_entity_names(self, identifier, is_alias):
+        return self._get_connection().execute(
+                "SELECT COUNT(*) FROM entity_names WHERE extraction_identifier = ? AND is_alias = ?",
+                (identifier, is_alias)).fetchone()[0]
+
+    def get_entity_names(self, identifier, is_alias, entity_extraction, start=0, limit=-1):
+        """ Yields the EntityName objects of the extraction in their original order,
+            starting at position start. At most limit names (-1 for all).
+        """
+        cursor = self._get_connection().execute(
+                "SELECT name, entity_identifier FROM entity_names WHERE extraction_identifier = ? AND is_alias = ? AND position >= ? ORDER BY position LIMIT ?",
+                (identifier, is_alias, start, limit))
+        for name, entity_identifier in cursor:
+            yield EntityName(EntityObject.get_instance(entity_identifier), name, entity_extraction)
+
+    def find_entity_names(self, first_token=None, entity_identifier=None, extraction_identifiers=None, limit=-1):
+        """ Returns (extraction_identifier, name, entity_identifier, is_alias) tuples of
+            names whose normalized first token and/or Q-id matches, optionally
+            limited to some extractions. At most limit names (-1 for all).
+            Uses the indexes of the database.
+        """
+        conditions = []
+        parameters = []
+        if first_token is not None:
+            conditions.append("first_token = ?")
+            parameters.append(normalize_first_token(first_token))
+        if entity_identifier is not None:
+            conditions.append("entity_identifier = ?")
+            parameters.append(entity_identifier)
+        if extraction_identifiers is not None:
+            conditions.append("extraction_identifier IN ({})".format(",".join("?" * len(extraction_identifiers))))
+            parameters.extend(extraction_identifiers)
+        if len(conditions) == 0:
+            raise Exception("At least one search criterion is necessary.")
+        return self._get_connection().execute(
+                "SELECT extraction_identifier, name, entity_identifier, is_alias FROM entity_names WHERE " + " AND ".join(conditions) + " LIMIT ?",
+                parameters + [limit]).fetchall()
+
+    def load_extracts(self, identifier, entity_extraction):
+        """ Returns the extracts of the extraction in the same structure as
+            WikiDataNameExtraction._extracts. The names are not loaded into
+            memory but read from the database when they are accessed.
+        """
+        return {"labels": SQLiteEntityNameList(self, identifier, 0, entity_extraction),
+                "aliases": SQLiteEntityNameList(self, identifier, 1, entity_extraction)}
+
+class SQLiteEntityNameList:
+    """ A list-like view of the names of one extraction stored in a SQLiteStore.
+        Names added after loading (via append) are kept in a
+        normal list behind the stored ones.
+    """
+
+    def __init__(self, store, identifier, is_alias, entity_extraction):
+        self._store = store
+        self._identifier = identifier
+        self._is_alias = is_alias
+        self._entity_extraction = entity_extraction
+        self._num_stored = store.count_entity_names(identifier, is_alias)
+        self._appended = []
+        self._lock = threading.Lock() # the names can be saved while an extraction appends more
+
+    def __len__(self):
+        with self._lock:
+            return self._num_stored + len(self._appended)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step == 1 and stop <= self._num_stored:
+                return list(self._store.get_entity_names(self._identifier, self._is_alias, self._entity_extraction,
+                                                         start, max(0, stop - start)))
+            return [self[i] for i in range(start, stop, step)]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("SQLiteEntityNameList index out of range")
+        with self._lock:
+            num_stored = self._num_stored
+            if idx >= num_stored:
+                return self._appended[idx - num_stored]
+        return next(self._store.get_entity_names(self._identifier, self._is_alias, self._entity_extraction, idx, 1))
+
+    def __iter__(self):
+        num_stored, appended = self._get_appended()
+        yield from self._store.get_entity_names(self._identifier, self._is_alias, self._entity_extraction,
+                                                0, num_stored)
+        yield from appended
+
+    def append(self, entity_name):
+        with self._lock:
+            self._appended.append(entity_name)
+    
+    def _get_appended(self):
+        """ The number of stored names and a copy of the names appended after them """
+        with self._lock:
+            return self._num_stored, list(self._appended)
+    
+    def _set_stored(self, num_inserted):
+        """ Called by SQLiteStore.save_extracts after the first num_inserted
+            appended names were inserted into the database.
+        """
+        with self._lock:
+            self._num_stored += num_inserted
+            del self._appended[:num_inserted]
+    
+    def get_entity_names_in_memory(self):
+        """ The EntityName objects that are kept in memory (the appended ones) """
+        return self._appended
+
+    def set_identifier(self, identifier):
+        """ Needs to be called when the extraction was renamed in the store """
+        self._identifier = identifier
@@ -1,3 +1,15 @@
 export FLASK_APP=server
 export FLASK_ENV=development
-flask run
+
+# ./run.sh --workers N runs N worker processes with gunicorn (pip install gunicorn)
+# that share the instance directory, otherwise the Flask development server is used.
+# Each worker handles 8 requests at the same time (--threads). A page that waits for a
+# job keeps one of these threads busy with the job's event stream, for at most 60 seconds
+# and at most 2 streams per worker (see EVENTS_MAX_STREAMS in server/jobs.py), afterwards
+# the page polls the job instead.
+if [ "$1" = "--workers" ] && [ -n "$2" ]; then
+    export ANEA_MULTI_WORKER=1
+    gunicorn --workers "$2" --threads 8 --bind 0.0.0.0:5000 "server:create_app()"
+else
+    flask run
+fi
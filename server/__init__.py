@@ -22,6 +22,7 @@ from flask import Flask, redirect, render_template
 
 from .memory import Memory, DocumentTypeConverter, document_type_to_readable_name
 from .status import Status
+from .jobs import JobManager
 
 def create_app(test_config=None):
     # create and configure the app
@@ -37,6 +38,10 @@ def create_app(test_config=None):
         # load the test config if passed in
         app.config.from_mapping(test_config)
 
+    # several worker processes share the instance directory (see run.sh)
+    if os.environ.get("ANEA_MULTI_WORKER") == "1":
+        app.config["MULTI_WORKER"] = True
+
     # ensure the instance folder exists
     try:
         os.makedirs(app.instance_path)
@@ -45,6 +50,13 @@ def create_app(test_config=None):
 
     Memory(app) # initalize static Memory instance
     Status()
+    JobManager(num_workers=app.config.get("NUM_JOB_WORKERS", 2),
+               shared_directory=os.path.join(app.instance_path, "jobs") if app.config.get("MULTI_WORKER") else None)
+    
+    if app.config.get("MULTI_WORKER"):
+        @app.before_request
+        def sync_with_other_workers():
+            Memory.get_instance().sync_with_other_workers()
     
     # allow conversion of DocumentTypeEnum to String and back
     app.url_map.converters['document_type'] = DocumentTypeConverter
@@ -90,6 +102,9 @@ def create_app(test_config=None):
     from . import status
     app.register_blueprint(status.bp)
     
+    from . import jobs
+    app.register_blueprint(jobs.bp)
+    
     from . import helping
     app.register_blueprint(helping.bp)
     
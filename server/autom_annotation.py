@@ -18,9 +18,11 @@
 from autom_labeling_library.entity import EntityNameCollection
 from autom_labeling_library.matching import MatchingAlgorithm, MatchConflictGreedySolvingAlgorithm
 from autom_labeling_library.formats import LabelCreator, CoNLLFormatCreator
-from .memory import Memory, DocumentType
+from autom_labeling_library.document import Corpus
+from .memory import Memory, DocumentType, document_type_to_readable_name
 from .status import Status
 from .util import try_method_return_json, create_tokenizer
+from .jobs import start_job_return_json
 
 from flask import (
     Blueprint, flash, g, redirect, render_template, request, session, url_for, jsonify
@@ -33,8 +35,8 @@ def index(document_type):
     """
     If no text has been uploaded, redirect to text upload.
     If text has been uploaded, show annotation result page.
-    The actual annotation is done via Ajax in the background on that
-    page as it might take a while (by calling the /autom_annotate_json 
+    The actual annotation is done in a background job started via Ajax
+    on that page as it might take a while (by calling the /autom_annotate_json 
     resource defined below).
     """
     document = Memory.get_instance().get_document(document_type)
@@ -44,30 +46,39 @@ def index(document_type):
         return redirect(url_for('text_input.index', document_type=document_type))
     
     at_least_one_entity_name = False
-    for extraction in Memory.get_instance().get_extractions(only_loaded=True):
-        if extraction.get_num_extracts() > 0:
+    for extraction in Memory.get_instance().get_extractions(only_loaded=False):
+        # extractions that are not loaded (-1 extracts) are loaded on demand if they are active
+        if extraction.get_property("active") and extraction.get_num_extracts() != 0:
             at_least_one_entity_name = True
             break
     
     if not at_least_one_entity_name:
-        flash("Entity names need to be extracted for the automatic labeling process! Have you already extracted entitiy names? Have you loaded the necessary extractions?", "danger")
+        flash("Entity names need to be extracted for the automatic labeling process! Have you already extracted entitiy names? Are the necessary extractions active?", "danger")
         return redirect(url_for('knowledge_base.list_extracts'))
     
-    #if document.autom_labels is not None: # TODO Now that cache clearing for labels is deactivated, this does not make sense
-    #    flash("This document has already been automatically annotated.", "warning")
+    if document.autom_labels is not None:
+        flash("This document has already been automatically annotated. Annotating it again keeps the manual changes.", "warning")
         
     return render_template("autom_annotation/autom_annotation.html", document_type=document_type)
 
 @bp.route('/autom_annotate_json/<document_type:document_type>', methods=('GET', 'POST'))
-def autom_annotate_json(document_type):    
-    def lambda_function():
+def autom_annotate_json(document_type):
+    """ Starts the annotation as a job and returns its job_id """
+    def lambda_function(job):
         document = Memory.get_instance().get_document(document_type)
-        annotate_text(document)
+        annotate_text(document, job)
+        Memory.get_instance().updated_document_labels(document_type)
 
-    return try_method_return_json(lambda_function, report_error_status=True)
+    return start_job_return_json(f"Automatic annotation of the {document_type_to_readable_name(document_type)}", lambda_function,
+                                 target=f"document_{document_type.value}")
     
-def annotate_text(document): 
-    Status.get_instance().set_state_processing()
+def annotate_text(document, status=None): 
+    """ Annotates the document with the active extractions. The progress is
+        reported to status (a Job), or to the Status singleton if not given.
+    """
+    if status is None:
+        status = Status.get_instance()
+        status.set_state_processing()
     
     settings = Memory.get_instance().get_settings()
     if settings.use_language_specific_tokenizer_for_entity_names:
@@ -75,31 +86,53 @@ def annotate_text(document):
     else:
         entity_name_tokenizer = create_tokenizer("whitespace")
     
-    Status.get_instance().set_message("Collecting entity names.")
+    status.set_message("Loading active extractions.")
+    active_entries = Memory.get_instance().load_active_extractions()
+    
     entity_names = []
-    for extraction in Memory.get_instance().get_extractions(only_loaded=True):
-        entity_names.extend(extraction.get_extracts_for_matching(tokenizer=entity_name_tokenizer))
+    # the extracts must not be unloaded while collecting the names
+    with Memory.get_instance().using_extraction_entries(active_entries):
+        for extraction_entry in active_entries:
+            status.set_message(f"Collecting entity names of {extraction_entry.extraction.get_name()}.")
+            entity_names.extend(extraction_entry.extraction.get_extracts_for_matching(tokenizer=entity_name_tokenizer))
     
     if len(entity_names) == 0:
         raise Exception("No entity names found. Could not annotate. Maybe no extractions are active?")
     
-    Status.get_instance().set_message("Building entity name collection.")
+    status.set_message("Building entity name collection.")
     entity_name_collection = EntityNameCollection(entity_names)
    
     matching_algorithm = MatchingAlgorithm(entity_name_collection)
-    tokens = document.tokens
-    possible_matches = matching_algorithm.match_tokens(tokens, Status.get_instance())
-    
-    Status.get_instance().set_message("Solving conflicts.")
+    if isinstance(document, Corpus):
+        # each document of the corpus is matched on its own, in parallel if configured
+        num_processes = Memory.get_instance().get_num_matching_processes()
+        possible_matches_per_document = matching_algorithm.match_documents([corpus_document.tokens for corpus_document in document.documents],
+                                                                           num_processes, status)
+        status.set_message("Solving conflicts.")
+        for corpus_document, possible_matches in zip(document.documents, possible_matches_per_document):
+            label_document(corpus_document, possible_matches)
+    else:
+        possible_matches = matching_algorithm.match_tokens(document.tokens, status)
+        status.set_message("Solving conflicts.")
+        label_document(document, possible_matches)
+
+    if status is Status.get_instance():
+        status.set_state_idle()
+
+def label_document(document, possible_matches):
+    """ Resolves the conflicts between the possible matches and
+        sets the matches and automatic labels of the document.
+    """
     conflict_solving_algorithm = MatchConflictGreedySolvingAlgorithm()
     matches = list(possible_matches) # copy because conflict resolving algorithm removes matches to resolve conflicts
     conflict_solving_algorithm.resolve_conflicts(matches)
     
     label_creator = LabelCreator()
-    labels = label_creator.create(tokens, matches)
+    labels = label_creator.create(document.tokens, matches)
     
     document.autom_labels = labels
     document.matches = matches
     document.possible_matches = possible_matches
-
-    Status.get_instance().set_state_idle()
+    
+    # manual changes are kept
+    document.post_editing_rules.apply(document)
@@ -15,9 +15,16 @@
 # See the Apache 2 License for the specific language governing permissions and
 # limitations under the License.
 
+import weakref
+from threading import Lock
+
 from autom_labeling_library import evaluation as evaluation_code # not object oriented because external code; renaming to avoid name conflict
 from autom_labeling_library.analysis import ErrorAnalysis
-from .memory import Memory, DocumentType
+from autom_labeling_library.ablation import ExtractionAblation
+from autom_labeling_library.incremental_evaluation import IncrementalEvaluation
+from autom_labeling_library.document import Corpus
+from .memory import Memory, DocumentType, document_type_to_readable_name
+from .jobs import start_job_return_json
 
 from flask import (
     Blueprint, flash, g, redirect, render_template, request, session, url_for, jsonify
@@ -25,6 +32,9 @@ from flask import (
 
 bp = Blueprint('evaluation', __name__, url_prefix='/evaluation')
 
+# ways to group the errors in the analysis, with their readable names
+ANALYSIS_GROUPINGS = {"token": "Tokens", "span": "Entity spans", "extraction": "Extractions"}
+
 @bp.route('/<document_type:document_type>', methods=('GET', 'POST'))
 def evaluation(document_type):
     document = Memory.get_instance().get_document(document_type)
@@ -35,9 +45,15 @@ def evaluation(document_type):
     
     overall_metrics, per_tag_metrics = evaluate(document)
     
+    per_document_metrics = None
+    if isinstance(document, Corpus):
+        per_document_metrics = [(name, evaluate(corpus_document)[0]) 
+                                for name, corpus_document in zip(document.document_names, document.documents)]
+    
     return render_template("evaluation/evaluation.html", document_type=document_type, 
                                                          overall_metrics=overall_metrics,
-                                                         per_tag_metrics=per_tag_metrics)
+                                                         per_tag_metrics=per_tag_metrics,
+                                                         per_document_metrics=per_document_metrics)
                                                          
 @bp.route('/analysis/<document_type:document_type>/<int:num_errors>', methods=('GET', 'POST'))
 def analysis(document_type, num_errors):
@@ -47,15 +63,95 @@ def analysis(document_type, num_errors):
     if precheck_fail:
         return precheck_fail
     
-    precision_errors, recall_errors = analyse(document, num_errors)
+    # token, span or extraction
+    group_by = request.args.get("group_by", "token")
+    if group_by not in ANALYSIS_GROUPINGS:
+        group_by = "token"
+    
+    precision_errors, recall_errors, extraction_errors = [], [], []
+    if group_by == "extraction":
+        extraction_errors = ErrorAnalysis().analyse_errors_by_extraction(document, num_errors)
+    else:
+        precision_errors, recall_errors = analyse(document, num_errors, group_by)
     
     return render_template("evaluation/analysis.html", document_type=document_type,
                                                        precision_errors=precision_errors,
                                                        recall_errors=recall_errors,
+                                                       extraction_errors=extraction_errors,
+                                                       group_by=group_by,
+                                                       groupings=ANALYSIS_GROUPINGS,
                                                        num_errors=num_errors)
     # TODO Implement analysis here
     
 
+@bp.route('/ablation/<document_type:document_type>', methods=('GET', 'POST'))
+def ablation(document_type):
+    """ Evaluation of the annotation without each extraction and with
+        each extraction alone, reusing the possible matches of the last
+        annotation. The ablation is done in a background job started via 
+        Ajax on this page (by calling the /ablation_json resource defined 
+        below), the page shows the results of the last finished ablation.
+    """
+    document = Memory.get_instance().get_document(document_type)
+    
+    precheck_fail = precheck(document, document_type)
+    if precheck_fail:
+        return precheck_fail
+    
+    if not has_possible_matches(document):
+        flash(f"The matches of the {document_type} document are not available (e.g. after a restart). Please annotate it again.", "warning")
+        return redirect(url_for("autom_annotation.index", document_type=document_type))
+    
+    return render_template("evaluation/ablation.html", document_type=document_type,
+                                                       results=get_ablation_results(document))
+
+@bp.route('/ablation_json/<document_type:document_type>', methods=('GET', 'POST'))
+def ablation_json(document_type):
+    """ Starts the ablation as a job and returns its job_id """
+    def lambda_function(job):
+        document = Memory.get_instance().get_document(document_type)
+        if not document or document.gold_labels is None or not has_possible_matches(document):
+            raise Exception(f"The {document_type} document has no gold labels or no matches of an annotation.")
+        
+        job.set_message("Preparing the ablation.")
+        ablation_key = get_ablation_key(document)
+        results = ExtractionAblation(get_single_documents(document)).run(Memory.get_instance().get_num_matching_processes(), status=job)
+        with _lock_ablation_results:
+            _ablation_results[document] = (ablation_key, results)
+    
+    return start_job_return_json(f"Extraction ablation of the {document_type_to_readable_name(document_type)}", lambda_function,
+                                 target=f"ablation_{document_type.value}")
+
+def get_single_documents(document):
+    return document.documents if isinstance(document, Corpus) else [document]
+
+def has_possible_matches(document):
+    return all(single_document.possible_matches is not None for single_document in get_single_documents(document))
+
+# The results of the last ablation of each document. They are only shown 
+# as long as the document still has the same gold labels and matches, a 
+# new annotation replaces the lists.
+_ablation_results = weakref.WeakKeyDictionary() # Document or Corpus -> (ablation key, results)
+_lock_ablation_results = Lock()
+
+def get_ablation_key(document):
+    """ The label and match lists the ablation of the document is based on """
+    return [(single_document.gold_labels, single_document.possible_matches) for single_document in get_single_documents(document)]
+
+def get_ablation_results(document):
+    """ The results of the last ablation of the document (see 
+        ExtractionAblation.run) or None if there is none for its current 
+        labels and matches.
+    """
+    with _lock_ablation_results:
+        ablation_key, results = _ablation_results.get(document, (None, None))
+    current_key = get_ablation_key(document)
+    if ablation_key is None or len(ablation_key) != len(current_key) or \
+       any(gold_labels is not current_gold_labels or possible_matches is not current_possible_matches
+           for (gold_labels, possible_matches), (current_gold_labels, current_possible_matches) in zip(ablation_key, current_key)):
+        return None
+    return results
+
 def precheck(document, document_type):
     if not document:
         flash("A {} document needs to be uploaded or inputed before evaluation.".format(
@@ -73,10 +169,49 @@ def precheck(document, document_type):
     return None
 
 def evaluate(document):
-    counts = evaluation_code.evaluate(document.gold_labels, document.autom_labels)
+    if isinstance(document, Corpus):
+        # documents are evaluated separately so that no chunk spans two documents
+        counts = evaluation_code.merge_counts([get_counts(corpus_document) for corpus_document in document.documents])
+    else:
+        counts = get_counts(document)
     return evaluation_code.metrics(counts)
+
+# The counts of each document are cached and only partially updated
+# after post-editing (see labels_changed). A new annotation replaces
+# the label lists, which invalidates the cache.
+_incremental_evaluations = weakref.WeakKeyDictionary() # Document -> IncrementalEvaluation
+_lock_incremental_evaluations = Lock()
+
+def get_counts(document):
+    """ The EvalCounts of a single Document """
+    with _lock_incremental_evaluations:
+        incremental_evaluation = _incremental_evaluations.get(document)
+        if incremental_evaluation is None or \
+           not incremental_evaluation.is_valid_for(document.gold_labels, document.autom_labels):
+            incremental_evaluation = IncrementalEvaluation(document.gold_labels, document.autom_labels)
+            _incremental_evaluations[document] = incremental_evaluation
+        return incremental_evaluation.get_counts()
+
+def labels_changed(document, positions):
+    """ Needs to be called if automatic labels of the document (a Document
+        or Corpus) were changed in place. positions are the indices of the
+        changed tokens.
+    """
+    if isinstance(document, Corpus):
+        changed = [document.locate(position) for position in positions]
+    else:
+        changed = [(document, position) for position in positions]
+    
+    with _lock_incremental_evaluations:
+        for single_document, position in changed:
+            incremental_evaluation = _incremental_evaluations.get(single_document)
+            if incremental_evaluation is not None:
+                incremental_evaluation.labels_changed(position, position + 1)
     
-def analyse(document, num_errors):
+def analyse(document, num_errors, group_by="token"):
     error_analysis = ErrorAnalysis()
-    precision_errors, recall_errors = error_analysis.analyse_errors(document, num_errors)
+    if group_by == "span":
+        precision_errors, recall_errors = error_analysis.analyse_span_errors(document, num_errors)
+    else:
+        precision_errors, recall_errors = error_analysis.analyse_errors(document, num_errors)
     return precision_errors, recall_errors
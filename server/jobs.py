@@ -0,0 +1,472 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+from enum import Enum
+import os
+import time
+import json
+import uuid
+import traceback
+from threading import Lock, Condition
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import (
+    Blueprint, flash, g, redirect, render_template, request, session, url_for, jsonify,
+    Response, stream_with_context
+)
+
+EVENTS_MIN_INTERVAL = 0.25 # seconds between two events sent to the same client
+EVENTS_HEARTBEAT_INTERVAL = 15 # seconds after which a comment is sent to keep the connection open
+# Each event stream holds a request thread while it is open. The streams
+# are limited in number and duration, then the client polls /jobs/<job_id>.
+EVENTS_MAX_STREAMS = 2 # per worker process
+EVENTS_MAX_DURATION = 60 # seconds after which a stream is closed
+SHARED_STATE_MIN_INTERVAL = 0.5 # seconds between two writes/checks of the shared job files
+SHARED_JOBS_RETENTION = 24 * 60 * 60 # seconds the files of jobs of stopped workers are kept after the job ended
+
+class JobManager:
+    """
+        Runs long operations (e.g. extraction from the knowledge base or
+        automatic annotation) in a pool of worker threads. Each operation
+        is a Job with its own identifier, state, message and progress, so
+        several jobs can run at the same time and they continue if the
+        browser disconnects. Finished jobs are kept for a while so that
+        their result can still be requested.
+        
+        If several worker processes are running, shared_directory is
+        used to share the state of the jobs between them: each job writes 
+        its state to a file there and can be cancelled by creating a 
+        marker file. Jobs of other workers are represented by SharedJob objects.
+    """
+
+    @staticmethod
+    def get_instance():
+        return JobManager.instance
+
+    def __init__(self, num_workers=2, max_retained_jobs=100, shared_directory=None):
+        JobManager.instance = self
+
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="job")
+        self._max_retained_jobs = max_retained_jobs
+        self._jobs = {} # job id -> Job, in the order they were started
+        self._lock_jobs = Lock()
+        self._shared_directory = shared_directory
+        if shared_directory is not None:
+            os.makedirs(shared_directory, exist_ok=True)
+
+    def start_job(self, name, method, target=None):
+        """ Queues the method to run in the background. The method
+            gets the Job object as its only argument and can report its
+            progress via job.set_message(). Returns the Job.
+            
+            target identifies what the job changes (e.g. a document). 
+            Only one job per target can be queued or running at the same
+            time, otherwise a JobConflictException is raised.
+        """
+        with self._lock_jobs:
+            if target is not None:
+                for active_job in self.get_jobs(only_active=True, lock_jobs=False):
+                    if active_job.to_dict().get("target") == target:
+                        raise JobConflictException(f"The job \"{active_job.to_dict()['name']}\" is still running, please wait until it is finished or cancel it.")
+            job = Job(uuid.uuid4().hex, name, self._shared_directory, target)
+            self._jobs[job.identifier] = job
+            self._remove_old_jobs()
+        self._executor.submit(self._run_job, job, method)
+        return job
+
+    def _run_job(self, job, method):
+        if not job.start_running(): # cancelled while it was queued
+            return
+
+        try:
+            method(job)
+            job.set_state(JobState.FINISHED)
+        except JobCancelledException:
+            job.set_state(JobState.CANCELLED)
+        except Exception as e:
+            print("Exception occured in job {}. The stacktrace: {}".format(job.name, traceback.format_exc()))
+            job.set_error(str(e), traceback.format_exc())
+
+    def _remove_old_jobs(self):
+        """ Removes the oldest finished jobs if more than max_retained_jobs
+            are stored. Jobs that are queued or running are never removed.
+        """
+        num_to_remove = len(self._jobs) - self._max_retained_jobs
+        if num_to_remove <= 0:
+            return
+        for job_identifier in list(self._jobs.keys()):
+            if num_to_remove <= 0:
+                break
+            if self._jobs[job_identifier].is_done():
+                self._jobs[job_identifier].remove_shared_files()
+                del self._jobs[job_identifier]
+                num_to_remove -= 1
+
+    def get_job(self, job_identifier):
+        """ Returns the Job or None if it does not exist (anymore) """
+        with self._lock_jobs:
+            job = self._jobs.get(job_identifier)
+        if job is None and self._shared_directory is not None:
+            job = SharedJob.from_directory(self._shared_directory, job_identifier)
+        return job
+
+    def get_jobs(self, only_active=False, lock_jobs=True):
+        """ Returns the jobs of all workers. lock_jobs is False if the
+            caller already holds the lock of the jobs.
+        """
+        if lock_jobs:
+            with self._lock_jobs:
+                jobs = list(self._jobs.values())
+        else:
+            jobs = list(self._jobs.values())
+        if self._shared_directory is not None:
+            own_job_identifiers = set(job.identifier for job in jobs)
+            for file_name in sorted(os.listdir(self._shared_directory)):
+                job_identifier, extension = os.path.splitext(file_name)
+                if extension == ".json" and not job_identifier in own_job_identifiers:
+                    job = SharedJob.from_directory(self._shared_directory, job_identifier)
+                    if job is None:
+                        continue
+                    if job.is_expired():
+                        # nobody else removes the files of a stopped worker
+                        job.remove_shared_files()
+                        continue
+                    jobs.append(job)
+        if only_active:
+            jobs = [job for job in jobs if not job.is_done()]
+        return jobs
+
+class Job:
+    """
+        A long operation run by the JobManager. Can be given to
+        library methods instead of the Status object to report the progress.
+    """
+
+    def __init__(self, identifier, name, shared_directory=None, target=None):
+        self.identifier = identifier
+        self.name = name # human readable description of the task
+        self.target = target # what the job changes, see JobManager.start_job
+        self.state = JobState.QUEUED
+        self.message = ""
+        self.progress = None # between 0 and 1 if known
+        self.error_msg = None
+        self.stacktrace = None
+        self.time_created = time.time()
+        self.time_finished = None
+        self._cancel_requested = False
+        self._lock_state = Lock() # a queued job is either started or cancelled
+        self._version = 0 # increased with every change, see wait_for_change
+        self._condition_changed = Condition()
+        self._shared_directory = shared_directory
+        self._time_shared = 0 # time of the last write/check of the shared files
+        self._changed()
+
+    def _changed(self):
+        with self._condition_changed:
+            self._version += 1
+            self._condition_changed.notify_all()
+        
+        if self._shared_directory is not None and \
+           (self.is_done() or time.time() - self._time_shared >= SHARED_STATE_MIN_INTERVAL):
+            self._time_shared = time.time()
+            file_path = os.path.join(self._shared_directory, self.identifier + ".json")
+            with open(file_path + ".tmp", "w") as output_file:
+                json.dump(self.to_dict(), output_file)
+            os.replace(file_path + ".tmp", file_path)
+    
+    def _check_cancel_requested(self):
+        """ Raises a JobCancelledException if the job should be cancelled.
+            Another worker process cancels the job via a marker file.
+        """
+        if not self._cancel_requested and self._shared_directory is not None and \
+           time.time() - self._time_shared >= SHARED_STATE_MIN_INTERVAL:
+            self._cancel_requested = os.path.isfile(os.path.join(self._shared_directory, self.identifier + ".cancel"))
+        if self._cancel_requested:
+            raise JobCancelledException(f"Job {self.name} was cancelled.")
+    
+    def remove_shared_files(self):
+        if self._shared_directory is None:
+            return
+        for extension in [".json", ".cancel"]:
+            try:
+                os.remove(os.path.join(self._shared_directory, self.identifier + extension))
+            except FileNotFoundError:
+                pass
+
+    def wait_for_change(self, version, timeout):
+        """ Blocks until the job changed after the given version or the
+            timeout passed. Returns the current version.
+        """
+        with self._condition_changed:
+            self._condition_changed.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def set_message(self, message):
+        """ Sets the progress message. Raises a JobCancelledException if
+            the job should be cancelled, this stops the job's method.
+        """
+        self._check_cancel_requested()
+        self.message = message
+        self._changed()
+
+    def set_progress(self, progress, message=None):
+        """ progress: Finished part of the job between 0 and 1 """
+        self._check_cancel_requested()
+        self.progress = progress
+        if message is not None:
+            self.message = message
+        self._changed()
+
+    def set_state(self, state):
+        self.state = state
+        if self.is_done():
+            self.time_finished = time.time()
+        self._changed()
+
+    def set_error(self, error_msg, stacktrace):
+        self.error_msg = error_msg
+        self.stacktrace = stacktrace
+        self.set_state(JobState.FAILED)
+
+    def request_cancel(self):
+        """ A queued job is cancelled directly, a running job stops 
+            the next time it reports its progress.
+        """
+        with self._lock_state:
+            self._cancel_requested = True
+            if self.state == JobState.QUEUED:
+                self.set_state(JobState.CANCELLED)
+    
+    def start_running(self):
+        """ Sets the state of a queued job to running. Returns False if it 
+            was cancelled before (also via the marker file of another worker).
+        """
+        with self._lock_state:
+            if not self._cancel_requested and self._shared_directory is not None:
+                self._cancel_requested = os.path.isfile(os.path.join(self._shared_directory, self.identifier + ".cancel"))
+            if self._cancel_requested:
+                if self.state == JobState.QUEUED:
+                    self.set_state(JobState.CANCELLED)
+                return False
+            self.set_state(JobState.RUNNING)
+            return True
+
+    def is_cancel_requested(self):
+        return self._cancel_requested
+
+    def is_done(self):
+        return self.state in (JobState.FINISHED, JobState.FAILED, JobState.CANCELLED)
+
+    def to_dict(self):
+        return {"job_id": self.identifier,
+                "name": self.name,
+                "target": self.target,
+                "pid": os.getpid(), # worker process running the job, see SharedJob
+                "state": self.state.value,
+                "message": self.message,
+                "progress": self.progress,
+                "error_msg": self.error_msg,
+                "stacktrace": self.stacktrace.replace("\n", "<br />") if self.stacktrace is not None else None,
+                "time_created": self.time_created,
+                "time_finished": self.time_finished}
+
+class SharedJob:
+    """
+        A job running in another worker process. Its state is read from
+        the file the job writes to the shared directory of the JobManager.
+        Offers the same methods as Job that are used by the routes.
+        
+        If the worker process stopped (e.g. it crashed or was restarted)
+        before the job ended, the job is marked as failed.
+    """
+    
+    @staticmethod
+    def from_directory(shared_directory, identifier):
+        """ Returns the SharedJob or None if there is no such job """
+        job = SharedJob(shared_directory, identifier)
+        if job._read_state() is None:
+            return None
+        return job
+    
+    def __init__(self, shared_directory, identifier):
+        self.identifier = identifier
+        self._file_path = os.path.join(shared_directory, identifier + ".json")
+        self._cancel_file_path = os.path.join(shared_directory, identifier + ".cancel")
+        self._state = None
+    
+    def _read_state(self):
+        try:
+            with open(self._file_path, "r") as input_file:
+                self._state = json.load(input_file)
+        except (OSError, ValueError):
+            return self._state
+        
+        if self._state["state"] in (JobState.QUEUED.value, JobState.RUNNING.value) and \
+           not is_process_running(self._state.get("pid")):
+            self._state["state"] = JobState.FAILED.value
+            self._state["error_msg"] = "The worker process of the job stopped before the job ended."
+            self._state["time_finished"] = time.time()
+            temporary_file_path = f"{self._file_path}.{os.getpid()}.tmp" # other workers might do the same
+            try:
+                with open(temporary_file_path, "w") as output_file:
+                    json.dump(self._state, output_file)
+                os.replace(temporary_file_path, self._file_path)
+            except OSError:
+                pass
+        return self._state
+    
+    def is_expired(self):
+        """ True if the job ended more than SHARED_JOBS_RETENTION ago and
+            its worker process stopped, so its files can be removed.
+        """
+        return self.is_done() and not is_process_running(self._state.get("pid")) and \
+               time.time() - (self._state["time_finished"] or 0) > SHARED_JOBS_RETENTION
+    
+    def remove_shared_files(self):
+        for file_path in [self._file_path, self._cancel_file_path]:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+    
+    def request_cancel(self):
+        open(self._cancel_file_path, "w").close()
+    
+    def is_done(self):
+        self.to_dict()
+        return self._state["state"] in (JobState.FINISHED.value, JobState.FAILED.value, JobState.CANCELLED.value)
+    
+    def to_dict(self):
+        self._read_state()
+        if self._state["state"] == JobState.QUEUED.value and os.path.isfile(self._cancel_file_path):
+            # the owning worker skips the job when it would start it
+            self._state["state"] = JobState.CANCELLED.value
+        return self._state
+
+def is_process_running(pid):
+    """ Whether a process with the pid exists (on this machine). None 
+        (files written by older versions) counts as stopped.
+    """
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0) # does not send a signal, only checks the process
+    except ProcessLookupError:
+        return False
+    except PermissionError: # exists, but belongs to another user
+        return True
+    return True
+
+class JobState(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class JobCancelledException(Exception):
+    pass
+
+class JobConflictException(Exception):
+    """ Raised if a job is started while another job for the same target is active """
+    pass
+
+def start_job_return_json(name, method, target=None):
+    """ Starts the method as a background job and returns a JSON
+        object with the job identifier. The state of the job can be
+        requested via /jobs/<job_id>. If another job for the same 
+        target is active, a JSON object with the error is returned.
+    """
+    try:
+        job = JobManager.get_instance().start_job(name, method, target)
+    except JobConflictException as e:
+        return jsonify({"successful": False, "error_msg": str(e)})
+    return jsonify({"successful": True, "job_id": job.identifier})
+
+bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+@bp.route('/', methods=('GET', 'POST'))
+def list_jobs():
+    only_active = request.args.get("only_active", "false") == "true"
+    return jsonify({"jobs": [job.to_dict() for job in JobManager.get_instance().get_jobs(only_active)]})
+
+@bp.route('/<string:job_id>', methods=('GET', 'POST'))
+def job_status(job_id):
+    job = JobManager.get_instance().get_job(job_id)
+    if job is None:
+        return jsonify({"successful": False, "error_msg": f"Job {job_id} does not exist."}), 404
+    return jsonify(job.to_dict())
+
+_num_event_streams = 0 # open event streams of this worker process
+_lock_event_streams = Lock()
+
+@bp.route('/<string:job_id>/events', methods=('GET',))
+def job_events(job_id):
+    """ Server-sent events stream of the job's state (as in /jobs/<job_id>).
+        An event is sent when the job changes, but at most one event per 
+        EVENTS_MIN_INTERVAL, intermediate changes are skipped. The stream
+        ends after the job is done or after EVENTS_MAX_DURATION. At most
+        EVENTS_MAX_STREAMS streams are open at the same time and jobs of
+        other workers are not streamed. In these cases, the client
+        polls /jobs/<job_id> instead (see wait_for_job in base.html).
+    """
+    global _num_event_streams
+    
+    job = JobManager.get_instance().get_job(job_id)
+    if job is None:
+        return jsonify({"successful": False, "error_msg": f"Job {job_id} does not exist."}), 404
+    if isinstance(job, SharedJob):
+        return jsonify({"successful": False, "error_msg": f"Job {job_id} runs in another worker, its state needs to be polled."}), 503
+    
+    with _lock_event_streams:
+        if _num_event_streams >= EVENTS_MAX_STREAMS:
+            return jsonify({"successful": False, "error_msg": "Too many open event streams, the state of the job needs to be polled."}), 503
+        _num_event_streams += 1
+    
+    def generate_events():
+        time_end = time.time() + EVENTS_MAX_DURATION
+        version = -1
+        while time.time() < time_end:
+            new_version = job.wait_for_change(version, min(EVENTS_HEARTBEAT_INTERVAL, max(0, time_end - time.time())))
+            if new_version == version:
+                yield ": heartbeat\n\n"
+                continue
+            version = new_version
+            job_state = job.to_dict()
+            yield "data: {}\n\n".format(json.dumps(job_state))
+            if job_state["state"] in (JobState.FINISHED.value, JobState.FAILED.value, JobState.CANCELLED.value):
+                return
+            time.sleep(EVENTS_MIN_INTERVAL)
+    
+    def stream_closed():
+        global _num_event_streams
+        with _lock_event_streams:
+            _num_event_streams -= 1
+    
+    response = Response(stream_with_context(generate_events()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # also called if the stream is closed before it was started
+    response.call_on_close(stream_closed)
+    return response
+
+@bp.route('/<string:job_id>/cancel', methods=('GET', 'POST'))
+def cancel_job(job_id):
+    job = JobManager.get_instance().get_job(job_id)
+    if job is None:
+        return jsonify({"successful": False, "error_msg": f"Job {job_id} does not exist."}), 404
+    job.request_cancel()
+    return jsonify({"successful": True})
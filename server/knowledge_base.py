@@ -16,16 +16,17 @@
 # limitations under the License.
 
 import time
-import io
+import traceback
 import re
 
 from autom_labeling_library.knowledge_base import WikiDataNameExtraction, WikiDataExtractor
 from .memory import Memory, ExtractionEntryState
 from .status import Status
-from .util import try_method_return_json, create_tokenizer
+from .util import try_method_return_json, create_tokenizer, stream_download
+from .jobs import start_job_return_json, JobCancelledException
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for, send_file
+    Blueprint, flash, g, redirect, render_template, request, session, url_for, jsonify
 )
 
 bp = Blueprint('knowledge_base', __name__, url_prefix='/knowledge_base')
@@ -125,20 +126,25 @@ def extract_from_knowledge_base_form():
 
 @bp.route('/extract_json', methods=('GET', 'POST'))
 def extract_from_knowledge_base_json():
+    """ Starts the extraction as a job and returns its job_id """
     
-    def lambda_function():
+    def lambda_function(job):
         # get all WikiDataNameExtraction objects that have not been filled, yet.
-        Status.get_instance().set_state_processing()
-        
         new_extractions = [extraction for extraction in Memory.get_instance().get_extractions(only_loaded=True)
                             if not extraction.get_property("has_been_fully_extracted")]
         extractor = WikiDataExtractor(Memory.get_instance().get_settings().wikidata_path)
-        extractor.extract(new_extractions, Status.get_instance())
+        try:
+            extractor.extract(new_extractions, job)
+        except JobCancelledException:
+            # a partial extraction would be extended twice when running again
+            for extraction in new_extractions:
+                extraction.clear_entity_names()
+            raise
         
         Memory.get_instance().updated_extractions(new_extractions)
-        Status.get_instance().set_state_idle()
     
-    return try_method_return_json(lambda_function, report_error_status=True)
+    # the job extends all extractions that were not extracted yet
+    return start_job_return_json("Extraction from the knowledge base", lambda_function, target="knowledge_base_extraction")
     
 @bp.route('/list_extracts', methods=('GET', 'POST'))
 def list_extracts():
@@ -150,22 +156,44 @@ def list_extracts():
     
     extraction_entries = Memory.get_instance().get_extraction_entries()
     all_example_extracts = []
-    for extraction_entry in extraction_entries:
-        if extraction_entry.state == ExtractionEntryState.LOADED:
-            example_extracts = extraction_entry.extraction.get_extracts_for_matching(entity_name_tokenizer, 20)
-            all_example_extracts.append(example_extracts)
-        elif extraction_entry.state == ExtractionEntryState.LOADING:
-            all_example_extracts.append([])
-        elif extraction_entry.state == ExtractionEntryState.NOT_LOADED:
-            all_example_extracts.append([])
+    with Memory.get_instance().using_extraction_entries(extraction_entries):
+        for extraction_entry in extraction_entries:
+            if extraction_entry.state == ExtractionEntryState.LOADED:
+                example_extracts = extraction_entry.extraction.get_extracts_for_matching(entity_name_tokenizer, 20)
+                all_example_extracts.append(example_extracts)
+            elif extraction_entry.state == ExtractionEntryState.LOADING:
+                all_example_extracts.append([])
+            elif extraction_entry.state == ExtractionEntryState.NOT_LOADED:
+                all_example_extracts.append([])
     
     extractions = [extraction_entry.extraction for extraction_entry in extraction_entries]
     extraction_states = [extraction_entry.state for extraction_entry in extraction_entries]
+    extraction_load_errors = [extraction_entry.load_error if extraction_entry.state == ExtractionEntryState.NOT_LOADED else None
+                              for extraction_entry in extraction_entries]
     return render_template("knowledge_base/list_extractions.html", 
                            extractions=extractions,
                            extraction_states=extraction_states,
+                           extraction_load_errors=extraction_load_errors,
                            example_extracts=all_example_extracts) 
 
+@bp.route('/find_entity_names', methods=('GET',))
+def find_entity_names():
+    """ Looks up the entity names that start with the token given in the
+        "token" parameter and/or belong to the Q-id given in the "entity" 
+        parameter. Returns them as JSON.
+    """
+    first_token = request.args.get("token", "").strip() or None
+    entity_identifier = request.args.get("entity", "").strip() or None
+    try:
+        entity_names = Memory.get_instance().find_entity_names(first_token, entity_identifier)
+    except Exception as e:
+        print("Exception occured. The stacktrace: " + traceback.format_exc())
+        return jsonify({"successful": False, "error_msg": str(e)})
+    return jsonify({"successful": True, 
+                    "entity_names": [{"extraction": extraction_identifier, "name": name, 
+                                      "entity": entity_identifier, "alias": bool(is_alias)}
+                                     for extraction_identifier, name, entity_identifier, is_alias in entity_names]})
+
 @bp.route('/load_extract/', methods=('GET', 'POST'))
 def load_all_extracts():
     return load_extract("")
@@ -173,19 +201,22 @@ def load_all_extracts():
 @bp.route('/load_extract/<string:extraction_identifier>', methods=('GET', 'POST'))
 def load_extract(extraction_identifier):
     """ A full extraction identifier (e.g. "en-ORG-Q5")
-        or a substring of an extraction identifier to match (e.g. "en-ORG" or "en")
+        or a substring of an extraction identifier to match (e.g. "en-ORG" or "en").
+        Starts loading the extracts in the background and returns directly.
     """
     
     def lambda_function():
         extraction_identifier_stripped = extraction_identifier.strip()
         extraction_entries = Memory.get_instance().get_extraction_entries()
+        entries_to_load = []
         for entry in extraction_entries:
             # either no limitation entered, then matching all or matching full or substring
             if len(extraction_identifier_stripped) == 0 or extraction_identifier_stripped in entry.identifier:
                 if entry.state == ExtractionEntryState.NOT_LOADED: # some might already have been loaded but still match, but that is fine
-                    entry.load_extraction(Memory.get_instance(), load_configuration=False, load_extracts=True)
+                    entries_to_load.append(entry)
         
-        Memory.get_instance().invalidate_autom_annotation_cache()
+        # loading runs in the background, progress is reported via /status
+        Memory.get_instance().load_extraction_entries_in_background(entries_to_load)
                 
     return try_method_return_json(lambda_function, report_error_status=False)
 
@@ -201,12 +232,15 @@ def unload_extract(extraction_identifier):
     
     def lambda_function():
         extraction_identifier_stripped = extraction_identifier.strip() # re-assign necessary due to context change
-        extraction_entries = Memory.get_instance().get_extraction_entries()
-        for entry in extraction_entries:
-            # either no limitation entered, then matching all or matching full or substring
-            if len(extraction_identifier_stripped) == 0 or extraction_identifier_stripped in entry.identifier:
-                if entry.state == ExtractionEntryState.LOADED: # some might not be loaded but still match, but that is fine
-                    entry.unload_extraction(Memory.get_instance())
+        # either no limitation entered, then matching all or matching full or substring
+        # (some might not be loaded but still match, but that is fine)
+        extraction_entries = [entry for entry in Memory.get_instance().get_extraction_entries()
+                              if len(extraction_identifier_stripped) == 0 or extraction_identifier_stripped in entry.identifier]
+        # entries used by a running job (e.g. an annotation) stay loaded
+        in_use = Memory.get_instance().unload_extraction_entries(extraction_entries)
+        if len(in_use) > 0:
+            flash("The following extractions are used by a running job and stayed loaded: " + 
+                  ", ".join(entry.identifier for entry in in_use), "warning")
                     
         Memory.get_instance().invalidate_autom_annotation_cache()
         
@@ -313,14 +347,11 @@ def download_extraction(extraction_identifier):
     else:
         entity_name_tokenizer = create_tokenizer("whitespace")
     
-    extracts = extraction_entry.extraction.get_extracts_for_matching(entity_name_tokenizer)
-    output_file = io.BytesIO()
-    output_file.write(f"# Extraction {stripped_extraction_identifier}\n#Timestamp: {time.strftime('%Y-%m-%d %H:%M')}\n".encode("utf-8"))
-    for extract in extracts:
-        output_file.write("{}\t{}\t{}\n".format(extract.name, extract.tokenized_name, extract.entity_object).encode("utf-8"))
+    extraction = extraction_entry.extraction
+    def generate_lines():
+        yield f"# Extraction {stripped_extraction_identifier}\n#Timestamp: {time.strftime('%Y-%m-%d %H:%M')}\n"
+        for extract in extraction.iter_extracts_for_matching(entity_name_tokenizer):
+            yield "{}\t{}\t{}\n".format(extract.name, extract.tokenized_name, extract.entity_object)
 
     filename = f"extracts_{stripped_extraction_identifier}.tsv" # stripped_extraction_identifier should be a valid identifier, otherwise .get_extraction would have thrown an Exception. Therefore should be safe to use this for a filename.
-    return send_file(io.BytesIO(output_file.getvalue()), mimetype="text/plain",  # TODO Do something better than BytesIO of BytesIO
-                     as_attachment=True, attachment_filename=filename,
-                     cache_timeout=0,  # prevents caching, could be set to the actual upload/annotation time
-                     last_modified=time.time())
+    return stream_download(generate_lines(), filename, compress=request.args.get("gzip", 0, type=int) == 1)
@@ -17,13 +17,38 @@
 
 from enum import Enum
 import os
+import sys
 import pickle
+import itertools
 import copy
-from threading import Lock
+import hashlib
+import traceback
+import json
+import time
+import atexit
+import uuid
+import weakref
+from contextlib import contextmanager
+from threading import Lock, RLock, Condition, Thread
+from concurrent.futures import ThreadPoolExecutor
 
 from werkzeug.routing import BaseConverter
+from werkzeug.utils import secure_filename
 
-from autom_labeling_library.document import DocumentRawFormat
+from autom_labeling_library.document import Document, DocumentRawFormat, Corpus
+from autom_labeling_library.entity import EntityObject
+from autom_labeling_library.preprocessing import Preprocessing
+from autom_labeling_library import extract_storage
+from autom_labeling_library import sqlite_store
+from autom_labeling_library.sqlite_store import SQLiteStore
+from .status import Status
+
+try:
+    import fcntl # only available on Unix, needed for running multiple worker processes
+except ImportError:
+    fcntl = None
+
+UNUSED_UPLOAD_MIN_AGE = 3600 # seconds before an uploaded file that no document refers to is removed
 
 class Memory:
     """
@@ -35,6 +60,11 @@ class Memory:
     objects are stored on disc and loaded on startup). All other objects
     are recomputed on start or when given by the user (and then cached).
     
+    By default, everything is stored in separate files in the instance
+    directory. If STORAGE_BACKEND = "sqlite" is set in the instance config,
+    settings, documents and extractions are stored in one SQLite database
+    (SQLITE_PATH, default instance/anea.sqlite) instead.
+    
     As the caching adds certain dependencies, objects should be 
     accessed and changed via the getter/setter/updated methods
     and not directly.
@@ -52,9 +82,41 @@ class Memory:
         self._extraction_entries = [] 
         
         self._documents = None # loaded from disk or created empty if does not exist yet
+        self._tokenization_cache_keys = weakref.WeakKeyDictionary() # Document -> key of its tokenization cache
+        self._stored_tokenization_cache_keys = {} # file name -> key of the stored tokenization cache
+        self._stored_post_editing_rules = {} # file name -> (key, tuple of the rules) as stored
         self._settings = None # loaded from disk or created default if does not exist yet
         
-        self._lock_extraction_saving = Lock() # During saving, the extractions are temporarly set to null to store them in two separate files. Use lock to prevent errors when saving twice at the same time. TODO Refactor to not setting to null
+        self._store = None # SQLiteStore if the SQLite backend is used, otherwise files are used
+        if app.config.get("STORAGE_BACKEND", "files") == "sqlite":
+            self._store = SQLiteStore(app.config.get("SQLITE_PATH", os.path.join(app.instance_path, "anea.sqlite")))
+        
+        # extractions are saved by a background thread (write-behind), 
+        # repeated saves of the same extraction are coalesced
+        self._pending_extraction_saves = {} # identifier -> (config as pickled bytes or None, extracts or None)
+        self._num_extraction_saves_in_progress = 0
+        self._condition_extraction_saving = Condition()
+        Thread(target=self._save_extractions_in_background, name="extraction_saving", daemon=True).start()
+        atexit.register(self.flush)
+        
+        self._lock_extraction_loading = Lock() # protects the state changes of the extraction entries when loading in the background
+        self._condition_extraction_loaded = Condition(self._lock_extraction_loading) # notified when an entry stopped loading
+        self._extraction_loading_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="extraction_loading")
+        
+        # Several worker processes (e.g. gunicorn workers) can share the instance
+        # directory. Writes are serialized by a file lock and each write increases 
+        # the generation of the changed part (settings, documents, extractions,
+        # the labels of each document) in the generation file. Before each request, a worker reloads the
+        # parts that were changed by other workers (see sync_with_other_workers).
+        # The extracts are memory-mapped, so all workers share them via the page cache.
+        self._multi_worker = app.config.get("MULTI_WORKER", False)
+        if self._multi_worker and fcntl is None:
+            raise Exception("Running multiple worker processes is only supported on Unix systems.")
+        self._lock_instance_writing = RLock()
+        self._instance_writing_depth = 0
+        self._instance_writing_parts = set()
+        self._lock_sync = Lock()
+        self._generations = self._read_generations()
         
         self._load_from_disk()
     
@@ -65,16 +127,128 @@ class Memory:
     
     def _load_settings(self):
         file_path = os.path.join(self._app.instance_path, "settings.pkl")
-        if os.path.isfile(file_path):
+        if self._store is not None:
+            self._settings = self._store.load_value("settings")
+        elif os.path.isfile(file_path):
             with open(file_path, "rb") as input_file:
                 self._settings = pickle.load(input_file)
+        
+        if self._settings is not None:
+            # settings stored by an older version might miss newer settings
+            default_settings = Settings.create_default_settings(default_directory=self._app.instance_path)
+            for key, value in vars(default_settings).items():
+                if not hasattr(self._settings, key):
+                    setattr(self._settings, key, value)
         else:
             self._settings = Settings.create_default_settings(default_directory=self._app.instance_path)
             self.save_settings()
         
     def save_settings(self):
-        with self._app.open_instance_resource("settings.pkl", "wb") as output_file:                
-            pickle.dump(self._settings, output_file)
+        with self._instance_write_lock("settings"):
+            if self._store is not None:
+                self._store.save_value("settings", self._settings)
+            else:
+                self._write_instance_file("settings.pkl", pickle.dumps(self._settings))
+    
+    def _write_instance_file(self, file_name, data):
+        """ Writes the data to a temporary file first and then replaces
+            the file in the instance directory. A crash while writing
+            does not corrupt the existing file.
+        """
+        file_path = os.path.join(self._app.instance_path, file_name)
+        temp_file_path = file_path + ".tmp"
+        with self._instance_write_lock():
+            with open(temp_file_path, "wb") as output_file:
+                output_file.write(data)
+                output_file.flush()
+                os.fsync(output_file.fileno())
+            os.replace(temp_file_path, file_path)
+    
+    @contextmanager
+    def _instance_write_lock(self, part=None):
+        """ Context manager for changing files in the instance directory.
+            Only one thread of one worker process writes at a time (a file 
+            lock is used if multiple workers are running). Can be nested.
+            part: "settings", "documents", "extractions" or the labels
+            part of a document (see _save_labels) if this change needs
+            to be reloaded by the other workers. 
+        """
+        with self._lock_instance_writing:
+            if self._instance_writing_depth == 0 and self._multi_worker:
+                self._instance_lock_file = open(os.path.join(self._app.instance_path, "write.lock"), "w")
+                fcntl.flock(self._instance_lock_file, fcntl.LOCK_EX)
+            self._instance_writing_depth += 1
+            if part is not None:
+                self._instance_writing_parts.add(part)
+            try:
+                yield
+            finally:
+                self._instance_writing_depth -= 1
+                if self._instance_writing_depth == 0:
+                    if self._multi_worker:
+                        try:
+                            if len(self._instance_writing_parts) > 0:
+                                self._increase_generations(self._instance_writing_parts)
+                        finally:
+                            fcntl.flock(self._instance_lock_file, fcntl.LOCK_UN)
+                            self._instance_lock_file.close()
+                    self._instance_writing_parts = set()
+    
+    def _get_generations_filename(self):
+        return os.path.join(self._app.instance_path, "generations.json")
+    
+    def _read_generations(self):
+        """ Returns the number of changes of each part of the
+            instance data (stored in the generations file).
+        """
+        if not self._multi_worker:
+            return {}
+        try:
+            with open(self._get_generations_filename(), "r") as input_file:
+                return json.load(input_file)
+        except (OSError, ValueError): # file does not exist yet or is being replaced
+            return {}
+    
+    def _increase_generations(self, parts):
+        """ Must hold the instance write lock """
+        generations = self._read_generations()
+        for part in parts:
+            generations[part] = generations.get(part, 0) + 1
+        
+        temp_file_path = self._get_generations_filename() + ".tmp"
+        with open(temp_file_path, "w") as output_file:
+            json.dump(generations, output_file)
+        os.replace(temp_file_path, self._get_generations_filename())
+        
+        # own changes do not need to be reloaded, changes of others that 
+        # have not been synced yet are still detected for the other parts
+        for part in parts:
+            self._generations[part] = generations[part]
+    
+    def sync_with_other_workers(self):
+        """ Reloads the settings, documents and extractions that
+            were changed by other worker processes since the last sync.
+            Called before each request if multiple workers are running.
+        """
+        if not self._multi_worker:
+            return
+        with self._lock_sync:
+            generations = self._read_generations()
+            changed_parts = [part for part, generation in generations.items() 
+                             if self._generations.get(part) != generation]
+            if len(changed_parts) == 0:
+                return
+            self._generations.update(generations)
+            
+            if "settings" in changed_parts:
+                self._settings = None
+                self._load_settings()
+            if "documents" in changed_parts or "settings" in changed_parts:
+                self._load_documents()
+            else:
+                self._reload_changed_labels([part for part in changed_parts if part.startswith("labels_")])
+            if "extractions" in changed_parts:
+                self._reload_extractions()
     
     def get_settings(self):
         return self._settings
@@ -82,24 +256,318 @@ class Memory:
     def _load_documents(self):
         file_path = os.path.join(self._app.instance_path, "documents.pkl")
         self._documents = {}
+        self._tokenization_cache_keys = weakref.WeakKeyDictionary() # the settings might have changed
         
-        if os.path.isfile(file_path):
+        # each entry is (document_type, raw format, raw text, name, raw text path).
+        # The name is only set for the documents of a corpus. The raw text
+        # of uploaded files is kept on disk (raw text path) instead.
+        # Older versions stored only the first three or four elements.
+        document_information = []
+        if self._store is not None:
+            document_information = [(DocumentType(document_type), DocumentRawFormat(document_raw_format), document_raw_text, 
+                                     document_name, raw_text_path)
+                                    for document_type, document_raw_format, document_raw_text, document_name, raw_text_path 
+                                    in self._store.load_documents()]
+        elif os.path.isfile(file_path):
             with open(file_path, "rb") as input_file:
-                document_information = pickle.load(input_file)
+                document_information = [tuple(entry) + (None,) * (5 - len(entry)) for entry in pickle.load(input_file)]
+                
+        if len(document_information) > 0:
+            from .text_input import create_document
+            corpora = {}
+            for document_type, document_raw_format, document_raw_text, document_name, raw_text_path in document_information:
+                if raw_text_path is not None:
+                    raw_text_path = os.path.join(self._app.instance_path, raw_text_path) # stored relative to the instance directory
+                if raw_text_path is not None and not os.path.isfile(raw_text_path):
+                    print(f"The uploaded file {raw_text_path} of the {document_type.value} document does not exist anymore.")
+                    continue
                 
-            from .text_input import process_input_text
-            for document_type, document_raw_format, document_raw_text in document_information:
-                process_input_text(document_raw_text, document_raw_format, document_type)
+                corpus_document_idx = None
+                if document_name is not None:
+                    corpus = corpora.setdefault(document_type, Corpus())
+                    corpus_document_idx = len(corpus.documents)
+                
+                document = self._load_tokenization_cache(document_type, document_raw_format, document_raw_text, 
+                                                         corpus_document_idx, raw_text_path)
+                if document is None:
+                    document = create_document(document_raw_text, document_raw_format, document_type, raw_text_path=raw_text_path)
+                    if document is None:
+                        continue
+                    self._save_tokenization_cache(document_type, document, corpus_document_idx)
+                self._load_post_editing_rules(document_type, document, corpus_document_idx)
+                if self._multi_worker:
+                    self._load_labels(document_type, document, corpus_document_idx)
+                
+                if corpus_document_idx is None:
+                    self.set_document(document_type, document)
+                else:
+                    corpus.add_document(document_name, document)
+            
+            for document_type, corpus in corpora.items():
+                self.set_document(document_type, corpus)
+    
+    def get_new_upload_path(self, filename):
+        """ A new path in the instance directory to store an uploaded file """
+        upload_directory = os.path.join(self._app.instance_path, "uploads")
+        os.makedirs(upload_directory, exist_ok=True)
+        return os.path.join(upload_directory, "{}_{}".format(uuid.uuid4().hex, secure_filename(filename)))
+    
+    def _remove_unused_uploads(self, used_paths):
+        """ Removes uploaded files that no document refers to anymore. Files
+            that were just uploaded (possibly by another worker) are kept.
+        """
+        upload_directory = os.path.join(self._app.instance_path, "uploads")
+        if not os.path.isdir(upload_directory):
+            return
+        used_paths = set(os.path.abspath(path) for path in used_paths)
+        for filename in os.listdir(upload_directory):
+            path = os.path.abspath(os.path.join(upload_directory, filename))
+            try:
+                if path not in used_paths and time.time() - os.path.getmtime(path) > UNUSED_UPLOAD_MIN_AGE:
+                    os.remove(path)
+            except OSError as e:
+                print(f"Could not remove the unused upload {path}: {e}")
+    
+    def _iter_single_documents(self, document):
+        """ Yields (index in the corpus or None, name or None, Document) for
+            the document or each document of a corpus.
+        """
+        if isinstance(document, Corpus):
+            for corpus_document_idx, (name, corpus_document) in enumerate(zip(document.document_names, document.documents)):
+                yield corpus_document_idx, name, corpus_document
+        else:
+            yield None, None, document
     
     def _save_documents(self):
         # do not store whole document objects as it contains references
         # to EntityName objects, etc. Difficult to store.
         to_store = []
+        with self._instance_write_lock("documents"):
+            for document_type, document in self._documents.items():
+                for corpus_document_idx, name, single_document in self._iter_single_documents(document):
+                    raw_text_path = single_document.raw_text_path
+                    if raw_text_path is not None:
+                        raw_text_path = os.path.relpath(raw_text_path, self._app.instance_path)
+                    to_store.append([document_type, single_document.document_raw_format, single_document.raw_text, 
+                                     name, raw_text_path])
+                    self._save_tokenization_cache(document_type, single_document, corpus_document_idx, only_if_changed=True)
+                    self._save_post_editing_rules(document_type, single_document, corpus_document_idx, only_if_changed=True)
+            
+            if self._store is not None:
+                self._store.save_documents([(document_type.value, DocumentRawFormat(document_raw_format).value, document_raw_text, name, raw_text_path)
+                                            for document_type, document_raw_format, document_raw_text, name, raw_text_path in to_store])
+            else:
+                self._write_instance_file("documents.pkl", pickle.dumps(to_store))
+            
+            self._remove_unused_uploads([os.path.join(self._app.instance_path, entry[4]) for entry in to_store if entry[4] is not None])
+    
+    def updated_document_labels(self, document_type, corpus_document_indices=None):
+        """ Tell the Memory system that the automatic labels of the 
+            document changed (annotation or post-editing). The 
+            post-editing rules are stored. The labels are only stored 
+            if multiple workers are running so that the other workers
+            see the same labels. The matches are only kept by the worker 
+            that annotated the document.
+            corpus_document_indices: if the document is a corpus, the
+            indices of the changed documents (None if all changed).
+        """
+        with self._instance_write_lock():
+            for corpus_document_idx, _, single_document in self._iter_single_documents(self._documents[document_type]):
+                if corpus_document_indices is not None and corpus_document_idx not in corpus_document_indices:
+                    continue
+                self._save_post_editing_rules(document_type, single_document, corpus_document_idx)
+                if self._multi_worker:
+                    self._save_labels(document_type, single_document, corpus_document_idx)
+    
+    def _get_labels_filename(self, document_type, corpus_document_idx=None):
+        if corpus_document_idx is not None:
+            return "labels_{}_{}.pkl".format(document_type.value, corpus_document_idx)
+        return "labels_{}.pkl".format(document_type.value)
+    
+    def _save_labels(self, document_type, document, corpus_document_idx=None):
+        """ Stores the automatic labels and post-editing rules of one 
+            document so that the other workers can reload only this
+            document. Each document is its own part in the generations
+            file (named like the file), the file also contains the 
+            generation of the change.
+        """
+        file_name = self._get_labels_filename(document_type, corpus_document_idx)
+        part = file_name[:-len(".pkl")]
+        with self._instance_write_lock(part):
+            data = {"key": self._get_document_tokenization_cache_key(document),
+                    "generation": self._read_generations().get(part, 0) + 1, # increased when releasing the lock
+                    "autom_labels": document.autom_labels,
+                    "rules": document.post_editing_rules.rules}
+            self._write_instance_file(file_name, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    
+    def _load_labels(self, document_type, document, corpus_document_idx=None):
+        """ Loads the labels stored by _save_labels if they belong to
+            the same raw text and tokenization as the document.
+        """
+        file_name = self._get_labels_filename(document_type, corpus_document_idx)
+        file_path = os.path.join(self._app.instance_path, file_name)
+        if not os.path.isfile(file_path):
+            return
+        
+        try:
+            with open(file_path, "rb") as input_file:
+                data = pickle.load(input_file)
+        except Exception as e:
+            print(f"Could not load the labels {file_path}: {e}")
+            return
+        
+        part = file_name[:-len(".pkl")]
+        self._generations[part] = max(self._generations.get(part, 0), data["generation"])
+        if data["key"] != self._get_document_tokenization_cache_key(document):
+            return
+        # a new list, so cached evaluations of the old labels are not used
+        document.autom_labels = list(data["autom_labels"]) if data["autom_labels"] is not None else None
+        document.post_editing_rules.rules = data["rules"]
+        document.matches = None # only kept by the worker that annotated the document
+        document.possible_matches = None
+    
+    def _reload_changed_labels(self, changed_parts):
+        """ Reloads the labels of the documents whose part (see _save_labels) 
+            was changed by another worker.
+        """
+        if len(changed_parts) == 0:
+            return
+        changed_parts = set(changed_parts)
         for document_type, document in self._documents.items():
-            to_store.append([document_type, document.document_raw_format, document.raw_text])
+            for corpus_document_idx, _, single_document in self._iter_single_documents(document):
+                if self._get_labels_filename(document_type, corpus_document_idx)[:-len(".pkl")] in changed_parts:
+                    self._load_labels(document_type, single_document, corpus_document_idx)
+    
+    def _get_post_editing_rules_filename(self, document_type, corpus_document_idx=None):
+        if corpus_document_idx is not None:
+            return "post_editing_rules_{}_{}.pkl".format(document_type.value, corpus_document_idx)
+        return "post_editing_rules_{}.pkl".format(document_type.value)
+    
+    def _save_post_editing_rules(self, document_type, document, corpus_document_idx=None, only_if_changed=False):
+        """ The rules are only valid for the same raw text and 
+            tokenization, they use the key of the tokenization cache.
+            With only_if_changed, the rules are not written if the
+            same rules are already stored (e.g. for the documents
+            that were not changed).
+        """
+        file_name = self._get_post_editing_rules_filename(document_type, corpus_document_idx)
+        key = self._get_document_tokenization_cache_key(document)
+        rules = tuple(document.post_editing_rules.rules)
+        if only_if_changed and file_name in self._stored_post_editing_rules:
+            stored_key, stored_rules = self._stored_post_editing_rules[file_name]
+            if stored_rules == rules and (stored_key == key or len(rules) == 0): # no rules are valid for any key
+                return
         
-        with self._app.open_instance_resource("documents.pkl", "wb") as output_file:                
-            pickle.dump(to_store, output_file)
+        data = {"key": key,
+                "rules": document.post_editing_rules.rules}
+        with self._instance_write_lock():
+            self._write_instance_file(file_name, pickle.dumps(data))
+        self._stored_post_editing_rules[file_name] = (key, rules)
+    
+    def _load_post_editing_rules(self, document_type, document, corpus_document_idx=None):
+        file_name = self._get_post_editing_rules_filename(document_type, corpus_document_idx)
+        file_path = os.path.join(self._app.instance_path, file_name)
+        if not os.path.isfile(file_path):
+            self._stored_post_editing_rules[file_name] = (None, ())
+            return
+        
+        try:
+            with open(file_path, "rb") as input_file:
+                data = pickle.load(input_file)
+        except Exception as e:
+            print(f"Could not load the post-editing rules {file_path}: {e}")
+            return
+        
+        self._stored_post_editing_rules[file_name] = (data["key"], tuple(data["rules"]))
+        if data["key"] == self._get_document_tokenization_cache_key(document):
+            document.post_editing_rules.rules = data["rules"]
+    
+    def get_num_matching_processes(self):
+        """ Number of processes used to match the documents of a corpus """
+        return self._app.config.get("NUM_MATCHING_PROCESSES", 1)
+    
+    def _get_tokenization_cache_key(self, document_raw_format, document_raw_text, raw_text_path=None):
+        """ The cached tokens of a document are only valid for the same
+            raw text, the same preprocessing settings and the same
+            version of the tokenizer. Uploaded files are not changed
+            after upload, so their path, size and modification time
+            identify the raw text.
+        """
+        settings = self._settings
+        if raw_text_path is not None:
+            raw_text_stat = os.stat(raw_text_path)
+            raw_text_key = [os.path.basename(raw_text_path), raw_text_stat.st_size, raw_text_stat.st_mtime_ns]
+        else:
+            raw_text_key = hashlib.sha1(document_raw_text.encode("utf-8")).hexdigest()
+        key_elements = [DocumentRawFormat(document_raw_format).value,
+                        settings.spacy_tokenizer_language_code,
+                        settings.lemmatize,
+                        settings.remove_diacritics,
+                        Preprocessing.get_tokenizer_version(settings.spacy_tokenizer_language_code),
+                        raw_text_key]
+        return hashlib.sha1(repr(key_elements).encode("utf-8")).hexdigest()
+    
+    def _get_document_tokenization_cache_key(self, document):
+        """ The key of the tokenization cache of the document, only
+            computed once per document (hashing the raw text is expensive).
+        """
+        key = self._tokenization_cache_keys.get(document)
+        if key is None:
+            key = self._get_tokenization_cache_key(document.document_raw_format, document.raw_text, document.raw_text_path)
+            self._tokenization_cache_keys[document] = key
+        return key
+        
+    def _get_tokenization_cache_filename(self, document_type, corpus_document_idx=None):
+        if corpus_document_idx is not None:
+            return "tokenization_{}_{}.pkl".format(document_type.value, corpus_document_idx)
+        return "tokenization_{}.pkl".format(document_type.value)
+    
+    def _save_tokenization_cache(self, document_type, document, corpus_document_idx=None, only_if_changed=False):
+        """ Stores the tokens (and labels from the input) of the given
+            document so that it does not need to be tokenized again
+            on the next start. With only_if_changed, the cache is not
+            written if the stored cache already has the same key (i.e. 
+            the same raw text and settings).
+        """
+        file_name = self._get_tokenization_cache_filename(document_type, corpus_document_idx)
+        key = self._get_document_tokenization_cache_key(document)
+        if only_if_changed and self._stored_tokenization_cache_keys.get(file_name) == key:
+            return
+        
+        cache = {"key": key,
+                 "tokens": document.tokens,
+                 "gold_labels": document.gold_labels,
+                 "autom_labels": document.autom_labels}
+        with self._instance_write_lock("documents"):
+            self._write_instance_file(file_name, pickle.dumps(cache, protocol=pickle.HIGHEST_PROTOCOL))
+        self._stored_tokenization_cache_keys[file_name] = key
+    
+    def _load_tokenization_cache(self, document_type, document_raw_format, document_raw_text, corpus_document_idx=None, raw_text_path=None):
+        """ Returns the document with the cached tokens or None if there
+            is no cache or if it is outdated (e.g. the settings changed).
+        """
+        file_name = self._get_tokenization_cache_filename(document_type, corpus_document_idx)
+        file_path = os.path.join(self._app.instance_path, file_name)
+        if not os.path.isfile(file_path):
+            return None
+        
+        try:
+            with open(file_path, "rb") as input_file:
+                cache = pickle.load(input_file)
+        except Exception as e:
+            print(f"Could not load the tokenization cache {file_path}: {e}")
+            return None
+        
+        if cache["key"] != self._get_tokenization_cache_key(document_raw_format, document_raw_text, raw_text_path):
+            return None
+        self._stored_tokenization_cache_keys[file_name] = cache["key"]
+        
+        document = Document(document_raw_text, DocumentRawFormat(document_raw_format), raw_text_path)
+        self._tokenization_cache_keys[document] = cache["key"]
+        document.tokens = cache["tokens"]
+        document.gold_labels = cache["gold_labels"]
+        document.autom_labels = cache["autom_labels"]
+        return document
             
     def raw_documents_changed(self):
         """ Only storing raw document data """
@@ -122,61 +590,330 @@ class Memory:
     def get_extraction_entries(self):
         return self._extraction_entries
     
+    def _get_stored_extraction_identifiers(self):
+        if self._store is not None:
+            return self._store.get_extraction_identifiers()
+        identifiers = []
+        for f in os.listdir(self._app.instance_path):
+            if f.startswith("extraction_") and f.endswith("_config.pkl"):
+                identifiers.append(f[len("extraction_"):-len("_config.pkl")]) # get the identifier in the filename
+        return identifiers
+    
     def _load_extractions(self):
         # load all extraction objects
-        all_files = os.listdir(self._app.instance_path)
         self._extraction_entries = [] # get the identifiers for the extraction objects
-        for f in all_files:
-            if f.startswith("extraction_") and f.endswith("_config.pkl"):
-                identifier = f[len("extraction_"):-len("_config.pkl")] # get the identifier in the filename
-                self._extraction_entries.append(ExtractionEntry(identifier))
+        for identifier in self._get_stored_extraction_identifiers():
+            self._extraction_entries.append(ExtractionEntry(identifier))
         
         for extraction_entry in self._extraction_entries:
             extraction_entry.load_extraction(self, load_configuration=True, load_extracts=False) # only load configuration for quicker start up
         self._sort_extraction_entries() 
     
+    def _reload_extractions(self):
+        """ Takes over the extractions as stored by other worker processes.
+            Configurations are updated in place, loaded extracts are kept 
+            unless they were changed and extractions that were added, 
+            removed or renamed are updated correspondingly.
+        """
+        self.flush()
+        with self._lock_extraction_loading:
+            old_extraction_entries = {entry.identifier: entry for entry in self._extraction_entries}
+            extraction_entries = []
+            for identifier in self._get_stored_extraction_identifiers():
+                extraction_entry = old_extraction_entries.get(identifier)
+                if extraction_entry is None:
+                    extraction_entry = ExtractionEntry(identifier)
+                    extraction_entry.load_extraction(self, load_configuration=True, load_extracts=False)
+                elif extraction_entry.state != ExtractionEntryState.LOADING: # loading entries are updated on the next sync
+                    extraction_entry.reload_configuration(self)
+                    if extraction_entry.state == ExtractionEntryState.LOADED and extraction_entry.extracts_changed_on_disk(self):
+                        extraction_entry.unload_extraction(self)
+                extraction_entries.append(extraction_entry)
+            self._extraction_entries = extraction_entries
+            self._sort_extraction_entries()
+        self.invalidate_autom_annotation_cache()
+    
+    def load_extraction_entries_in_background(self, extraction_entries):
+        """ Loads the extracts of the given extraction entries in 
+            background threads. Several extractions are loaded in parallel.
+            The entries are in the state LOADING until their extracts
+            are available. Entries that are already loaded or loading
+            are skipped.
+        """
+        for extraction_entry in extraction_entries:
+            with self._lock_extraction_loading:
+                if extraction_entry.state != ExtractionEntryState.NOT_LOADED:
+                    continue
+                extraction_entry.state = ExtractionEntryState.LOADING
+            self._extraction_loading_executor.submit(self._load_extraction_entry_in_background, extraction_entry)
+    
+    def _load_extraction_entry_in_background(self, extraction_entry):
+        try:
+            extraction_entry.load_extracts(self)
+        except Exception as e:
+            print("Exception occured. The stacktrace: " + traceback.format_exc())
+            Status.get_instance().set_state_error()
+            Status.get_instance().set_message(f"Loading extraction {extraction_entry.identifier} failed: {str(e)}")
+        finally:
+            with self._condition_extraction_loaded:
+                self._condition_extraction_loaded.notify_all()
+        
+        if extraction_entry.state == ExtractionEntryState.LOADED:
+            self.enforce_memory_budget(keep=[extraction_entry])
+    
+    def load_active_extractions(self):
+        """ Loads the extracts of all active extractions that are not 
+            loaded yet (e.g. before the automatic annotation). To stay within
+            the memory budget, other extractions might be unloaded.
+            Blocks until all extractions are loaded. Raises an exception
+            if the extracts of an active extraction could not be loaded.
+            Returns the active extraction entries.
+        """
+        active_entries = [extraction_entry for extraction_entry in self._extraction_entries
+                          if extraction_entry.extraction.get_property("active")]
+        
+        for extraction_entry in active_entries:
+            with self._lock_extraction_loading:
+                if extraction_entry.state != ExtractionEntryState.NOT_LOADED:
+                    continue
+                extraction_entry.state = ExtractionEntryState.LOADING
+            try:
+                extraction_entry.load_extracts(self)
+            finally:
+                with self._condition_extraction_loaded:
+                    self._condition_extraction_loaded.notify_all()
+            self.enforce_memory_budget(keep=active_entries)
+        
+        # wait for extractions that are loaded by the background threads
+        with self._condition_extraction_loaded:
+            self._condition_extraction_loaded.wait_for(
+                lambda: all(extraction_entry.state != ExtractionEntryState.LOADING for extraction_entry in active_entries))
+        
+        failed_entries = [extraction_entry for extraction_entry in active_entries 
+                          if extraction_entry.state != ExtractionEntryState.LOADED]
+        if len(failed_entries) > 0:
+            raise Exception("Could not load the active extractions " + 
+                            ", ".join(f"{extraction_entry.identifier} ({extraction_entry.load_error})" for extraction_entry in failed_entries))
+        
+        for extraction_entry in active_entries:
+            extraction_entry.last_used = time.time()
+        return active_entries
+    
+    @contextmanager
+    def using_extraction_entries(self, extraction_entries):
+        """ Context manager for using the extracts of the given entries 
+            (e.g. in a job). While it is active, the entries are not
+            unloaded to stay within the memory budget.
+        """
+        with self._lock_extraction_loading:
+            for extraction_entry in extraction_entries:
+                extraction_entry.num_users += 1
+        try:
+            yield extraction_entries
+        finally:
+            with self._lock_extraction_loading:
+                for extraction_entry in extraction_entries:
+                    extraction_entry.num_users -= 1
+            self.enforce_memory_budget()
+    
+    def get_memory_usage(self):
+        """ Returns the estimated number of bytes used by all loaded extracts.
+        """
+        return sum([extraction_entry.get_memory_size() for extraction_entry in self._extraction_entries
+                    if extraction_entry.state == ExtractionEntryState.LOADED])
+    
+    def enforce_memory_budget(self, keep=()):
+        """ If the loaded extracts use more memory than the memory budget
+            from the settings, unloads extractions until the budget is met. 
+            Inactive extractions are unloaded first, then the least recently 
+            used ones. The extraction entries given in keep and the ones 
+            that are in use (see using_extraction_entries) are not unloaded.
+        """
+        memory_budget = self._settings.memory_budget_mb * 1024 * 1024
+        if memory_budget < 0: # no budget
+            return
+        
+        with self._lock_extraction_loading:
+            candidates = [extraction_entry for extraction_entry in self._extraction_entries
+                          if extraction_entry.state == ExtractionEntryState.LOADED and extraction_entry not in keep
+                          and extraction_entry.num_users == 0]
+            candidates.sort(key=lambda extraction_entry: (extraction_entry.extraction.get_property("active"),
+                                                          extraction_entry.last_used))
+            
+            memory_usage = self.get_memory_usage()
+            for extraction_entry in candidates:
+                if memory_usage <= memory_budget:
+                    break
+                memory_usage -= extraction_entry.get_memory_size()
+                extraction_entry.unload_extraction(self)
+                print(f"Unloaded extraction {extraction_entry.identifier} to stay within the memory budget.")
+        
+        if memory_usage > memory_budget:
+            print(f"Loaded extractions use more than the memory budget of {self._settings.memory_budget_mb} MB.")
+    
+    def unload_extraction_entries(self, extraction_entries):
+        """ Unloads the extracts of the given entries, except for the ones
+            that are in use (see using_extraction_entries). Returns the 
+            entries that stayed loaded because they are in use.
+        """
+        in_use = []
+        with self._lock_extraction_loading:
+            for extraction_entry in extraction_entries:
+                if extraction_entry.state != ExtractionEntryState.LOADED:
+                    continue
+                if extraction_entry.num_users > 0:
+                    in_use.append(extraction_entry)
+                else:
+                    extraction_entry.unload_extraction(self)
+        return in_use
+    
+    def get_loading_progress(self):
+        """ Returns for each extraction entry that is currently loading a 
+            dictionary with the number of bytes already loaded and 
+            the percentage.
+        """
+        progress = []
+        for extraction_entry in self._extraction_entries:
+            if extraction_entry.state == ExtractionEntryState.LOADING:
+                if extraction_entry.bytes_total > 0:
+                    percent = int(extraction_entry.bytes_loaded / extraction_entry.bytes_total * 100)
+                else:
+                    percent = 0
+                progress.append({"identifier": extraction_entry.identifier,
+                                 "bytes_loaded": extraction_entry.bytes_loaded,
+                                 "bytes_total": extraction_entry.bytes_total,
+                                 "percent": percent})
+        return progress
+    
+    def get_loading_errors(self):
+        """ Returns for each extraction entry whose extracts could not be
+            loaded a dictionary with the identifier and the error message.
+        """
+        return [{"identifier": extraction_entry.identifier, "error_msg": extraction_entry.load_error}
+                for extraction_entry in self._extraction_entries
+                if extraction_entry.state == ExtractionEntryState.NOT_LOADED and extraction_entry.load_error is not None]
+    
     def _save_extraction(self, extraction_identifier, save_config = True, save_extracts = True):
         """
             Saves the specified extraction specified by the given extraction_identifier
             to disc. The extraction object must be part of self._extractions.
-            Pickles the object into
-            a file. Each extraction object gets its
-            own file to be able to update them independently.
+            Each extraction object gets its own files (configuration
+            and extracts) to be able to update them independently.
+            
+            The configuration is pickled directly, the actual writing 
+            happens in a background thread. The extracts are only written
+            if names were added since they were last saved.
         """
-        self._lock_extraction_saving.acquire()
-        
-        file_name_config, file_name_extracts = self._get_extraction_filename(extraction_identifier)
-        
-        # temporarily separate WikiDataNameExtraction object and its
-        # extracts to store them separately
         extraction = self.get_extraction_from_identifier(extraction_identifier)
-        extracts = extraction._extracts
-        extraction._extracts = None # TODO: Implement saving in special method to not having to do that
+        _, file_name_extracts = self._get_extraction_filename(extraction_identifier, absolute=True)
         
+        config = None
         if save_config:
-            with self._app.open_instance_resource(file_name_config, "wb") as output_file:
-                pickle.dump(extraction, output_file)
-                
-        if save_extracts:
-            with self._app.open_instance_resource(file_name_extracts, "wb") as output_file:
-                pickle.dump(extracts, output_file)
+            config = pickle.dumps(extraction) # does not contain the extracts, see WikiDataNameExtraction.__getstate__
         
-        extraction._extracts = extracts
+        if self._store is not None:
+            extracts_exist = self._store.has_extraction(extraction_identifier)
+        else:
+            extracts_exist = os.path.isfile(file_name_extracts)
         
-        self._lock_extraction_saving.release()
+        extracts = None
+        if save_extracts and extraction._extracts is not None and \
+            (extraction._extracts_changed or not extracts_exist):
+            # shallow copy so that further added names do not change the saved state
+            # (views of stored extracts only grow at the end)
+            extracts = {}
+            for key, entity_names in extraction._extracts.items():
+                extracts[key] = list(entity_names) if isinstance(entity_names, list) else entity_names
+            extraction._extracts_changed = False
+        
+        if config is None and extracts is None:
+            return
+        
+        with self._condition_extraction_saving:
+            # coalesce with a save of the same extraction that has not been written yet
+            pending_config, pending_extracts = self._pending_extraction_saves.get(extraction_identifier, (None, None))
+            self._pending_extraction_saves[extraction_identifier] = (config if config is not None else pending_config,
+                                                                     extracts if extracts is not None else pending_extracts)
+            self._condition_extraction_saving.notify_all()
+    
+    def _save_extractions_in_background(self):
+        while True:
+            with self._condition_extraction_saving:
+                while len(self._pending_extraction_saves) == 0:
+                    self._condition_extraction_saving.wait()
+                pending_extraction_saves = self._pending_extraction_saves
+                self._pending_extraction_saves = {}
+                self._num_extraction_saves_in_progress = len(pending_extraction_saves)
+            
+            for extraction_identifier, (config, extracts) in pending_extraction_saves.items():
+                try:
+                    self._write_extraction(extraction_identifier, config, extracts)
+                except Exception as e:
+                    print("Exception occured. The stacktrace: " + traceback.format_exc())
+                    Status.get_instance().set_state_error()
+                    Status.get_instance().set_message(f"Saving extraction {extraction_identifier} failed: {str(e)}")
+            
+            with self._condition_extraction_saving:
+                self._num_extraction_saves_in_progress = 0
+                self._condition_extraction_saving.notify_all()
+    
+    def _write_extraction(self, extraction_identifier, config, extracts):
+        with self._instance_write_lock("extractions"):
+            if self._store is not None:
+                if config is not None:
+                    self._store.save_extraction_config(extraction_identifier, config)
+                if extracts is not None:
+                    self._store.save_extracts(extraction_identifier, extracts)
+                return
+            
+            file_name_config, file_name_extracts = self._get_extraction_filename(extraction_identifier)
+            
+            if config is not None:
+                self._write_instance_file(file_name_config, config)
+                    
+            if extracts is not None:
+                file_name_extracts = os.path.join(self._app.instance_path, file_name_extracts)
+                extract_storage.write_extracts(file_name_extracts, extracts)
+                
+                # extracts in the old (pickle) format are replaced by the new file
+                legacy_file_name_extracts = self._get_legacy_extraction_extracts_filename(extraction_identifier, absolute=True)
+                if os.path.isfile(legacy_file_name_extracts):
+                    os.remove(legacy_file_name_extracts)
+                
+                for extraction_entry in self._extraction_entries:
+                    if extraction_entry.identifier == extraction_identifier and extraction_entry.extracts_file_stat is not None:
+                        # own change, the loaded extracts are up to date
+                        extraction_entry.extracts_file_stat = os.stat(file_name_extracts)
+    
+    def flush(self):
+        """ Blocks until all pending saves of extractions are written to disk.
+        """
+        with self._condition_extraction_saving:
+            while len(self._pending_extraction_saves) > 0 or self._num_extraction_saves_in_progress > 0:
+                self._condition_extraction_saving.wait()
         
     def _get_extraction_filename(self, extraction_identifier, absolute=False):
         """ 
             Returns the config and extracts filename for a given identifier
         """
         file_name_config = "extraction_{}_config.pkl".format(extraction_identifier)
-        file_name_extracts = "extraction_{}_extracts.pkl".format(extraction_identifier)
+        file_name_extracts = "extraction_{}_extracts.bin".format(extraction_identifier)
         
         if absolute:
             file_name_config = os.path.join(self._app.instance_path, file_name_config)
             file_name_extracts = os.path.join(self._app.instance_path, file_name_extracts)
             
         return file_name_config, file_name_extracts
+    
+    def _get_legacy_extraction_extracts_filename(self, extraction_identifier, absolute=False):
+        """ 
+            Returns the filename of extracts that were stored as pickled
+            EntityName objects (before the columnar format was introduced)
+        """
+        file_name_extracts = "extraction_{}_extracts.pkl".format(extraction_identifier)
+        if absolute:
+            file_name_extracts = os.path.join(self._app.instance_path, file_name_extracts)
+        return file_name_extracts
         
     def get_extraction_from_identifier(self, identifier):
         """ Returns the extraction that has this (assumed unique)
@@ -184,6 +921,43 @@ class Memory:
         """
         return self.get_extraction_entry_from_identifier(identifier).extraction
     
+    def find_entity_names(self, first_token=None, entity_identifier=None, limit=100):
+        """ Returns (extraction_identifier, name, entity_identifier, is_alias) 
+            tuples of at most limit entity names that start with the given 
+            token (case-insensitive) and/or belong to the entity with the 
+            given Q-id. With the SQLite backend, this is an indexed query over 
+            all stored extractions. Otherwise, only the loaded extractions 
+            are searched.
+        """
+        if first_token is None and entity_identifier is None:
+            raise Exception("At least one search criterion is necessary.")
+        
+        if self._store is not None:
+            self.flush() # names of pending saves would be missing
+            return self._store.find_entity_names(first_token, entity_identifier, limit=limit)
+        
+        if first_token is not None:
+            first_token = sqlite_store.normalize_first_token(first_token)
+        results = []
+        loaded_entries = [extraction_entry for extraction_entry in self._extraction_entries
+                          if extraction_entry.state == ExtractionEntryState.LOADED]
+        with self.using_extraction_entries(loaded_entries):
+            for extraction_entry in loaded_entries:
+                extracts = extraction_entry.extraction._extracts
+                if extracts is None: # unloaded in the meantime
+                    continue
+                for is_alias, entity_names in [(0, extracts["labels"]), (1, extracts["aliases"])]:
+                    for entity_name in entity_names:
+                        if first_token is not None and sqlite_store.normalize_first_token(entity_name.name) != first_token:
+                            continue
+                        if entity_identifier is not None and entity_name.entity_object.identifier != entity_identifier:
+                            continue
+                        results.append((extraction_entry.identifier, entity_name.name, 
+                                        entity_name.entity_object.identifier, is_alias))
+                        if len(results) == limit:
+                            return results
+        return results
+    
     def update_extraction_identifier(self, extraction):
         """ The properties of an extraction might be changed in a way that
             it needs a new identifier (e.g. if the label is changed).
@@ -202,15 +976,32 @@ class Memory:
                 assert extraction_entry.extraction == extraction
                 extraction_entry.identifier = new_identifier
         
-        old_file_name_config, old_file_name_extracts = self._get_extraction_filename(old_identifier, absolute=True)
-        new_file_name_config, new_file_name_extracts = self._get_extraction_filename(new_identifier, absolute=True)
-        
-        os.rename(old_file_name_config, new_file_name_config)
-        os.rename(old_file_name_extracts, new_file_name_extracts)   
-        
-        self._sort_extraction_entries()  
+        self.flush() # pending saves use the old file names
         
-        extraction.set_identifier(new_identifier)   
+        with self._instance_write_lock("extractions"):
+            if self._store is not None:
+                self._store.rename_extraction(old_identifier, new_identifier)
+                if extraction._extracts is not None:
+                    for entity_names in extraction._extracts.values():
+                        if hasattr(entity_names, "set_identifier"):
+                            entity_names.set_identifier(new_identifier)
+                self._sort_extraction_entries()
+                extraction.set_identifier(new_identifier)
+                return
+            
+            old_file_name_config, old_file_name_extracts = self._get_extraction_filename(old_identifier, absolute=True)
+            new_file_name_config, new_file_name_extracts = self._get_extraction_filename(new_identifier, absolute=True)
+            
+            os.rename(old_file_name_config, new_file_name_config)
+            if os.path.isfile(old_file_name_extracts):
+                os.rename(old_file_name_extracts, new_file_name_extracts)
+            else:
+                os.rename(self._get_legacy_extraction_extracts_filename(old_identifier, absolute=True),
+                          self._get_legacy_extraction_extracts_filename(new_identifier, absolute=True))
+            
+            self._sort_extraction_entries()  
+            
+            extraction.set_identifier(new_identifier)   
         
     def get_extraction_entry_from_identifier(self, identifier):
         """ Returns the extraction entry that has this (assumed unique)
@@ -301,17 +1092,18 @@ class Memory:
         self._load_documents()
     
     def invalidate_autom_annotation_cache(self, documents=None):
-        """ Invalidation of automatic annotation.
-            Currently deactivated as the user might do manual 
-            changes and these would then be lost.
+        """ Invalidation of automatic annotation. The manual 
+            changes are kept as post-editing rules of the documents
+            and applied again after the next annotation.
         """
         if documents == None:
             documents = self._documents.values()
         
-        # Deactivated caching invalidation 
-        # for document in documents:
-        #     document.autom_labels = None
-        #     document.matches = None
+        for document in documents:
+            for _, _, single_document in self._iter_single_documents(document):
+                single_document.autom_labels = None
+                single_document.matches = None
+                single_document.possible_matches = None
 
 class DocumentType(Enum):   
 # TODO Move to own file
@@ -345,8 +1137,28 @@ class Settings:
         settings.use_language_specific_tokenizer_for_entity_names = False
         settings.lemmatize = False
         settings.remove_diacritics = False
+        settings.memory_budget_mb = -1 # RAM for loaded extracts, -1 for no limit
         return settings
                 
+MEMORY_SIZE_SAMPLE_SIZE = 1000 # EntityName objects measured to estimate the memory of a list of names
+
+def estimate_entity_names_memory_size(entity_names):
+    """ Estimated number of bytes used by the EntityName objects of the
+        list (including their names and tokenized names), extrapolated 
+        from a sample of the names.
+    """
+    num_entity_names = len(entity_names)
+    if num_entity_names == 0:
+        return 0
+    step = max(1, num_entity_names // MEMORY_SIZE_SAMPLE_SIZE)
+    sample = [entity_names[i] for i in range(0, num_entity_names, step)]
+    sample_size = 0
+    for entity_name in sample:
+        sample_size += sys.getsizeof(entity_name) + sys.getsizeof(entity_name.name) + 8 # 8 bytes for the reference in the list
+        if entity_name.tokenized_name is not None: # built for matching
+            sample_size += sys.getsizeof(entity_name.tokenized_name)
+    return int(sample_size / len(sample) * num_entity_names)
+
 class ExtractionEntry:
     """ Represents a WikiDataNameExtraction in the Memory.
         Implements loading and storing of the Extraction.
@@ -360,7 +1172,12 @@ class ExtractionEntry:
         self.identifier = identifier
         self.extraction = None
         self.state = ExtractionEntryState.NOT_LOADED
-        
+        self.bytes_loaded = 0 # progress of loading the extracts
+        self.bytes_total = 0
+        self.last_used = 0 # time when the extracts were last loaded or used
+        self.extracts_file_stat = None # os.stat of the extracts file when it was loaded
+        self.load_error = None # error message if the last loading of the extracts failed
+        self.num_users = 0 # jobs using the extracts, see Memory.using_extraction_entries
     
     def load_extraction(self, memory, load_configuration, load_extracts):
         """ Loads (unpickles) the saved extraction object
@@ -368,43 +1185,157 @@ class ExtractionEntry:
         if load_configuration:
             assert self.extraction is None, f"Configuration of Extraction {self.identifier} has already been loaded"
             
-            file_name_config = "extraction_{}_config.pkl".format(self.identifier)
-            with memory._app.open_instance_resource(file_name_config, "rb") as input_file:
-                self.extraction = pickle.load(input_file)   
-                self.extraction._extracts = None # override default initalization  
-                assert self.extraction.get_identifier() == self.identifier              
+            self.extraction = self._load_configuration(memory)
+            self.extraction._extracts = None # override default initalization  
+            assert self.extraction.get_identifier() == self.identifier              
         
         if load_extracts:
-            assert not self.extraction is None, f"Configuration of Extraction {self.identifier} has not been loaded, yet"
-            assert self.extraction._extracts is None
-            assert self.state != ExtractionEntryState.LOADED
-            assert self.state != ExtractionEntryState.LOADING # TODO Is here proper error handling necessary?
-            file_name_extracts = "extraction_{}_extracts.pkl".format(self.identifier)    
-            with memory._app.open_instance_resource(file_name_extracts, "rb") as input_file:
-                self.state = ExtractionEntryState.LOADING
-                extracts = pickle.load(input_file)
-                assert not extracts is None 
-                self.extraction._extracts = extracts
+            assert self.state == ExtractionEntryState.NOT_LOADED, f"Extracts of Extraction {self.identifier} are already loaded or loading"
+            self.state = ExtractionEntryState.LOADING
+            self.load_extracts(memory)
+    
+    def _load_configuration(self, memory):
+        if memory._store is not None:
+            return memory._store.load_extraction_config(self.identifier)
+        file_name_config = "extraction_{}_config.pkl".format(self.identifier)
+        with memory._app.open_instance_resource(file_name_config, "rb") as input_file:
+            return pickle.load(input_file)
+    
+    def reload_configuration(self, memory):
+        """ Updates the configuration of the already loaded extraction
+            object in place (the EntityName objects refer to it).
+        """
+        self.extraction.update_configuration(self._load_configuration(memory))
+    
+    def extracts_changed_on_disk(self, memory):
+        """ Returns if the stored extracts differ from the loaded ones
+            (e.g. because another worker process added names).
+        """
+        if memory._store is not None:
+            return any(memory._store.count_entity_names(self.identifier, is_alias) != len(self.extraction._extracts[key])
+                       for is_alias, key in [(0, "labels"), (1, "aliases")])
+        _, file_name_extracts = memory._get_extraction_filename(self.identifier, absolute=True)
+        if not os.path.isfile(file_name_extracts):
+            file_name_extracts = memory._get_legacy_extraction_extracts_filename(self.identifier, absolute=True)
+        try:
+            file_stat = os.stat(file_name_extracts)
+        except OSError:
+            return True
+        return self.extracts_file_stat is None or \
+               (file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns) != \
+               (self.extracts_file_stat.st_ino, self.extracts_file_stat.st_size, self.extracts_file_stat.st_mtime_ns)
+    
+    def load_extracts(self, memory):
+        """ Loads the extracts of an extraction whose configuration
+            has already been loaded. The state must have been set
+            to LOADING before. If loading fails, the state is reset
+            to NOT_LOADED.
+        """
+        assert not self.extraction is None, f"Configuration of Extraction {self.identifier} has not been loaded, yet"
+        assert self.extraction._extracts is None
+        assert self.state == ExtractionEntryState.LOADING
+        
+        self.load_error = None
+        try:
+            self.bytes_loaded = 0
+            _, file_name_extracts = memory._get_extraction_filename(self.identifier, absolute=True)
+            if memory._store is not None:
+                # names are read from the database when accessed
+                self.bytes_total = 0
+                self.extraction._extracts = memory._store.load_extracts(self.identifier, self.extraction)
+            elif os.path.isfile(file_name_extracts):
+                # memory-mapped, EntityName objects are created on access
+                self.extracts_file_stat = os.stat(file_name_extracts)
+                self.bytes_total = self.extracts_file_stat.st_size
+                self.extraction._extracts = extract_storage.load_extracts(file_name_extracts, self.extraction)
+                self.bytes_loaded = self.bytes_total
+            else:
+                self._load_legacy_extracts(memory)
+        except:
+            self.extraction._extracts = None
+            self.load_error = str(sys.exc_info()[1])
+            self.state = ExtractionEntryState.NOT_LOADED
+            raise
+        
+        if self.extraction._extracts is None:
+            self.load_error = f"Failed to load extracts for {self.identifier}"
+            self.state = ExtractionEntryState.NOT_LOADED
+            raise Exception(self.load_error)
             
-            # TODO: Do not pickle the old extraction object in the first place
-            # that is linked here. Different extraction objects due to the 2step pickling process
-            for entity_name in self.extraction._extracts["labels"]:
-                entity_name.entity_extraction = self.extraction
-            for entity_name in self.extraction._extracts["aliases"]:
-                entity_name.entity_extraction = self.extraction
-                
-            self.extraction._properties_changed = True # Force tokenization
-            self.state = ExtractionEntryState.LOADED
-
-            if self.extraction._extracts is None:
-                raise Exception(f"Failed to load extracts for {self.identifier}")
+        self.extraction._properties_changed = True # Force tokenization
+        self.last_used = time.time()
+        self.state = ExtractionEntryState.LOADED
+            
+    def _load_legacy_extracts(self, memory):
+        """ Loads extracts that were stored as pickled EntityName objects.
+            They are converted to the columnar format the next time
+            the extraction is saved.
+        """
+        file_name_extracts = memory._get_legacy_extraction_extracts_filename(self.identifier, absolute=True)
+        self.extracts_file_stat = os.stat(file_name_extracts)
+        self.bytes_total = self.extracts_file_stat.st_size
+        with open(file_name_extracts, "rb") as input_file:
+            extracts = pickle.load(ProgressReader(input_file, self))
+            assert not extracts is None 
+            self.extraction._extracts = extracts
+        
+        # TODO: Do not pickle the old extraction object in the first place
+        # that is linked here. Different extraction objects due to the 2step pickling process
+        # Also share entity objects and names with the other extractions.
+        for entity_name in itertools.chain(self.extraction._extracts["labels"], self.extraction._extracts["aliases"]):
+            entity_name.entity_extraction = self.extraction
+            entity_name.entity_object = EntityObject.get_instance(entity_name.entity_object.identifier)
+            entity_name.name = sys.intern(entity_name.name)
             
+    def get_memory_size(self):
+        """ Returns an estimate of the bytes used by the loaded extracts.
+            Only the EntityName objects in memory are counted: all of them 
+            for extracts kept in lists (new extractions and the old pickle
+            format), the decoded and added ones for memory-mapped or 
+            database-backed extracts. The pages of a memory-mapped file 
+            are shared between the processes and can be dropped by the 
+            operating system, so they are not counted.
+        """
+        extracts = self.extraction._extracts if self.extraction is not None else None
+        if self.state != ExtractionEntryState.LOADED or extracts is None:
+            return 0
+        memory_size = 0
+        for entity_names in extracts.values():
+            if not isinstance(entity_names, list):
+                entity_names = entity_names.get_entity_names_in_memory()
+            memory_size += estimate_entity_names_memory_size(entity_names)
+        return memory_size
+    
     def unload_extraction(self, memory):
         assert not self.extraction._extracts is None
         self.extraction._extracts = None
         self.state = ExtractionEntryState.NOT_LOADED
 
 
+class ProgressReader:
+    """ Wraps a file that is read (e.g. by pickle) and counts
+        the bytes read so far in extraction_entry.bytes_loaded.
+    """
+    
+    def __init__(self, input_file, extraction_entry):
+        self._input_file = input_file
+        self._extraction_entry = extraction_entry
+        
+    def read(self, size=-1):
+        data = self._input_file.read(size)
+        self._extraction_entry.bytes_loaded += len(data)
+        return data
+        
+    def readline(self, size=-1):
+        data = self._input_file.readline(size)
+        self._extraction_entry.bytes_loaded += len(data)
+        return data
+    
+    def readinto(self, buffer):
+        num_bytes = self._input_file.readinto(buffer)
+        self._extraction_entry.bytes_loaded += num_bytes
+        return num_bytes
+
 class ExtractionEntryState(Enum):
     """ State that defines if the extracts of an extraction have already been loaded
     """
@@ -15,7 +15,10 @@
 # See the Apache 2 License for the specific language governing permissions and
 # limitations under the License.
 
+from autom_labeling_library.document import Corpus
 from .util import try_method_return_json, get_document_from_memory
+from .memory import Memory
+from .evaluation import labels_changed
 
 from flask import (
     Blueprint, flash, g, redirect, render_template, request, session, url_for, jsonify
@@ -35,11 +38,19 @@ def manually_change_one_autom_label_json(document_type):
         token_index = int(request.form['token_index'])
         new_label = request.form['new_label']
 
-        document, redirect = get_document_from_memory(document_type)
-        if document is None:
-            raise Exception("Could not load document for manually changing label value.");
+        document = get_annotated_document(document_type)
 
+        # recorded so that the change is kept if the document is annotated again
+        corpus_document_indices = None
+        if isinstance(document, Corpus):
+            corpus_document, position = document.locate(token_index)
+            corpus_document.post_editing_rules.add_position_rule(position, new_label)
+            corpus_document_indices = [document.documents.index(corpus_document)]
+        else:
+            document.post_editing_rules.add_position_rule(token_index, new_label)
         document.autom_labels[token_index] = new_label
+        labels_changed(document, [token_index])
+        Memory.get_instance().updated_document_labels(document_type, corpus_document_indices)
 
     return try_method_return_json(lambda_function, report_error_status=True)
     
@@ -55,16 +66,85 @@ def manually_change_all_autom_label_for_one_token_json(document_type):
         request_token_index = int(request.form['token_index'])
         request_new_label = request.form["new_label"]
         
-        document, redirect = get_document_from_memory(document_type)
-        if document is None:
-            raise Exception("Could not load document for manually changing label value.");
+        document = get_annotated_document(document_type)
 
         request_token = document.tokens[request_token_index]
         request_current_label = document.autom_labels[request_token_index]
     
-        for i, (token, current_label) in enumerate(zip(document.tokens, document.autom_labels)):
-            if token == request_token and request_current_label == current_label:
-                document.autom_labels[i] = request_new_label
+        changed_positions, corpus_document_indices = relabel_token(document, request_token, request_current_label, request_new_label)
+        labels_changed(document, changed_positions)
+        Memory.get_instance().updated_document_labels(document_type, corpus_document_indices)
 
     return try_method_return_json(lambda_function, report_error_status=True)
 
+@bp.route('/change_labels/<document_type:document_type>', methods=('POST',))
+def manually_change_labels_json(document_type):
+    """ Applies several relabeling rules at once. The rules are sent as
+        JSON list {"rules": [{"token": ..., "current_label": ..., "new_label": ..., 
+        "ignore_case": false}, ...]}. Each rule changes the label of all 
+        occurences of the token to new_label (only those that currently 
+        have current_label if it is given). The rules are applied in order. 
+        Background, json function.
+    """
+    def lambda_function():
+        rules = request.get_json(force=True)["rules"]
+        
+        document = get_annotated_document(document_type)
+        
+        changed_positions = []
+        corpus_document_indices = set() if isinstance(document, Corpus) else None
+        for rule in rules:
+            rule_changed_positions, rule_corpus_document_indices = relabel_token(document, rule["token"], rule.get("current_label"), 
+                                                                                 rule["new_label"], rule.get("ignore_case", False))
+            changed_positions.extend(rule_changed_positions)
+            if corpus_document_indices is not None:
+                corpus_document_indices.update(rule_corpus_document_indices)
+        labels_changed(document, changed_positions)
+        Memory.get_instance().updated_document_labels(document_type, corpus_document_indices)
+    
+    return try_method_return_json(lambda_function, report_error_status=True)
+
+def get_annotated_document(document_type):
+    """ The document whose automatic labels are changed. Raises an exception
+        if it has no automatic labels, for a corpus also if only some of 
+        its documents were annotated.
+    """
+    document, redirect = get_document_from_memory(document_type)
+    if document is None:
+        raise Exception("Could not load document for manually changing label value.");
+    if document.autom_labels is None:
+        if isinstance(document, Corpus):
+            not_annotated = [name for name, corpus_document in zip(document.document_names, document.documents)
+                             if corpus_document.autom_labels is None]
+            raise Exception("Not all documents have been automatically annotated yet: " + ", ".join(not_annotated))
+        raise Exception("The document has not been automatically annotated yet.")
+    return document
+
+def relabel_token(document, token, current_label, new_label, ignore_case=False):
+    """ Changes the automatic label of all occurences of the token that have 
+        current_label (or any label if current_label is None) to new_label. 
+        Uses the token index of the document, so only the occurences of the 
+        token are visited. The change is recorded as rule so that it is 
+        kept if the document is annotated again, only in the documents of
+        a corpus that contain the token. Returns the changed positions and, 
+        for a corpus, the indices of the documents that got the rule (None 
+        for a single document).
+    """
+    if isinstance(document, Corpus):
+        corpus_document_indices = []
+        for corpus_document_idx, corpus_document in enumerate(document.documents):
+            if len(corpus_document.get_token_positions(token, ignore_case)) > 0:
+                corpus_document.post_editing_rules.add_token_rule(token, current_label, new_label, ignore_case)
+                corpus_document_indices.append(corpus_document_idx)
+    else:
+        corpus_document_indices = None
+        document.post_editing_rules.add_token_rule(token, current_label, new_label, ignore_case)
+    
+    autom_labels = document.autom_labels
+    changed_positions = []
+    for i in document.get_token_positions(token, ignore_case):
+        if (current_label is None or autom_labels[i] == current_label) and autom_labels[i] != new_label:
+            autom_labels[i] = new_label
+            changed_positions.append(i)
+    return changed_positions, corpus_document_indices
+
@@ -81,6 +81,18 @@ def index():
             remove_diacritics = True
         else: # if checkbox is unchecked, the "remove_diacritics" element is not part of the post
             remove_diacritics = False
+            
+        memory_budget_mb = request.form.get("memory_budget_mb", "").strip()
+        if len(memory_budget_mb) == 0: # empty field
+            memory_budget_mb = -1
+        else:
+            try:
+                memory_budget_mb = int(memory_budget_mb)
+                if memory_budget_mb < -1 or memory_budget_mb == 0:
+                    raise ValueError()
+            except ValueError:
+                flash("The memory budget must be a number > 0 (in MB) or -1 (no limit).", "danger")
+                worked = False
     
         if worked:
             settings.wikidata_path = wikidata_path
@@ -88,7 +100,9 @@ def index():
             settings.use_language_specific_tokenizer_for_entity_names = use_language_specific_tokenizer_for_entity_names
             settings.lemmatize = lemmatize
             settings.remove_diacritics = remove_diacritics
+            settings.memory_budget_mb = memory_budget_mb
             Memory.get_instance().save_settings()
+            Memory.get_instance().enforce_memory_budget()
             Memory.get_instance().invalidate_tokenization_cache()
             flash("Settings saved.", "success")
         else:
@@ -32,12 +32,19 @@ class Status:
         
         self.state = StatusState.IDLE
         self.message = ""
+        self.progress = None # between 0 and 1 if known
         
     def set_message(self, message):
         self.message = message
         
+    def set_progress(self, progress, message=None):
+        self.progress = progress
+        if message is not None:
+            self.message = message
+        
     def clear_message(self):
         self.message = ""
+        self.progress = None
         
     def set_state_processing(self):
         self.state = StatusState.PROCESSING
@@ -60,10 +67,16 @@ bp = Blueprint('status', __name__, url_prefix='/status')
 
 @bp.route('/', methods=('GET', 'POST'))
 def status():    
+    from .memory import Memory # avoid circular import, Memory reports errors via Status
+    from .jobs import JobManager
     status = Status.get_instance()
     
     return jsonify({"state": status.state.value, 
-                    "message": status.message})
+                    "message": status.message,
+                    "progress": status.progress,
+                    "loading_extractions": Memory.get_instance().get_loading_progress(),
+                    "failed_extractions": Memory.get_instance().get_loading_errors(),
+                    "jobs": [job.to_dict() for job in JobManager.get_instance().get_jobs(only_active=True)]})
     
 @bp.route('/clear', methods=('GET', 'POST'))
 def clear():    
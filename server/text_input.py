@@ -17,11 +17,12 @@
 
 import traceback
 
-from autom_labeling_library.preprocessing import Preprocessing, remove_diacritics
-from autom_labeling_library.document import Document, DocumentRawFormat
+from autom_labeling_library.preprocessing import Preprocessing, ParallelTokenizer, remove_diacritics
+from autom_labeling_library.document import Document, DocumentRawFormat, Corpus
 from autom_labeling_library.formats import CoNLLFormatParser
 from .memory import Memory, DocumentType, document_type_to_readable_name
 from .util import create_tokenizer
+from .jobs import JobManager, JobConflictException
 
 import functools
 
@@ -54,8 +55,6 @@ def text_input_form(document_type):
     annotated_text = None
     # if text was sent via form
     if request.method == 'POST':
-        worked = True
-        
         raw_text = request.form['text_input']
         raw_format = request.form['raw_format']
         
@@ -66,16 +65,14 @@ def text_input_form(document_type):
         
         if not raw_text or len(raw_text) == 0:
             flash("No text given.", "warning")
-            worked = False
-            
         else:
             raw_text = raw_text.strip()
-            worked = process_input_text(raw_text, raw_format, document_type, label_type)
-            Memory.get_instance().raw_documents_changed()
-                                                   
-        if worked:
-            return redirect(url_for('text_output.text_output_page', 
-                                    document_type=document_type))
+            def lambda_function(job):
+                errors = []
+                if not process_input_text(raw_text, raw_format, document_type, label_type, errors=errors):
+                    raise Exception(" ".join(errors))
+                Memory.get_instance().raw_documents_changed()
+            return start_processing_job(document_type, lambda_function)
     
     # display text input form
     return render_template('text_input/text_input_form.html', 
@@ -84,8 +81,6 @@ def text_input_form(document_type):
 @bp.route('/text_upload_form/<document_type:document_type>', methods=('GET', 'POST'))
 def text_upload_form(document_type):
     if request.method == 'POST':
-        worked = True
-        
         raw_format = request.form['raw_format']
         
         if "label_type" in request.form:
@@ -93,44 +88,103 @@ def text_upload_form(document_type):
         else:
             raise Exception("Label type not specified")
         
-        if 'file' not in request.files or len(request.files['file'].filename) == 0:
+        uploaded_files = [uploaded_file for uploaded_file in request.files.getlist('file') 
+                          if len(uploaded_file.filename) > 0]
+        if len(uploaded_files) == 0:
             flash('No file was given.', "warning")
-            worked = False
         else:
-            uploaded_file = request.files['file']
             # TODO Check Mime type if it is string
-            lines = [line.decode() for line in uploaded_file.readlines()]
-            raw_text = "\n".join(lines)
+            # the uploads are written to disk in chunks and parsed from there,
+            # the raw text is not kept in memory
+            uploads = []
+            for uploaded_file in uploaded_files:
+                raw_text_path = Memory.get_instance().get_new_upload_path(uploaded_file.filename)
+                uploaded_file.save(raw_text_path)
+                uploads.append((uploaded_file.filename, raw_text_path))
             
-            worked = process_input_text(raw_text, raw_format, document_type, label_type)
-            Memory.get_instance().raw_documents_changed()
-        
-        if worked:
-            return redirect(url_for('text_output.text_output_page', 
-                                    document_type=document_type))
+            def lambda_function(job):
+                errors = []
+                if len(uploads) == 1:
+                    worked = process_input_text(None, raw_format, document_type, label_type, raw_text_path=uploads[0][1], 
+                                                errors=errors)
+                else:
+                    # several files are kept as separate documents of a corpus
+                    worked = process_input_corpus(uploads, raw_format, document_type, label_type, errors=errors, status=job)
+                if not worked:
+                    raise Exception(" ".join(errors))
+                Memory.get_instance().raw_documents_changed()
+            return start_processing_job(document_type, lambda_function)
                                     
     return render_template('text_input/text_upload_form.html', document_type=document_type)  
 
-def process_input_text(input_text, document_raw_format, document_type, label_type="gold"):
+def start_processing_job(document_type, method):
+    """
+    Tokenizing/parsing can take a while, so it runs as job. The returned
+    page waits for the job and then shows the document.
+    """
+    try:
+        job = JobManager.get_instance().start_job(f"Processing the {document_type_to_readable_name(document_type)}", method,
+                                                  target=f"document_{document_type.value}")
+    except JobConflictException as e:
+        flash(str(e), "warning")
+        return redirect(request.url)
+    return render_template('text_input/processing.html', document_type=document_type, job_id=job.identifier)
+
+def process_input_text(input_text, document_raw_format, document_type, label_type="gold", raw_text_path=None, errors=None):
     """
     Processes the given text. Checks whether tokenization/parsing
     worked and stores the resulting document in the corresponding 
     document_type memory. The processing depends on the 
-    document_raw_format (tokenize_text or parse_conll)
+    document_raw_format (tokenize_text or parse_conll). Instead of
+    the text, the path of a file containing it can be given.
+    If errors (a list) is given, error messages are added to it 
+    instead of being shown.
+    """
+    document = create_document(input_text, document_raw_format, document_type, label_type, raw_text_path, errors)
+    if document is None:
+        return False
+                    
+    Memory.get_instance().set_document(document_type, document)
+    return True
+
+def process_input_corpus(named_raw_text_paths, document_raw_format, document_type, label_type="gold", errors=None, status=None):
+    """
+    Like process_input_text but for several files, given as list of
+    (name, path). Each file is processed on its own and stored as
+    document of a Corpus. The progress is reported to status (a Job) 
+    if given.
+    """
+    corpus = Corpus()
+    for i, (name, raw_text_path) in enumerate(named_raw_text_paths):
+        if not status is None:
+            status.set_progress(i/len(named_raw_text_paths), f"Processing {name}.")
+        document = create_document(None, document_raw_format, document_type, label_type, raw_text_path, errors)
+        if document is None:
+            _show_error(f"Failed to process the file {name}.", errors)
+            return False
+        corpus.add_document(name, document)
+    
+    Memory.get_instance().set_document(document_type, corpus)
+    return True
+
+def create_document(input_text, document_raw_format, document_type, label_type="gold", raw_text_path=None, errors=None):
+    """
+    Tokenizes/parses the given text (or the text in the file raw_text_path)
+    and returns the resulting Document or None if this failed.
     """
     document_raw_format = DocumentRawFormat(document_raw_format)
     if document_raw_format == DocumentRawFormat.SIMPLE_TEXT:
-        document = tokenize_text(input_text)
+        document = tokenize_text(input_text, raw_text_path=raw_text_path)
     elif document_raw_format == DocumentRawFormat.CONLL_SPACE or \
         document_raw_format == DocumentRawFormat.CONLL_TAB:
-        document = parse_conll(input_text, document_raw_format, label_type)
+        document = parse_conll(input_text, document_raw_format, label_type, raw_text_path)
     else:
-        flash("Document raw format {} unknown.".format(document_raw_format), "danger")
-        return False        
+        _show_error("Document raw format {} unknown.".format(document_raw_format), errors)
+        return None
             
     if not document:
-        flash("Failed to process the input.", "danger")
-        return False
+        _show_error("Failed to process the input.", errors)
+        return None
         
     if Memory.get_instance().get_settings().remove_diacritics:
         document.tokens = [remove_diacritics(token) for token in document.tokens]
@@ -138,14 +192,25 @@ def process_input_text(input_text, document_raw_format, document_type, label_typ
     if (document_type == DocumentType.DEVELOPMENT or 
         document_type == DocumentType.TEST) and \
         document.gold_labels is None:
-            flash("Uploaded {} data needs gold labels but none were provided. Maybe the wrong format was selected? Have you checked whether the columns are separated by a space or a tab?".format(
-                    document_type_to_readable_name(document_type)), "danger")
-            return False
-                    
-    Memory.get_instance().set_document(document_type, document)
-    return True
+            _show_error("Uploaded {} data needs gold labels but none were provided. Maybe the wrong format was selected? Have you checked whether the columns are separated by a space or a tab?".format(
+                    document_type_to_readable_name(document_type)), errors)
+            return None
+    
+    return document
 
-def tokenize_text(input_text, language_code=None, lemmatize=None):
+def _show_error(error_message, errors=None):
+    """ Added to errors if given (e.g. in a job), shown to the user if 
+        called during a request, otherwise printed (e.g. when the 
+        documents are loaded on start).
+    """
+    if errors is not None:
+        errors.append(error_message)
+    elif has_request_context():
+        flash(error_message, "danger")
+    else:
+        print(error_message)
+
+def tokenize_text(input_text, language_code=None, lemmatize=None, raw_text_path=None):
     if language_code is None:
         language_code = Memory.get_instance().get_settings().spacy_tokenizer_language_code
     if lemmatize is None:
@@ -156,11 +221,14 @@ def tokenize_text(input_text, language_code=None, lemmatize=None):
     if tokenizer is None:
         return None
     
-    document = Document(input_text, DocumentRawFormat.SIMPLE_TEXT)
-    document.tokens = tokenizer.tokenize(input_text, lemmatize=lemmatize)
+    # long texts are split at paragraph/sentence boundaries and tokenized in parallel
+    tokenizer = ParallelTokenizer(language_code, tokenizer)
+    
+    document = Document(input_text, DocumentRawFormat.SIMPLE_TEXT, raw_text_path)
+    document.tokens = tokenizer.tokenize(document.get_raw_text(), lemmatize=lemmatize)
     return document
 
-def parse_conll(input_text, raw_format, label_type):
+def parse_conll(input_text, raw_format, label_type, raw_text_path=None):
     parser = CoNLLFormatParser()
     language_code = Memory.get_instance().get_settings().spacy_tokenizer_language_code
     lemmatize = Memory.get_instance().get_settings().lemmatize
@@ -179,7 +247,13 @@ def parse_conll(input_text, raw_format, label_type):
                 raise Exception(error_message)
             return None
     try:
-        document = parser.parse(input_text, raw_format, label_type)
+        if raw_text_path is not None:
+            # parsed line by line from the file
+            with open(raw_text_path, "r", encoding="utf-8") as input_file:
+                document = parser.parse_lines(input_file, raw_format, label_type)
+            document.raw_text_path = raw_text_path
+        else:
+            document = parser.parse(input_text, raw_format, label_type)
         if lemmatize:
             document.tokens = lemmatizer.lemmatize(document.tokens)
     except Exception as e:
@@ -15,73 +15,144 @@
 # See the Apache 2 License for the specific language governing permissions and
 # limitations under the License.
 
-import io
-import time
+import weakref
+from threading import Lock
 
 from autom_labeling_library.formats import LabelCreator, CoNLLFormatCreator
 from .memory import Memory, DocumentType
-from .util import get_document_from_memory
+from .util import get_document_from_memory, stream_download
 
 from flask import (
     Blueprint, flash, g, redirect, render_template, request, session, url_for, 
-    jsonify, send_file
+    jsonify
 )
 
 bp = Blueprint('text_output', __name__, url_prefix='/text_output')
 
+WINDOW_SIZE = 500 # number of tokens rendered at once, further windows are loaded when scrolling
+
 @bp.route('/text_output_page/<document_type:document_type>', methods=('GET', 'POST'))
 def text_output_page(document_type):
     document, redirect = get_document_from_memory(document_type)
     if document is None:
         return redirect
     
-    # convert the match objects into a list that shows
-    # for each token which EntityNames match
-    match_output = None
-    other_match_output = None
-    if not document.matches is None:
-        
-        # the actual matches
-        match_output = [None for _ in range(len(document.tokens))]
-        for match in document.matches:
-            matcher = [match.match_entity_name.name, match.match_entity_name.get_label(), match.match_entity_name.entity_object.identifier, match.match_entity_name.entity_extraction.get_identifier()]
-            for i in range(match.match_start_pos, match.match_end_pos):
-                match_output[i] = matcher
-      
-        # other matches, not taken by conflict-resolving-algorithm
-        other_match_output = [[] for _ in range(len(document.tokens))]
-        for match in document.possible_matches:
-            if match in document.matches: # only those not taken
-                continue
-            matcher = [match.match_entity_name.name, match.match_entity_name.get_label(), match.match_entity_name.entity_object.identifier, match.match_entity_name.entity_extraction.get_identifier()]
-            for i in range(match.match_start_pos, match.match_end_pos):
-                other_match_output[i].append(matcher)
-
+    # only the first window is rendered with the page
     return render_template('text_output/text_output_page.html', 
                                document_type=document_type,
-                               tokens=document.tokens,
-                               gold_labels=document.gold_labels,
-                               autom_labels=document.autom_labels,
-                               match_output=match_output,
-                               other_match_output=other_match_output
+                               num_tokens=len(document.tokens),
+                               window_size=WINDOW_SIZE,
+                               rows=get_rows(document_type, document, 0, WINDOW_SIZE),
+                               has_gold_labels=document.gold_labels is not None,
+                               has_autom_labels=document.autom_labels is not None,
+                               has_matches=document.matches is not None
                                )
+
+@bp.route('/window/<document_type:document_type>', methods=('GET', 'POST'))
+def text_output_window(document_type):
+    """ The rendered table rows of the tokens [start, start+size).
+        Background, json function.
+    """
+    document = Memory.get_instance().get_document(document_type)
+    if document is None:
+        return jsonify({"successful": False, "error_msg": f"No {document_type} document."}), 404
+    
+    start = max(0, request.args.get("start", 0, type=int))
+    size = min(max(1, request.args.get("size", WINDOW_SIZE, type=int)), 10 * WINDOW_SIZE)
+    end = min(start + size, len(document.tokens))
+    
+    html = render_template('text_output/text_output_rows.html',
+                           rows=get_rows(document_type, document, start, end),
+                           has_gold_labels=document.gold_labels is not None,
+                           has_autom_labels=document.autom_labels is not None,
+                           has_matches=document.matches is not None)
+    return jsonify({"successful": True, "start": start, "end": end, 
+                    "num_tokens": len(document.tokens), "html": html})
+
+def get_rows(document_type, document, start, end):
+    """ For each token in [start, end), its labels, the EntityName
+        of the match (if any) and the other possible matches that 
+        were not taken by the conflict-resolving-algorithm.
+    """
+    tokens = document.tokens
+    gold_labels = document.gold_labels
+    autom_labels = document.autom_labels
+    end = min(end, len(tokens))
+    
+    match_at_position, other_matches_at_position = {}, {}
+    if not document.matches is None:
+        match_at_position, other_matches_at_position = _get_match_index(document)
+    
+    rows = []
+    for i in range(start, end):
+        rows.append({"index": i,
+                     "token": tokens[i],
+                     "gold_label": gold_labels[i] if gold_labels is not None else None,
+                     "autom_label": autom_labels[i] if autom_labels is not None else None,
+                     "match": match_at_position.get(i),
+                     "other_matches": other_matches_at_position.get(i, [])})
+    return rows
+
+# The index is kept as long as the document exists. It is only used if the 
+# document still has the same lists of matches (they are replaced when the 
+# document is annotated again).
+_match_indexes = weakref.WeakKeyDictionary() # Document or Corpus -> (matches, possible_matches, match_at_position, other_matches_at_position)
+_lock_match_indexes = Lock()
+
+def _get_match_index(document):
+    """ Maps token positions to the matches covering them. Built once
+        per annotation.
+    """
+    with _lock_match_indexes:
+        matches = document.matches
+        possible_matches = document.possible_matches
+        cached = _match_indexes.get(document)
+        if cached is not None and cached[0] is matches and cached[1] is possible_matches:
+            return cached[2], cached[3]
+        
+        match_at_position, other_matches_at_position = _build_match_index(matches, possible_matches)
+        _match_indexes[document] = (matches, possible_matches, match_at_position, other_matches_at_position)
+        return match_at_position, other_matches_at_position
+
+def _build_match_index(matches, possible_matches):
+    # the actual matches
+    match_at_position = {}
+    for match in matches:
+        matcher = _get_matcher(match)
+        for i in range(match.match_start_pos, match.match_end_pos):
+            match_at_position[i] = matcher
+    
+    # other matches, not taken by conflict-resolving-algorithm
+    taken = set(id(match) for match in matches)
+    other_matches_at_position = {}
+    for match in possible_matches:
+        if id(match) in taken: # only those not taken
+            continue
+        matcher = _get_matcher(match)
+        for i in range(match.match_start_pos, match.match_end_pos):
+            other_matches_at_position.setdefault(i, []).append(matcher)
+    
+    return match_at_position, other_matches_at_position
+
+def _get_matcher(match):
+    return [match.match_entity_name.name, match.match_entity_name.get_label(), 
+            match.match_entity_name.entity_object.identifier, match.match_entity_name.entity_extraction.get_identifier()]
                                
 @bp.route('/text_download/<document_type:document_type>', methods=('GET', 'POST'))
 def text_download(document_type):
-    document, redirect = get_document_from_memory(document_type)
+    """ Streams the document in CoNLL format. 
+        Compressed with gzip if the parameter gzip=1 is given.
+    """
+    document, redirect_response = get_document_from_memory(document_type)
     if document is None:
-        return redirect
+        return redirect_response
         
     output_creator = CoNLLFormatCreator()
-    output_text = output_creator.create(document.tokens, 
-                                        gold_labels = document.gold_labels,
-                                        autom_labels = document.autom_labels)
-    output_text = output_text.encode("utf-8")
-    output_file = io.BytesIO(output_text)
-    
-    return send_file(output_file, mimetype="text/plain", 
-                     as_attachment=True, attachment_filename="document.conll",
-                     cache_timeout=0,  # prevents caching, could be set to the actual upload/annotation time
-                     last_modified=time.time())
-    
-                              
+    try:
+        lines = output_creator.iter_lines(document.tokens, 
+                                          gold_labels = document.gold_labels,
+                                          autom_labels = document.autom_labels)
+    except Exception as e:
+        flash(f"Could not create the download: {e}", "danger")
+        return redirect(url_for("text_output.text_output_page", document_type=document_type))
+    return stream_download(lines, "document.conll", compress=request.args.get("gzip", 0, type=int) == 1)
@@ -16,7 +16,10 @@
 # limitations under the License.
 
 import traceback
-from flask import jsonify, has_request_context, flash
+import zlib
+from urllib.parse import quote
+from werkzeug.utils import secure_filename
+from flask import jsonify, has_request_context, flash, redirect, url_for, Response, stream_with_context
 from autom_labeling_library.preprocessing import Preprocessing
 from .status import Status
 from .memory import Memory
@@ -72,3 +75,43 @@ def create_tokenizer(language_code):
     return tokenizer
     
 
+STREAM_CHUNK_SIZE = 64 * 1024 # bytes of text collected before a chunk is sent
+
+def stream_download(lines, filename, compress=False):
+    """ Sends the given lines (an iterable of strings, e.g. a generator) 
+        as file download. The lines are encoded and sent in chunks as they 
+        are created, so the whole file is never held in memory. 
+        If compress is True, the file is sent gzip-compressed (filename.gz).
+    """
+    def generate_chunks():
+        compressor = zlib.compressobj(wbits=31) if compress else None # wbits=31: gzip header
+        buffer = []
+        buffer_size = 0
+        for line in lines:
+            buffer.append(line)
+            buffer_size += len(line)
+            if buffer_size >= STREAM_CHUNK_SIZE:
+                chunk = "".join(buffer).encode("utf-8")
+                buffer = []
+                buffer_size = 0
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if len(chunk) > 0:
+                    yield chunk
+        chunk = "".join(buffer).encode("utf-8")
+        if compressor is not None:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if len(chunk) > 0:
+            yield chunk
+    
+    if compress:
+        filename += ".gz"
+        mimetype = "application/gzip"
+    else:
+        mimetype = "text/plain"
+    # an ASCII fallback and the full name (RFC 5987), both can not break the header
+    content_disposition = 'attachment; filename="{}"; filename*=UTF-8\'\'{}'.format(
+            secure_filename(filename) or "download", quote(filename, safe=""))
+    return Response(stream_with_context(generate_chunks()), mimetype=mimetype,
+                    headers={"Content-Disposition": content_disposition,
+                             "Cache-Control": "no-cache"}) # prevents caching, the document might change
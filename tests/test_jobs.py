@@ -0,0 +1,165 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from flask import Flask
+
+from server import jobs
+from server.jobs import JobManager, JobState, JobConflictException, SharedJob, start_job_return_json
+
+class JobManagerTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.job_manager = JobManager(num_workers=1, shared_directory=self.directory.name)
+        self.release = threading.Event()
+        # occupies the only worker thread until released
+        self.blocking_job = self.job_manager.start_job("blocking", lambda job: self.release.wait(10))
+    
+    def wait_for_jobs(self):
+        self.release.set()
+        while len(self.job_manager.get_jobs(only_active=True)) > 0:
+            time.sleep(0.01)
+    
+    def tearDown(self):
+        self.release.set()
+        self.job_manager._executor.shutdown(wait=True)
+        self.directory.cleanup()
+    
+    def test_cancel_queued_job(self):
+        calls = []
+        job = self.job_manager.start_job("queued", lambda job: calls.append(job))
+        self.assertEqual(job.state, JobState.QUEUED)
+        
+        job.request_cancel()
+        self.assertEqual(job.state, JobState.CANCELLED)
+        
+        self.release.set()
+        self.job_manager._executor.shutdown(wait=True) # the queued job would have run by now
+        self.assertEqual(job.state, JobState.CANCELLED)
+        self.assertEqual(calls, [])
+    
+    def test_cancel_queued_job_of_other_worker(self):
+        calls = []
+        job = self.job_manager.start_job("queued", lambda job: calls.append(job))
+        
+        shared_job = SharedJob.from_directory(self.directory.name, job.identifier)
+        shared_job.request_cancel()
+        self.assertEqual(shared_job.to_dict()["state"], JobState.CANCELLED.value)
+        
+        self.release.set()
+        self.job_manager._executor.shutdown(wait=True) # the queued job would have run by now
+        self.assertEqual(job.state, JobState.CANCELLED)
+        self.assertEqual(calls, [])
+    
+    def test_one_active_job_per_target(self):
+        self.job_manager.start_job("annotation", lambda job: None, target="document_test")
+        with self.assertRaises(JobConflictException):
+            self.job_manager.start_job("annotation", lambda job: None, target="document_test")
+        self.job_manager.start_job("annotation", lambda job: None, target="document_development")
+        
+        with Flask("server").app_context():
+            response = start_job_return_json("annotation", lambda job: None, target="document_test")
+        self.assertFalse(response.json["successful"])
+        
+        self.wait_for_jobs()
+        job = self.job_manager.start_job("annotation", lambda job: None, target="document_test")
+        self.assertEqual(job.target, "document_test")
+
+class SharedJobTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.job_manager = JobManager(num_workers=1, shared_directory=self.directory.name)
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        self.stopped_pid = process.pid
+    
+    def tearDown(self):
+        self.job_manager._executor.shutdown(wait=True)
+        self.directory.cleanup()
+    
+    def write_job_file(self, identifier, state, pid, time_finished=None):
+        with open(os.path.join(self.directory.name, identifier + ".json"), "w") as output_file:
+            json.dump({"job_id": identifier, "name": identifier, "target": None, "pid": pid, "state": state, 
+                       "message": "", "progress": None, "error_msg": None, "stacktrace": None, 
+                       "time_created": 0, "time_finished": time_finished}, output_file)
+    
+    def test_job_of_stopped_worker_fails(self):
+        self.write_job_file("stopped", JobState.RUNNING.value, self.stopped_pid)
+        self.write_job_file("alive", JobState.RUNNING.value, os.getppid())
+        
+        states = {job.identifier: job.to_dict()["state"] for job in self.job_manager.get_jobs()}
+        self.assertEqual(states, {"stopped": JobState.FAILED.value, "alive": JobState.RUNNING.value})
+        self.assertEqual([job.identifier for job in self.job_manager.get_jobs(only_active=True)], ["alive"])
+        # the failed state is written back
+        with open(os.path.join(self.directory.name, "stopped.json")) as input_file:
+            self.assertEqual(json.load(input_file)["state"], JobState.FAILED.value)
+    
+    def test_old_jobs_of_stopped_worker_are_removed(self):
+        self.write_job_file("old", JobState.FINISHED.value, self.stopped_pid, time_finished=0)
+        self.write_job_file("recent", JobState.FINISHED.value, self.stopped_pid, time_finished=time.time())
+        
+        self.assertEqual([job.identifier for job in self.job_manager.get_jobs()], ["recent"])
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "old.json")))
+
+class JobEventsTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.job_manager = JobManager(num_workers=1)
+        self.release = threading.Event()
+        self.job = self.job_manager.start_job("blocking", lambda job: self.release.wait(10))
+        app = Flask("server")
+        app.register_blueprint(jobs.bp)
+        self.client = app.test_client()
+        self.max_duration = jobs.EVENTS_MAX_DURATION
+        jobs.EVENTS_MAX_DURATION = 0.5
+    
+    def tearDown(self):
+        jobs.EVENTS_MAX_DURATION = self.max_duration
+        self.release.set()
+        self.job_manager._executor.shutdown(wait=True)
+    
+    def test_number_of_streams_is_limited(self):
+        responses = [self.client.get(f"/jobs/{self.job.identifier}/events", buffered=False) 
+                     for _ in range(jobs.EVENTS_MAX_STREAMS)]
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertEqual(self.client.get(f"/jobs/{self.job.identifier}/events").status_code, 503)
+        
+        for response in reversed(responses): # the request contexts of the streams are stacked
+            response.close()
+        response = self.client.get(f"/jobs/{self.job.identifier}/events", buffered=False)
+        self.assertEqual(response.status_code, 200)
+        response.close()
+    
+    def test_stream_ends_after_max_duration(self):
+        time_start = time.time()
+        response = self.client.get(f"/jobs/{self.job.identifier}/events")
+        self.assertLess(time.time() - time_start, 5)
+        self.assertIn(b"data: ", response.data)
+        self.assertFalse(self.job.is_done())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+import tempfile
+import unittest
+
+from flask import Flask
+
+from autom_labeling_library.document import Document, DocumentRawFormat, Corpus
+from server.memory import Memory, DocumentType, DocumentTypeConverter
+from server.status import Status
+from server import post_editing
+
+def create_document(tokens, autom_labels):
+    document = Document(" ".join(tokens), DocumentRawFormat.SIMPLE_TEXT)
+    document.tokens = tokens
+    document.autom_labels = autom_labels
+    return document
+
+class PostEditingTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        app = Flask("server", instance_path=self.directory.name)
+        app.url_map.converters['document_type'] = DocumentTypeConverter
+        app.register_blueprint(post_editing.bp)
+        Memory(app)
+        Status()
+        self.client = app.test_client()
+        
+        # only the first document of the corpus is annotated
+        self.corpus = Corpus()
+        self.corpus.add_document("annotated.txt", create_document(["Angela", "Merkel"], ["B-PER", "I-PER"]))
+        self.corpus.add_document("not_annotated.txt", create_document(["Angela", "said"], None))
+        Memory.get_instance().set_document(DocumentType.TEST, self.corpus)
+    
+    def tearDown(self):
+        self.directory.cleanup()
+    
+    def assert_not_annotated_error(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json["successful"])
+        self.assertIn("not_annotated.txt", response.json["error_msg"])
+        self.assertEqual(self.corpus.documents[0].autom_labels, ["B-PER", "I-PER"])
+    
+    def test_change_one_label_of_partially_annotated_corpus(self):
+        response = self.client.post("/post_editing/change_one_label/test", data={"token_index": "0", "new_label": "B-LOC"})
+        self.assert_not_annotated_error(response)
+    
+    def test_change_all_labels_of_token_in_partially_annotated_corpus(self):
+        response = self.client.post("/post_editing/change_all_label_one_token/test", data={"token_index": "0", "new_label": "B-LOC"})
+        self.assert_not_annotated_error(response)
+    
+    def test_change_labels_of_partially_annotated_corpus(self):
+        response = self.client.post("/post_editing/change_labels/test", json={"rules": [{"token": "Angela", "new_label": "B-LOC"}]})
+        self.assert_not_annotated_error(response)
+    
+    def test_change_one_label_of_annotated_corpus(self):
+        self.corpus.documents[1].autom_labels = ["B-PER", "O"]
+        response = self.client.post("/post_editing/change_one_label/test", data={"token_index": "2", "new_label": "O"})
+        self.assertTrue(response.json["successful"])
+        self.assertEqual(list(self.corpus.autom_labels), ["B-PER", "I-PER", "O", "O"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+from autom_labeling_library.sqlite_store import SQLiteStore
+from autom_labeling_library.entity import EntityObject, EntityName
+
+class _AppendingEntityName:
+    """ Appends another name to the list while its name is read during saving,
+        like an extraction job that runs while the names are stored.
+    """
+    def __init__(self, name, entity_names, name_to_append):
+        self._name = name
+        self.entity_object = EntityObject.get_instance("Q1")
+        self._entity_names = entity_names
+        self._name_to_append = name_to_append
+    
+    @property
+    def name(self):
+        if self._name_to_append is not None:
+            self._entity_names.append(EntityName(EntityObject.get_instance("Q2"), self._name_to_append, None))
+            self._name_to_append = None
+        return self._name
+
+class SQLiteStoreTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = SQLiteStore(os.path.join(self.directory.name, "anea.sqlite"))
+        self.store.save_extraction_config("extraction", b"")
+    
+    def tearDown(self):
+        self.directory.cleanup()
+    
+    def test_names_appended_while_saving_are_kept(self):
+        extracts = self.store.load_extracts("extraction", None)
+        labels = extracts["labels"]
+        labels.append(_AppendingEntityName("first", labels, "appended while saving"))
+        
+        self.store.save_extracts("extraction", extracts)
+        self.assertEqual(self.store.count_entity_names("extraction", 0), 1)
+        self.assertEqual([entity_name.name for entity_name in labels], ["first", "appended while saving"])
+        
+        self.store.save_extracts("extraction", extracts)
+        self.assertEqual(self.store.count_entity_names("extraction", 0), 2)
+        reloaded = self.store.load_extracts("extraction", None)["labels"]
+        self.assertEqual([entity_name.name for entity_name in reloaded], ["first", "appended while saving"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+# Copyright 2020 Saarland University, Spoken Language Systems LSV
+# Author: Michael A. Hedderich, Lukas Lange, Dietrich Klakow
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS*, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+#
+# See the Apache 2 License for the specific language governing permissions and
+# limitations under the License.
+
+import gc
+import unittest
+
+from autom_labeling_library.document import Document, DocumentRawFormat
+from autom_labeling_library.entity import EntityObject, EntityName
+from autom_labeling_library.matching import Match
+from server import text_output
+
+class _Extraction:
+    def get_identifier(self):
+        return "en-PER-Q5-1"
+    
+    def get_label(self):
+        return "PER"
+
+def create_annotated_document():
+    document = Document("Angela Merkel said", DocumentRawFormat.SIMPLE_TEXT)
+    document.tokens = ["Angela", "Merkel", "said"]
+    entity_object = EntityObject.get_instance("Q567")
+    match = Match(0, 2, EntityName(entity_object, "Angela Merkel", _Extraction()))
+    other_match = Match(1, 2, EntityName(entity_object, "Merkel", _Extraction()))
+    document.matches = [match]
+    document.possible_matches = [match, other_match]
+    return document
+
+class MatchIndexTest(unittest.TestCase):
+    
+    def test_index_is_rebuilt_for_new_matches(self):
+        document = create_annotated_document()
+        match_at_position, other_matches_at_position = text_output._get_match_index(document)
+        self.assertEqual(match_at_position[1][0], "Angela Merkel")
+        self.assertEqual(other_matches_at_position[1][0][0], "Merkel")
+        self.assertIs(text_output._get_match_index(document)[0], match_at_position)
+        
+        # annotated again
+        document.matches = [document.possible_matches[1]]
+        match_at_position, other_matches_at_position = text_output._get_match_index(document)
+        self.assertEqual(match_at_position, {1: ["Merkel", "PER", "Q567", "en-PER-Q5-1"]})
+        self.assertEqual(other_matches_at_position[0][0][0], "Angela Merkel")
+    
+    def test_index_is_removed_with_document(self):
+        document = create_annotated_document()
+        text_output._get_match_index(document)
+        self.assertIn(document, text_output._match_indexes)
+        
+        num_indexes = len(text_output._match_indexes)
+        del document
+        gc.collect()
+        self.assertEqual(len(text_output._match_indexes), num_indexes - 1)
+
+if __name__ == "__main__":
+    unittest.main()